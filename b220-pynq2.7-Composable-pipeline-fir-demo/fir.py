@@ -2,6 +2,9 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import functools
+from collections import namedtuple
+
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import signal
@@ -13,15 +16,68 @@ __email__ = "pynq_support@xilinx.com"
 
 fs = 44_100
 
+FrequencyResponse = namedtuple(
+    "FrequencyResponse", ["w", "h", "magnitude", "phase", "group_delay"])
+
+
+@functools.lru_cache(maxsize=None)
+def _freqz(coef, sample_rate, worN=512):
+    """ Frequency response of a coefficient set, computed once per set """
+    w, h = signal.freqz(coef, fs=sample_rate, worN=worN)
+    w.flags.writeable = False
+    h.flags.writeable = False
+    return w, h
+
+
+def freq_response(coefs, worN=512, sample_rate=None):
+    """ Frequency response of many coefficient sets in one vectorized pass
+
+    Each row of coefs is one filter. Returns a FrequencyResponse whose
+    h, magnitude (linear), phase (unwrapped, radians) and group_delay
+    (samples) are 2-D arrays with one row per filter, evaluated at the
+    same worN frequencies in Hz as signal.freqz.
+    """
+    if sample_rate is None:
+        sample_rate = fs
+    b = np.atleast_2d(np.asarray(coefs, dtype=np.float64))
+    # Oversample the FFT if a filter is longer than the FFT length
+    step = -(-b.shape[1] // (2 * worN))
+    nfft = 2 * worN * step
+    h = np.fft.rfft(b, n=nfft, axis=1)[:, :nfft // 2:step]
+    hn = np.fft.rfft(b * np.arange(b.shape[1]), n=nfft,
+                     axis=1)[:, :nfft // 2:step]
+    w = np.arange(worN) * (sample_rate / (2 * worN))
+    magnitude = np.abs(h)
+    phase = np.unwrap(np.angle(h), axis=1)
+    # Group delay is undefined where the response is zero, report 0 there
+    singular = magnitude < 10 * np.finfo(np.float64).eps * \
+        np.abs(b).sum(axis=1, keepdims=True)
+    group_delay = np.zeros(h.shape)
+    group_delay[~singular] = (hn[~singular] / h[~singular]).real
+    return FrequencyResponse(w, h, magnitude, phase, group_delay)
+
+
 class FIR:
     coef = []
     _type = ""
+    # Full precision accumulator width of the fir_compiler IP
+    # (C_ACCUM_OP_PATH_WIDTHS in overlay/fir.hwh)
+    accum_width = 48
     
     def __init__(self):
-        self.w, self.h = signal.freqz(self.coef, fs= fs)
         self.taps = len(self.coef)
         self.group_delay = (self.taps-1)//2
 
+    @property
+    def w(self):
+        """ Frequencies (Hz) of the cached frequency response """
+        return _freqz(tuple(self.coef), fs)[0]
+
+    @property
+    def h(self):
+        """ Cached complex frequency response """
+        return _freqz(tuple(self.coef), fs)[1]
+
     def plot(self):
         plt.plot(self.w, 20 * np.log10(abs(self.h)), 'b');
         plt.ylabel('Amplitude [dB]');
@@ -30,6 +86,7 @@ class FIR:
 
 class LowPassFilter(FIR):
     _type = "Lowpass Filter"
+    accum_width = 48
     coef =[-133, -375, -356, -559, -643, -731, -731, -650, -458, -153, 263,
            772, 1348, 1949, 2532, 3048, 3453, 3712, 3800, 3712, 3453, 3048,
            2532, 1949, 1348, 772, 263, -153, -458, -650, -731, -731, -643,
@@ -38,6 +95,7 @@ class LowPassFilter(FIR):
 
 class HighPassFilter(FIR):
     _type = "Highpass Filter"
+    accum_width = 49
     coef = [1136, -1197, -580, -33, 438, 658, 461, -116, -762, -1015, -565,
             480, 1532, 1774, 604, -1953, -5154, -7805, 23932, -7805, -5154,
             -1953, 604, 1774, 1532, 480, -565, -1015, -762, -116, 461, 658,
@@ -46,6 +104,7 @@ class HighPassFilter(FIR):
 
 class BandPassFilter(FIR):
     _type = "Bandpass Filter"
+    accum_width = 48
     coef = [195, 42, -82, -129, -41, -6, -269, -705, -710, 234, 1758, 2526,
             1313, -1585, -4106, -3949, -708, 3427, 5298, 3427, -708, -3949,
             -4106, -1585, 1313, 2526, 1758, 234, -710, -705, -269, -6, -41,
@@ -54,11 +113,270 @@ class BandPassFilter(FIR):
 
 class StopBandFilter(FIR):
     _type = "Stopband Filter"
+    accum_width = 49
     coef = [-1705, 2484, 232, -657, -484, 337, 1239, 1622, 1243, 449, 58, 737,
             2347, 3809, 3706, 1322, -2668, -6410, 24833, -6410, -2668, 1322,
             3706, 3809, 2347, 737, 58, 449, 1243, 1622, 1239, 337, -484, -657,
             232, 2484, -1705]
 
+_ip_filters = {
+    "fir_lowpass": LowPassFilter,
+    "fir_highpass": HighPassFilter,
+    "fir_bandpass": BandPassFilter,
+    "fir_stopband": StopBandFilter,
+}
+
+# IP data path: 32-bit signed samples in, 32 MSBs of the accumulator out
+_output_width = 32
+
+
+def _convolve_exact(x, coef, method):
+    """ Exact integer 'valid' convolution of int64 samples with coef """
+    if method == "direct":
+        return np.convolve(x, coef, "valid")
+    # Split the samples into 16-bit halves so that each FFT convolution
+    # stays well inside float64 precision and rounds back exactly
+    lo = x & 0xFFFF
+    hi = x >> 16
+    return (_overlap_save(hi, coef) << 16) + _overlap_save(lo, coef)
+
+
+def _overlap_save(x, coef, nfft=4096):
+    """ 'valid' convolution of x with coef using FFT overlap-save """
+    taps = len(coef)
+    step = nfft - taps + 1
+    n_out = len(x) - taps + 1
+    frames = -(-n_out // step)
+    padded = np.zeros((frames - 1) * step + nfft)
+    padded[:len(x)] = x
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=(frames, nfft),
+        strides=(step * padded.strides[0], padded.strides[0]))
+    y = np.fft.irfft(np.fft.rfft(windows, axis=1) *
+                     np.fft.rfft(np.asarray(coef, np.float64), nfft),
+                     nfft, axis=1)[:, taps - 1:]
+    return np.rint(y.reshape(-1)[:n_out]).astype(np.int64)
+
+
+class FIRChain:
+    """ Bit-exact software model of a chain of composable fir_* IP
+
+    Mirrors the fir_compiler configuration of the overlay: 32-bit signed
+    input, 16-bit integer coefficients, full precision accumulation and
+    the output truncated (Truncate_LSBs) to the 32 most significant bits
+    of the accumulator. Filters are given in data flow order, like the
+    list passed to compose, either as FIR objects or classes or by IP
+    name, e.g. ["fir_stopband", "fir_highpass"].
+
+    The filter history is kept between calls to process, as the IP keeps
+    it between DMA transfers; call reset to start from zero state.
+    """
+
+    def __init__(self, filters, method="auto", block_size=65_536):
+        self.filters = []
+        for f in filters:
+            if isinstance(f, str):
+                f = _ip_filters[f]
+            if isinstance(f, type):
+                f = f()
+            self.filters.append(f)
+        if method not in ("auto", "direct", "fft"):
+            raise ValueError("method must be 'auto', 'direct' or 'fft'")
+        self.method = method
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        """ Clear the filter history """
+        self._history = [np.zeros(f.taps - 1, np.int64) for f in self.filters]
+
+    def _stage(self, i, x):
+        f = self.filters[i]
+        ext = np.concatenate((self._history[i], x))
+        self._history[i] = ext[len(ext) - (f.taps - 1):]
+        method = self.method
+        if method == "auto":
+            method = "fft" if len(x) >= 8_192 else "direct"
+        acc = _convolve_exact(ext, np.asarray(f.coef, np.int64), method)
+        return acc >> (f.accum_width - _output_width)
+
+    def process(self, data):
+        """ Filter a block of int32 samples, returns an int32 array """
+        data = np.asarray(data, dtype=np.int32)
+        out = np.empty(len(data), np.int32)
+        for start in range(0, len(data), self.block_size):
+            block = data[start:start + self.block_size].astype(np.int64)
+            for i in range(len(self.filters)):
+                block = self._stage(i, block)
+            out[start:start + len(block)] = block
+        return out
+
+    @property
+    def group_delay(self):
+        """ Total group delay of the chain in samples """
+        return sum(f.group_delay for f in self.filters)
+
+
+class _MockChannel:
+    def __init__(self, dma, direction):
+        self._dma = dma
+        self._direction = direction
+        self._pending = None
+
+    @property
+    def idle(self):
+        return self._pending is None
+
+    def transfer(self, array, start=0, nbytes=0):
+        if self._pending is not None:
+            raise RuntimeError("DMA channel not idle")
+        if nbytes == 0:
+            nbytes = array.nbytes - start
+        view = array.reshape(-1).view(np.int32)[start // 4:(start + nbytes) // 4]
+        if self._direction == "send":
+            self._dma._stream.append(self._dma.chain.process(view))
+        self._pending = view
+
+    def wait(self):
+        if self._pending is None:
+            return
+        if self._direction == "recv":
+            self._dma._fill(self._pending)
+        self._pending = None
+
+
+class MockDMA:
+    """ Off-board stand-in for the axi_dma of the composed filter
+
+    sendchannel and recvchannel follow the pynq DMA channel interface
+    (transfer, wait, idle). Sent samples pass through a FIRChain, so
+    receiving returns what the composed hardware pipeline would.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self._stream = []
+        self.sendchannel = _MockChannel(self, "send")
+        self.recvchannel = _MockChannel(self, "recv")
+
+    def _fill(self, out):
+        data = np.concatenate(self._stream) if self._stream \
+            else np.empty(0, np.int32)
+        if len(data) < len(out):
+            raise RuntimeError("Receive would stall: not enough data sent")
+        out[:] = data[:len(out)]
+        self._stream = [data[len(out):]]
+
+
+def _rechunk(blocks, block_size, tail=0):
+    """ Regroup an iterable of sample blocks into block_size chunks,
+    followed by tail zero samples """
+    pending = []
+    count = 0
+    for block in blocks:
+        block = np.asarray(block, dtype=np.int32).reshape(-1)
+        pending.append(block)
+        count += len(block)
+        while count >= block_size:
+            data = np.concatenate(pending)
+            yield data[:block_size]
+            pending = [data[block_size:]]
+            count -= block_size
+    pending.append(np.zeros(tail, np.int32))
+    data = np.concatenate(pending)
+    for start in range(0, len(data), block_size):
+        yield data[start:start + block_size]
+
+
+class StreamingFilter:
+    """ Stream arbitrarily long signals through the composed filter
+
+    Samples are sent in blocks of block_size through a ring of reusable
+    DMA buffers, so memory use does not depend on the signal length.
+    While one block is being received the next one is already being
+    sent. The group delay of the composed filters is removed, and made
+    up with trailing zeros, so that output sample n corresponds to input
+    sample n across block boundaries.
+
+    Pass the DMA (ol.axi_dma, or a MockDMA off-board) and the FIR
+    objects or classes that are composed, in order. allocator defaults
+    to pynq.allocate; np.empty can be used with MockDMA.
+    """
+
+    def __init__(self, dma, filters=(), block_size=65_536, buffers=2,
+                 allocator=None, delay=None):
+        if buffers < 2:
+            raise ValueError("At least two buffers are needed")
+        if allocator is None:
+            from pynq import allocate as allocator
+        self.dma = dma
+        self.block_size = block_size
+        if delay is None:
+            delay = sum(f.group_delay if not isinstance(f, type)
+                        else f().group_delay for f in filters)
+        self.delay = delay
+        self._in = [allocator(shape=(block_size,), dtype=np.int32)
+                    for _ in range(buffers)]
+        self._out = [allocator(shape=(block_size,), dtype=np.int32)
+                     for _ in range(buffers)]
+
+    def _start(self, slot, n):
+        self.dma.recvchannel.transfer(self._out[slot], nbytes=n * 4)
+        self.dma.sendchannel.transfer(self._in[slot], nbytes=n * 4)
+
+    def _raw(self, blocks):
+        """ Yield the filter output for each chunk, including the delay """
+        chunks = _rechunk(blocks, self.block_size, self.delay)
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        slot, n = 0, len(chunk)
+        self._in[slot][:n] = chunk
+        self._start(slot, n)
+        in_flight = True
+        try:
+            while in_flight:
+                chunk = next(chunks, None)
+                nxt = (slot + 1) % len(self._in)
+                if chunk is not None:
+                    self._in[nxt][:len(chunk)] = chunk
+                self.dma.sendchannel.wait()
+                if chunk is not None:
+                    self.dma.sendchannel.transfer(self._in[nxt],
+                                                  nbytes=len(chunk) * 4)
+                self.dma.recvchannel.wait()
+                if chunk is not None:
+                    self.dma.recvchannel.transfer(self._out[nxt],
+                                                  nbytes=len(chunk) * 4)
+                else:
+                    in_flight = False
+                out = np.array(self._out[slot][:n])
+                if chunk is not None:
+                    slot, n = nxt, len(chunk)
+                yield out
+        finally:
+            if in_flight:
+                self.dma.sendchannel.wait()
+                self.dma.recvchannel.wait()
+
+    def run(self, blocks):
+        """ Generator of filtered int32 blocks for an iterable of blocks """
+        skip = self.delay
+        for out in self._raw(blocks):
+            if skip:
+                dropped = min(skip, len(out))
+                out = out[dropped:]
+                skip -= dropped
+            if len(out):
+                yield out
+
+    def close(self):
+        """ Free the DMA buffers """
+        for buf in self._in + self._out:
+            if hasattr(buf, "freebuffer"):
+                buf.freebuffer()
+
+
 class Filters:
     """ Create Filter objects """
 
@@ -104,4 +422,121 @@ def plot_fft(data):
     plt.xlabel("Frequency (Hz)", fontsize = 14);
     plt.ylabel("Amplitude", fontsize = 14);
     plt.xlim([0, 22050]);
-    plt.xticks(np.arange(0, 22050, 1000), rotation=30);
\ No newline at end of file
+    plt.xticks(np.arange(0, 22050, 1000), rotation=30);
+
+
+class SpectrumAnalyzer:
+    """ Streaming spectral analysis for long captures
+
+    Blocks of samples are split into overlapping windowed segments of
+    nperseg samples as they arrive. Each segment contributes to a
+    running Welch power spectral density estimate (matching
+    signal.welch with the same window, nperseg and overlap), and only
+    the samples needed for the next segment are kept between blocks, so
+    memory does not grow with the capture length.
+    """
+
+    def __init__(self, nperseg=4_096, overlap=0.5, window="hann",
+                 sample_rate=None):
+        self.sample_rate = fs if sample_rate is None else sample_rate
+        self.nperseg = nperseg
+        self.step = nperseg - int(nperseg * overlap)
+        self.window = signal.get_window(window, nperseg)
+        self._scale = 1.0 / (self.sample_rate * (self.window ** 2).sum())
+        self.freqs = np.fft.rfftfreq(nperseg, 1 / self.sample_rate)
+        self.reset()
+
+    def reset(self):
+        """ Discard the running estimate and any buffered samples """
+        self._buffer = np.empty(0)
+        self._psd_sum = np.zeros(len(self.freqs))
+        self.segments = 0
+
+    def update(self, block):
+        """ Add a block of samples, returns the STFT of the segments it
+        completed as a (segments, bins) complex array """
+        data = np.concatenate((self._buffer, np.asarray(block, np.float64)))
+        count = max(0, (len(data) - self.nperseg) // self.step + 1)
+        if count == 0:
+            self._buffer = data
+            return np.empty((0, len(self.freqs)), np.complex128)
+        segments = np.lib.stride_tricks.as_strided(
+            data, shape=(count, self.nperseg),
+            strides=(self.step * data.strides[0], data.strides[0]))
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spectra = np.fft.rfft(segments * self.window, axis=1)
+        psd = np.abs(spectra) ** 2 * self._scale
+        psd[:, 1:(self.nperseg + 1) // 2] *= 2
+        self._psd_sum += psd.sum(axis=0)
+        self.segments += count
+        self._buffer = data[count * self.step:]
+        return spectra
+
+    def feed(self, blocks):
+        """ Add every block from an iterable, returns self """
+        for block in blocks:
+            self.update(block)
+        return self
+
+    def stft(self, blocks):
+        """ Generator of STFT segments, one (segments, bins) array per
+        block, updating the Welch estimate on the way """
+        for block in blocks:
+            yield self.update(block)
+
+    @property
+    def psd(self):
+        """ Welch power spectral density of all samples so far """
+        if not self.segments:
+            return np.zeros(len(self.freqs))
+        return self._psd_sum / self.segments
+
+    def display(self, max_points=1_024):
+        """ PSD reduced to at most max_points bins for plotting, keeping
+        the peak of each group of bins so narrow tones stay visible """
+        psd = self.psd
+        group = -(-len(psd) // max_points)
+        if group == 1:
+            return self.freqs, psd
+        pad = -len(psd) % group
+        peaks = np.pad(psd, (0, pad)).reshape(-1, group).max(axis=1)
+        return self.freqs[::group], peaks
+
+    def band_power(self, low, high):
+        """ Power in the band [low, high) Hz """
+        band = (self.freqs >= low) & (self.freqs < high)
+        return self.psd[band].sum() * (self.freqs[1] - self.freqs[0])
+
+    def plot(self, max_points=1_024):
+        freqs, psd = self.display(max_points)
+        plt.figure(figsize=(20, 5));
+        plt.plot(freqs, 10 * np.log10(psd + np.finfo(np.float64).tiny), 'r');
+        plt.grid()
+        plt.title("Power Spectral Density", fontsize = 18);
+        plt.xlabel("Frequency (Hz)", fontsize = 14);
+        plt.ylabel("Power (dB/Hz)", fontsize = 14);
+        plt.xlim([0, self.sample_rate / 2]);
+
+
+def plot_spectrum(blocks, max_points=1_024, **kwargs):
+    """ Bounded-memory replacement of plot_fft for long captures given
+    as an iterable of blocks """
+    analyzer = SpectrumAnalyzer(**kwargs).feed(blocks)
+    analyzer.plot(max_points)
+    return analyzer
+
+
+def measure_attenuation(input_blocks, output_blocks, bands, **kwargs):
+    """ Attenuation in dB per band between the input and output of a
+    composed filter chain, both given as iterables of blocks
+
+    bands is a list of (low, high) frequency pairs in Hz. Positive values
+    mean the band is attenuated by the chain.
+    """
+    before = SpectrumAnalyzer(**kwargs).feed(input_blocks)
+    after = SpectrumAnalyzer(**kwargs).feed(output_blocks)
+    attenuation = {}
+    for low, high in bands:
+        attenuation[(low, high)] = 10 * np.log10(
+            before.band_power(low, high) / after.band_power(low, high))
+    return attenuation
@@ -0,0 +1,396 @@
+"""多颜色检测：一次查表得到所有颜色的标签图像
+
+colorDetect.ipynb对color_list中的每个颜色分别做cv2.inRange和findContours，
+而且det_color在if判断和解包时各调用一次，5个颜色就是10次整帧处理。这里：
+
+* 预先计算BGR→颜色标志位的查找表（内部按OpenCV的整数算法换算HSV，
+  与cv2.cvtColor(COLOR_BGR2HSV)的结果逐位一致），每帧一次查表得到标签图像，
+  不再需要cvtColor
+* 标签图像每个像素的第i位表示是否落在第i个颜色的HSV范围内，范围重叠时
+  （如orange和yellow在H=24处）与Notebook中各颜色独立判断的结果相同
+* 一次直方图得到每个颜色的像素总数，像素太少、不可能构成足够大色块的
+  颜色直接跳过；其余颜色用连通域分析一次得到所有色块的面积、质心和外接框
+* 直接把帧写入hdmi_out.newframe()的缓冲区并在其上标注，不再经过中间副本
+
+连通域分析和绘制优先使用cv2，没有cv2时使用scipy.ndimage和numpy。
+
+有cv2时色块的面积和质心与Notebook一样由外轮廓计算（cv2.contourArea和
+cv2.moments），中间有孔的色块按外轮廓围成的面积计算。与Notebook仍有两点
+不同：Notebook用RETR_TREE，孔的轮廓也可能被当作色块；它返回
+findContours中第一个满足条件的轮廓，这里返回面积最大的。没有cv2时面积为
+连通域的像素数，比轮廓面积大约半个周长，有孔时则小于轮廓面积，因此在
+阈值附近和有孔的色块上与Notebook的结果可能不同。
+"""
+
+import collections
+import time
+
+import numpy as np
+
+
+# 与colorDetect.ipynb中的color_list相同（HSV下限、上限）
+DEFAULT_COLORS = collections.OrderedDict([
+    ("blue", ((100, 150, 50), (130, 255, 255))),
+    ("red", ((161, 165, 111), (180, 255, 255))),
+    ("yellow", ((24, 0, 20), (39, 255, 255))),
+    ("orange", ((16, 100, 20), (24, 255, 255))),
+    ("light", ((85, 50, 20), (95, 255, 255))),
+])
+
+_HSV_SHIFT = 12
+
+Detection = collections.namedtuple(
+    "Detection", ["name", "area", "cx", "cy", "bbox", "component"])
+Detection.__doc__ = """一个色块
+
+name: 颜色名
+area: 外轮廓面积（与cv2.contourArea相同）；没有cv2时为像素数
+cx, cy: 质心坐标（整数像素）
+bbox: 外接框(x, y, w, h)
+component: 连通域标号图像中该色块的标号（用于提取轮廓）
+"""
+
+
+def _cv2():
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2
+
+
+def bgr_to_hsv(b, g, r):
+    """按OpenCV 8位RGB2HSV的整数算法换算HSV（H范围0~180）
+
+    参数:
+        b, g, r: 整数数组
+
+    返回:
+        (h, s, v)，int32数组
+    """
+    b, g, r = (np.asarray(c, dtype=np.int32) for c in (b, g, r))
+    i = np.arange(1, 256, dtype=np.float64)
+    sdiv = np.zeros(256, dtype=np.int32)
+    hdiv = np.zeros(256, dtype=np.int32)
+    sdiv[1:] = np.rint((255 << _HSV_SHIFT) / i)
+    hdiv[1:] = np.rint((180 << _HSV_SHIFT) / (6.0 * i))
+    half = 1 << (_HSV_SHIFT - 1)
+
+    v = np.maximum(np.maximum(b, g), r)
+    diff = v - np.minimum(np.minimum(b, g), r)
+    s = (diff * sdiv[v] + half) >> _HSV_SHIFT
+    h = np.where(v == r, g - b,
+                 np.where(v == g, b - r + 2 * diff, r - g + 4 * diff))
+    h = (h * hdiv[diff] + half) >> _HSV_SHIFT
+    h += np.where(h < 0, 180, 0)
+    return h, s, v
+
+
+def build_lut(colors=None):
+    """计算BGR→颜色标志位的查找表
+
+    参数:
+        colors: 有序字典，颜色名 -> (HSV下限, HSV上限)，最多8个颜色；
+            None时使用DEFAULT_COLORS
+
+    返回:
+        长度为2**24的uint8数组，下标为(b << 16) | (g << 8) | r
+    """
+    if colors is None:
+        colors = DEFAULT_COLORS
+    if len(colors) > 8:
+        raise ValueError("At most 8 colors are supported")
+    bounds = [(np.asarray(lo), np.asarray(hi)) for lo, hi in colors.values()]
+    lut = np.zeros(1 << 24, dtype=np.uint8)
+    g, r = np.divmod(np.arange(1 << 16, dtype=np.int32), 256)
+    # 按b分块计算，避免同时保存全部2**24个颜色的中间结果
+    for b in range(256):
+        h, s, v = bgr_to_hsv(b, g, r)
+        flags = np.zeros(1 << 16, dtype=np.uint8)
+        for bit, (lo, hi) in enumerate(bounds):
+            hit = (h >= lo[0]) & (h <= hi[0]) & (s >= lo[1]) & (s <= hi[1]) & \
+                (v >= lo[2]) & (v <= hi[2])
+            flags[hit] |= 1 << bit
+        lut[b << 16:(b + 1) << 16] = flags
+    return lut
+
+
+def _min_pixels(min_area):
+    """面积大于min_area的色块至少包含的像素数
+
+    有cv2时面积为外轮廓围成的面积，周长为P的轮廓最多围成P**2 / (4 * pi)，
+    轮廓上相邻像素的距离不超过sqrt(2)，因此至少需要sqrt(2 * pi * min_area)
+    个像素（例如细圆环）；没有cv2时面积就是像素数。
+    """
+    if _cv2() is None:
+        return min_area
+    return int(np.sqrt(2 * np.pi * min_area))
+
+
+def _outer_contour(cv2, labels, component, bbox):
+    """连通域的外轮廓（整幅图像坐标）"""
+    x, y, w, h = bbox
+    mask = (labels[y:y + h, x:x + w] == component).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE, offset=(x, y))
+    return max(contours, key=len)
+
+
+def _components(mask, min_area):
+    """8连通域分析，只返回面积大于min_area的连通域
+
+    有cv2时面积和质心由外轮廓计算（与Notebook中的cv2.contourArea和
+    cv2.moments相同），否则面积为像素数、质心为像素的平均坐标。
+
+    返回:
+        (标号图像, [(标号, 面积, cx, cy, (x, y, w, h)), ...])
+    """
+    cv2 = _cv2()
+    if cv2 is not None:
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            mask.view(np.uint8), connectivity=8)
+        # 轮廓经过边界像素的中心，面积不超过(w - 1) * (h - 1)
+        w, h = stats[1:, 2].astype(np.int64), stats[1:, 3].astype(np.int64)
+        blobs = []
+        for i in np.nonzero((w - 1) * (h - 1) > min_area)[0] + 1:
+            bbox = tuple(stats[i, :4])
+            contour = _outer_contour(cv2, labels, i, bbox)
+            area = cv2.contourArea(contour)
+            if area > min_area:
+                m = cv2.moments(contour)
+                blobs.append((i, area, m["m10"] / m["m00"],
+                              m["m01"] / m["m00"], bbox))
+        return labels, blobs
+
+    from scipy import ndimage
+    labels, n = ndimage.label(mask, structure=np.ones((3, 3)))
+    area = np.bincount(labels.ravel(), minlength=n + 1)
+    big = np.nonzero(area[1:] > min_area)[0] + 1
+    slices = ndimage.find_objects(labels, max_label=big.max()) if len(big) else []
+    blobs = []
+    for i in big:
+        rows, cols = slices[i - 1]
+        ys, xs = np.nonzero(labels[rows, cols] == i)
+        blobs.append((i, area[i], cols.start + xs.mean(), rows.start + ys.mean(),
+                      (cols.start, rows.start, cols.stop - cols.start,
+                       rows.stop - rows.start)))
+    return labels, blobs
+
+
+class ColorDetector:
+    """基于查找表的多颜色检测器"""
+
+    def __init__(self, colors=None, min_area=4000, lut=None, max_blobs=1):
+        """初始化
+
+        参数:
+            colors: 有序字典，颜色名 -> (HSV下限, HSV上限)；None时使用DEFAULT_COLORS
+            min_area: 色块的最小面积，与Notebook中的cv2.contourArea(c) > 4000
+                对应（没有cv2时按像素数）
+            lut: 预先计算（或用np.load读取）的查找表，None时调用build_lut计算
+            max_blobs: 每个颜色最多返回的色块数（按面积从大到小），None表示不限；
+                Notebook中每个颜色只取一个
+        """
+        self.colors = collections.OrderedDict(
+            DEFAULT_COLORS if colors is None else colors)
+        self.names = list(self.colors)
+        self.min_area = min_area
+        self.max_blobs = max_blobs
+        self.lut = build_lut(self.colors) if lut is None else lut
+        # 每个标志位组合（0~255）包含哪些颜色，用于从直方图求各颜色的像素数
+        self._members = (np.arange(256)[:, np.newaxis] >>
+                         np.arange(len(self.names)) & 1).astype(bool)
+        self._index = None
+        self._labels = None
+        self._components = {}
+
+    def save_lut(self, path):
+        """保存查找表（下次用np.load读取后作为lut参数，跳过计算）"""
+        np.save(path, self.lut)
+
+    def labels(self, frame):
+        """一次查表得到标签图像
+
+        参数:
+            frame: BGR图像（rows, cols, 3）
+
+        返回:
+            uint8标签图像，第i位对应第i个颜色（内部缓冲区，下一帧会被覆盖）
+        """
+        shape = frame.shape[:2]
+        if self._index is None or self._index.shape != shape:
+            self._index = np.empty(shape, dtype=np.uint32)
+            self._labels = np.empty(shape, dtype=np.uint8)
+        index = self._index
+        np.copyto(index, frame[..., 0])
+        index <<= 8
+        index |= frame[..., 1]
+        index <<= 8
+        index |= frame[..., 2]
+        np.take(self.lut, index, out=self._labels)
+        return self._labels
+
+    def detect(self, frame):
+        """检测所有颜色的色块
+
+        返回:
+            Detection列表，按colors的顺序，同一颜色内按面积从大到小
+        """
+        labels = self.labels(frame)
+        counts = np.bincount(labels.ravel(), minlength=256)
+        totals = counts @ self._members
+        min_pixels = _min_pixels(self.min_area)
+        detections = []
+        self._components = {}
+        for bit, name in enumerate(self.names):
+            if totals[bit] < min_pixels:
+                continue
+            components, blobs = _components(
+                (labels & (1 << bit)).astype(bool), self.min_area)
+            self._components[name] = components
+            blobs.sort(key=lambda blob: blob[1], reverse=True)
+            for i, area, cx, cy, bbox in blobs[:self.max_blobs]:
+                detections.append(Detection(
+                    name, int(area), int(cx), int(cy),
+                    tuple(int(v) for v in bbox), int(i)))
+        return detections
+
+    def contour(self, detection):
+        """检测到的色块的外轮廓（坐标为整幅图像坐标）
+
+        格式与cv2.findContours相同（形状为(N, 1, 2)的int32数组）；没有cv2时
+        返回外接框的四个顶点，与annotate的后备画法一致。
+        """
+        cv2 = _cv2()
+        x, y, w, h = detection.bbox
+        if cv2 is None:
+            return np.array([[[x, y]], [[x + w - 1, y]],
+                             [[x + w - 1, y + h - 1]], [[x, y + h - 1]]],
+                            dtype=np.int32)
+        return _outer_contour(cv2, self._components[detection.name],
+                              detection.component, detection.bbox)
+
+    def annotate(self, frame, detections, color=(255, 255, 255)):
+        """在帧上标注色块（与Notebook相同：轮廓、质心和颜色名）
+
+        没有cv2时只画外接框和质心。
+        """
+        cv2 = _cv2()
+        for d in detections:
+            if cv2 is not None:
+                cv2.drawContours(frame, [self.contour(d)], -1, color, 3)
+                cv2.circle(frame, (d.cx, d.cy), 7, color, -1)
+                cv2.putText(frame, d.name, (d.cx, d.cy),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, color, 1)
+            else:
+                x, y, w, h = d.bbox
+                frame[y:y + h, [x, x + w - 1]] = color
+                frame[[y, y + h - 1], x:x + w] = color
+                frame[max(d.cy - 3, 0):d.cy + 4, max(d.cx - 3, 0):d.cx + 4] = color
+        return frame
+
+    def process(self, source, hdmi_out, color=(255, 255, 255)):
+        """检测一帧、标注并输出到HDMI
+
+        帧直接写入hdmi_out.newframe()的缓冲区，检测在标注之前完成，
+        标注直接画在输出缓冲区上。
+
+        参数:
+            source: BGR图像，或函数source(buffer)（如lambda buf: videoIn.read(buf)），
+                由它把帧直接读入输出缓冲区
+            hdmi_out: base.video.hdmi_out
+
+        返回:
+            Detection列表
+        """
+        out = hdmi_out.newframe()
+        if callable(source):
+            source(out)
+        else:
+            out[:] = source
+        detections = self.detect(out)
+        self.annotate(out, detections, color)
+        hdmi_out.writeframe(out)
+        return detections
+
+
+class MockHDMIOut:
+    """模拟的hdmi_out，用于无板卡测试"""
+
+    def __init__(self, width=640, height=480):
+        self.shape = (height, width, 3)
+        self.frames = 0
+        self.last = None
+
+    def newframe(self):
+        return np.empty(self.shape, dtype=np.uint8)
+
+    def writeframe(self, frame):
+        self.frames += 1
+        self.last = frame
+
+
+def make_test_frame(width=640, height=480, seed=0):
+    """生成带几个纯色矩形的BGR测试帧（背景为低饱和度噪声）"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(90, 110, (height, width, 3), dtype=np.uint8)
+    for (x, y), bgr in zip([(40, 40), (300, 60), (120, 280), (420, 300)],
+                           [(200, 60, 20), (60, 20, 220), (20, 220, 220),
+                            (200, 200, 40)]):
+        frame[y:y + 120, x:x + 150] = bgr
+    return frame
+
+
+def _notebook_detect(frame, colors, min_area):
+    """Notebook中的做法（每个颜色调用两次det_color），用于比较"""
+    cv2 = _cv2()
+    if cv2 is not None:
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    else:
+        hsv = np.stack(bgr_to_hsv(frame[..., 0], frame[..., 1],
+                                  frame[..., 2]), axis=-1)
+
+    def det_color(points):
+        lo, hi = (np.asarray(p, dtype=np.uint8) for p in points)
+        if cv2 is not None:
+            mask = cv2.inRange(hsv, lo, hi)
+        else:
+            mask = ((hsv >= lo) & (hsv <= hi)).all(axis=-1)
+        _, blobs = _components(mask, min_area)
+        for i, area, cx, cy, bbox in blobs:
+            return i, int(cx), int(cy)
+
+    found = []
+    for name, points in colors.items():
+        if det_color(points):
+            found.append((name,) + det_color(points)[1:])
+    return found
+
+
+def benchmark_detect(frames=50, width=640, height=480):
+    """比较Notebook的逐颜色检测与查表检测的帧率
+
+    两种方式都包括换算/查表和连通域分析；查表方式还包括写入输出缓冲区和
+    标注。查找表的计算时间单独报告（只需计算一次）。
+
+    返回:
+        字典，lut_build_seconds、notebook_fps、detector_fps和检测结果
+    """
+    frame = make_test_frame(width, height)
+    start = time.perf_counter()
+    detector = ColorDetector()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        _notebook_detect(frame, detector.colors, detector.min_area)
+    notebook = frames / (time.perf_counter() - start)
+
+    hdmi_out = MockHDMIOut(width, height)
+    start = time.perf_counter()
+    for _ in range(frames):
+        detections = detector.process(frame, hdmi_out)
+    lut = frames / (time.perf_counter() - start)
+    return {"lut_build_seconds": build, "notebook_fps": notebook,
+            "detector_fps": lut,
+            "detections": [(d.name, d.area, d.cx, d.cy) for d in detections]}
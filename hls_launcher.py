@@ -0,0 +1,478 @@
+"""HLS内核的预编译寄存器写入与启动
+
+axi2stream、pynq_awb、threshhold_stream等Notebook逐个属性设置内核参数
+（tpg.register_map.image_r_1 = ...、awb.register_map.thresh = ...），再设置
+CTRL.AP_START并手动查询AP_DONE。每次属性赋值都要按名字找到寄存器并做一次
+读-改-写。这里把内核的寄存器描述（ip_dict中的registers）编译一次，得到
+每个参数的偏移和打包格式：
+
+* 所有参数先打包到内存中的影子块，再对连续的参数区间做一次块写入，
+  然后单独写CTRL启动内核
+* 64位参数（xclbin中的指针，或hwh中拆成name_1/name_2的两个寄存器）、
+  float/double参数和Memory_*数组参数按类型打包
+* 完成时先短暂查询，再按有界指数退避睡眠等待；异步等待时使用IP的中断
+* SimulatedRegisterFile模拟HLS的控制寄存器和参数寄存器，用于无板卡测试
+"""
+
+import asyncio
+import struct
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+
+CTRL_OFFSET = 0x00
+GIER_OFFSET = 0x04
+IP_IER_OFFSET = 0x08
+IP_ISR_OFFSET = 0x0C
+
+AP_START = 0x01
+AP_DONE = 0x02
+AP_IDLE = 0x04
+AP_READY = 0x08
+
+_CONTROL_REGISTERS = ("CTRL", "GIER", "IP_IER", "IP_ISR")
+
+# 与pynq.overlay._struct_dict相同的C类型到struct格式的对应
+_STRUCT_FORMATS = {
+    "char": "b", "signed char": "b", "unsigned char": "B",
+    "short": "h", "unsigned short": "H", "int": "i", "unsigned int": "I",
+    "long int": "l", "long unsigned int": "L",
+    "long long int": "q", "long long unsigned int": "Q",
+    "float": "f", "double": "d", "long": "l", "uint": "I", "ushort": "H",
+}
+
+
+class KernelTimeoutError(Exception):
+    pass
+
+
+def registers_from_hwh(path, instance):
+    """从.hwh文件读取一个IP的寄存器描述（格式与ip_dict中的registers相同）
+
+    参数:
+        path: .hwh文件路径
+        instance: IP实例名，如colorthresholding_ac_0
+    """
+    tree = ElementTree.parse(path)
+    for module in tree.iter("MODULE"):
+        if module.get("INSTANCE") != instance:
+            continue
+        registers = {}
+        for register in module.iter("REGISTER"):
+            props = {p.get("NAME"): p.get("VALUE")
+                     for p in register.findall("PROPERTY")}
+            fields = {}
+            for field in register.iter("FIELD"):
+                fprops = {p.get("NAME"): p.get("VALUE")
+                          for p in field.findall("PROPERTY")}
+                fields[field.get("NAME")] = {
+                    "bit_offset": int(fprops["BIT_OFFSET"], 0),
+                    "bit_width": int(fprops["BIT_WIDTH"], 0),
+                    "access": fprops.get("ACCESS", "read-write"),
+                    "description": fprops.get("DESCRIPTION", ""),
+                }
+            registers[register.get("NAME")] = {
+                "address_offset": int(props["ADDRESS_OFFSET"], 0),
+                "size": int(props["SIZE"], 0),
+                "access": props.get("ACCESS", "read-write"),
+                "description": props.get("DESCRIPTION", ""),
+                "fields": fields,
+            }
+        return registers
+    raise ValueError("{} not found in {}".format(instance, path))
+
+
+def _format(register):
+    ctype = register.get("type")
+    if ctype is not None:
+        if "*" in ctype:
+            return "<Q"
+        ctype = ctype.replace("const", "").strip()
+        if ctype in _STRUCT_FORMATS:
+            return "<" + _STRUCT_FORMATS[ctype]
+    return "<I" if register["size"] <= 32 else "<Q"
+
+
+class RegisterPlan:
+    """编译后的寄存器写入方案
+
+    属性:
+        args: 字典，参数名 -> (块内字节偏移, struct格式或数组字节数)
+        outputs: 字典，输出寄存器名 -> (寄存器偏移, struct格式)
+        runs: 块写入区间列表[(寄存器字偏移, 块内字偏移, 字数)]
+        base: 影子块起始的寄存器偏移
+    """
+
+    def __init__(self, registers):
+        """编译寄存器描述
+
+        参数:
+            registers: ip_dict中IP的registers（或registers_from_hwh的结果）
+        """
+        args = {}
+        outputs = {}
+        occupied = set()
+        for name, reg in registers.items():
+            offset = reg["address_offset"]
+            access = reg.get("access", "read-write")
+            if name in _CONTROL_REGISTERS:
+                continue
+            if name.startswith("Memory_"):
+                # hwh中数组参数的SIZE为字节数
+                args[name[len("Memory_"):]] = (offset, int(reg["size"]))
+            elif access.startswith("read-only") or name.endswith("_ctrl"):
+                outputs[name] = (offset, _format(reg))
+                occupied.add(offset >> 2)
+            else:
+                args[name] = (offset, _format(reg))
+        # hwh把64位参数拆成name_1（低32位）和name_2（高32位）
+        for name in [n for n in args if n.endswith("_1")]:
+            base, high = name[:-2], name[:-2] + "_2"
+            if high in args and base not in args and \
+                    args[high][0] == args[name][0] + 4:
+                args[base] = (args.pop(name)[0], "<Q")
+                del args[high]
+        if not args:
+            raise ValueError("Kernel has no argument registers")
+
+        spans = sorted((offset, self._size(spec)) for offset, spec in args.values())
+        self.base = spans[0][0] & ~3
+        end = max(offset + size for offset, size in spans)
+        self.words = (end - self.base + 3) >> 2
+        self.args = {name: (offset - self.base, spec)
+                     for name, (offset, spec) in args.items()}
+        self.outputs = outputs
+        # 合并相邻参数为尽量少的块写入区间；区间不能跨过输出寄存器
+        runs = []
+        for offset, size in spans:
+            first = (offset - self.base) >> 2
+            last = (offset - self.base + size - 1) >> 2
+            gap = range((self.base >> 2) + (runs[-1][1] if runs else 0),
+                        (self.base >> 2) + first)
+            if runs and not occupied.intersection(gap):
+                runs[-1][1] = max(runs[-1][1], last + 1)
+            else:
+                runs.append([first, last + 1])
+        self.runs = [((self.base >> 2) + a, a, b - a) for a, b in runs]
+
+    @staticmethod
+    def _size(spec):
+        return spec if isinstance(spec, int) else struct.calcsize(spec)
+
+    def pack(self, shadow, values):
+        """把参数打包到影子块（uint32数组）"""
+        raw = shadow.view(np.uint8)
+        for name, value in values.items():
+            try:
+                offset, spec = self.args[name]
+            except KeyError:
+                raise TypeError(
+                    "Unknown kernel argument {}".format(name)) from None
+            if isinstance(spec, int):
+                data = np.atleast_1d(np.asarray(value))
+                data = data.view(np.uint8).reshape(-1) if data.dtype != bool \
+                    else data.astype(np.uint8).reshape(-1)
+                if len(data) > spec:
+                    raise ValueError("{} holds at most {} bytes".format(name, spec))
+                raw[offset:offset + spec] = 0
+                raw[offset:offset + len(data)] = data
+            else:
+                if hasattr(value, "physical_address"):
+                    value = value.physical_address
+                if spec[-1] in "bhilqBHILQ":
+                    value = int(value)
+                    if spec[-1] in "BHILQ":
+                        value &= (1 << (8 * struct.calcsize(spec))) - 1
+                struct.pack_into(spec, raw, offset, value)
+
+
+class KernelLauncher:
+    """用编译后的写入方案设置参数并启动HLS内核"""
+
+    def __init__(self, ip, registers=None, mmio=None, interrupt=None,
+                 spin=20, poll_interval=(20e-6, 1e-3), timeout=1.0):
+        """初始化
+
+        参数:
+            ip: pynq IP对象（如ol.colorthresholding_ac_0），或None（此时须给出
+                registers和mmio）
+            registers: 寄存器描述，None时使用ip的registers
+                （ip._registers，即ip_dict中的registers）
+            mmio: 寄存器空间，None时使用ip.mmio
+            interrupt: 完成中断，None时使用ip.interrupt（HLS IP的interrupt
+                引脚连接到中断控制器时存在）
+            spin: wait中先连续查询的次数（短内核在这期间即可完成）
+            poll_interval: 之后睡眠间隔的(最短, 最长)值（秒），每次加倍
+            timeout: 内核的最长执行时间（秒）
+        """
+        if registers is None:
+            registers = ip._registers
+        self.mmio = mmio if mmio is not None else ip.mmio
+        self.interrupt = interrupt if interrupt is not None \
+            else getattr(ip, "interrupt", None)
+        self.plan = RegisterPlan(registers)
+        self._shadow = np.zeros(self.plan.words, dtype=np.uint32)
+        self.spin = spin
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._interrupt_enabled = False
+        self.launches = 0
+
+    @property
+    def args(self):
+        """参数名列表"""
+        return list(self.plan.args)
+
+    def set(self, **values):
+        """只更新影子块中的参数（下次start时写入）"""
+        self.plan.pack(self._shadow, values)
+
+    def write(self, **values):
+        """更新参数并块写入寄存器（不启动内核）"""
+        self.plan.pack(self._shadow, values)
+        array = self.mmio.array
+        for start, first, count in self.plan.runs:
+            array[start:start + count] = self._shadow[first:first + count]
+
+    def start(self, **values):
+        """写入参数并启动内核（未给出的参数保持上次的值）"""
+        self.write(**values)
+        self.mmio.write(CTRL_OFFSET, AP_START)
+        self.launches += 1
+
+    def done(self):
+        """内核是否已完成（AP_DONE或AP_IDLE）"""
+        return bool(self.mmio.read(CTRL_OFFSET) & (AP_DONE | AP_IDLE))
+
+    def wait(self, timeout=None):
+        """等待内核完成：先查询spin次，再按有界指数退避睡眠"""
+        deadline = time.perf_counter() + (timeout or self.timeout)
+        for _ in range(self.spin):
+            if self.done():
+                return
+        delay, max_delay = self.poll_interval
+        while not self.done():
+            if time.perf_counter() > deadline:
+                raise KernelTimeoutError("HLS kernel did not finish")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def _enable_interrupt(self):
+        if not self._interrupt_enabled:
+            self.mmio.write(GIER_OFFSET, 1)
+            self.mmio.write(IP_IER_OFFSET, 1)    # ap_done
+            self._interrupt_enabled = True
+
+    async def wait_async(self, timeout=None):
+        """在事件循环中等待内核完成（有中断时由中断唤醒）"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        delay, max_delay = self.poll_interval
+        while not self.done():
+            if loop.time() > deadline:
+                raise KernelTimeoutError("HLS kernel did not finish")
+            if self.interrupt is not None:
+                try:
+                    await asyncio.wait_for(self.interrupt.wait(), max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        if self.interrupt is not None:
+            self.mmio.write(IP_ISR_OFFSET, 1)    # 写1清除ap_done中断状态
+
+    def run(self, **values):
+        """写入参数、启动内核并等待完成"""
+        self.start(**values)
+        self.wait()
+
+    async def run_async(self, **values):
+        if self.interrupt is not None:
+            self._enable_interrupt()
+        self.start(**values)
+        await self.wait_async()
+
+    def read(self, name):
+        """读取输出寄存器（如hls_adder的out_r）"""
+        offset, fmt = self.plan.outputs[name]
+        words = self.mmio.array[offset >> 2:(offset + struct.calcsize(fmt) + 3) >> 2]
+        return struct.unpack_from(fmt, words.tobytes())[0]
+
+
+class _RegisterArray(np.ndarray):
+    """模拟寄存器空间的数组：读写控制寄存器时通知SimulatedRegisterFile
+
+    pynq的RegisterMap和Register直接读写mmio.array的切片视图，这里通过视图
+    的数据地址计算其在寄存器空间中的位置。
+    """
+
+    def __array_finalize__(self, obj):
+        self._owner = getattr(obj, "_owner", None)
+
+    def _covers_ctrl(self, key):
+        owner = self._owner
+        if owner is None:
+            return False
+        if self.__array_interface__["data"][0] != owner._address:
+            return False
+        if isinstance(key, slice):
+            return not key.start
+        return isinstance(key, (int, np.integer)) and key == 0
+
+    def __getitem__(self, key):
+        ctrl = self._covers_ctrl(key)
+        if ctrl:
+            self._owner._service()
+        value = super().__getitem__(key)
+        if ctrl:
+            self._owner._read_ctrl()
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self._covers_ctrl(key):
+            self._owner._write_ctrl()
+
+
+class SimulatedRegisterFile:
+    """模拟的HLS内核寄存器空间（提供mmio的read、write和array）
+
+    写CTRL的AP_START后，内核在latency秒后完成：调用kernel，置AP_DONE
+    （读后清除）和AP_IDLE；使能了中断时置IP_ISR。
+    """
+
+    def __init__(self, registers, kernel=None, latency=0.0, size=0x10000):
+        """初始化
+
+        参数:
+            registers: 寄存器描述
+            kernel: 函数kernel(regs)，内核完成时调用；regs为本对象，可用value(name)
+                读取参数寄存器、用array写入输出寄存器
+            latency: 内核执行时间（秒）
+            size: 寄存器空间大小（字节）
+        """
+        self.registers = registers
+        self.kernel = kernel
+        self.latency = latency
+        self.array = np.zeros(size // 4, dtype=np.uint32).view(_RegisterArray)
+        self._address = self.array.__array_interface__["data"][0]
+        self.array._owner = self
+        np.ndarray.__setitem__(self.array, 0, AP_IDLE)
+        self._done_at = None
+        self.runs = 0
+
+    def value(self, name):
+        """按寄存器描述读取一个寄存器的原始值（64位寄存器读两个字）"""
+        reg = self.registers[name]
+        words = np.asarray(self.array).view(np.uint32)
+        index = reg["address_offset"] >> 2
+        if reg["size"] > 32 and not name.startswith("Memory_"):
+            return int(words[index]) | int(words[index + 1]) << 32
+        return int(words[index])
+
+    def _raw_ctrl(self):
+        return int(np.ndarray.__getitem__(self.array, 0))
+
+    def _set_ctrl(self, value):
+        np.ndarray.__setitem__(self.array, 0, value)
+
+    def _write_ctrl(self):
+        ctrl = self._raw_ctrl()
+        if ctrl & AP_START and self._done_at is None:
+            self._done_at = time.perf_counter() + self.latency
+            self._set_ctrl(ctrl & ~(AP_IDLE | AP_DONE))
+
+    def _service(self):
+        if self._done_at is None or time.perf_counter() < self._done_at:
+            return
+        self._done_at = None
+        if self.kernel is not None:
+            self.kernel(self)
+        self.runs += 1
+        self._set_ctrl((self._raw_ctrl() & ~AP_START) | AP_DONE | AP_IDLE |
+                       AP_READY)
+        words = np.asarray(self.array).view(np.uint32)
+        if words[GIER_OFFSET >> 2] & 1 and words[IP_IER_OFFSET >> 2] & 1:
+            words[IP_ISR_OFFSET >> 2] |= 1
+
+    def _read_ctrl(self):
+        # AP_DONE读后清除
+        self._set_ctrl(self._raw_ctrl() & ~AP_DONE)
+
+    def read(self, offset=0, length=4):
+        return int(self.array[offset >> 2])
+
+    def write(self, offset, value):
+        if offset == IP_ISR_OFFSET:
+            # 写1翻转（清除）中断状态
+            words = np.asarray(self.array).view(np.uint32)
+            words[offset >> 2] ^= value
+            return
+        self.array[offset >> 2] = value
+
+
+def _register_map_launch(register_map, values):
+    """Notebook中的做法：逐个属性赋值、设置AP_START并查询AP_DONE"""
+    for name, value in values.items():
+        setattr(register_map, name, value)
+    register_map.CTRL.AP_START = 1
+    while not register_map.CTRL.AP_DONE:
+        pass
+
+
+def benchmark_launcher(launches=2000, registers=None, values=None):
+    """比较register_map逐属性赋值与预编译块写入的启动速率
+
+    默认使用仓库中kern_threshhold.hwh的colorthresholding_ac_0寄存器描述，
+    参数与threshhold_stream.ipynb相同。register_map方式需要pynq.registers，
+    不可用时只测量预编译方式。
+
+    返回:
+        字典，每秒启动次数（包括写参数、启动和等待完成）
+    """
+    import os
+
+    if registers is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "vision-lib-stream-thresholding", "overlay",
+                            "kern_threshhold.hwh")
+        registers = registers_from_hwh(path, "colorthresholding_ac_0")
+    if values is None:
+        values = {"rows": 1080, "cols": 1920,
+                  "Memory_lower_threshold": np.array(
+                      [136, 87, 111, 25, 52, 72, 94, 80, 2], np.uint8),
+                  "Memory_upper_threshold": np.array(
+                      [180, 255, 255, 102, 255, 255, 120, 255, 255], np.uint8)}
+    results = {}
+
+    try:
+        from pynq.registers import RegisterMap
+    except ImportError:
+        RegisterMap = None
+    if RegisterMap is not None:
+        regfile = SimulatedRegisterFile(registers)
+        register_map = RegisterMap.create_subclass("kernel", registers)(
+            regfile.array)
+        # register_map的每个Memory_*属性只对应一个32位字
+        words = {name: int(np.resize(value, 4).view(np.uint32)[0])
+                 if name.startswith("Memory_") else value
+                 for name, value in values.items()}
+        start = time.perf_counter()
+        for _ in range(launches):
+            _register_map_launch(register_map, words)
+        results["register_map_per_second"] = \
+            launches / (time.perf_counter() - start)
+
+    regfile = SimulatedRegisterFile(registers)
+    launcher = KernelLauncher(None, registers, mmio=regfile)
+    compiled = {name[len("Memory_"):] if name.startswith("Memory_") else name:
+                value for name, value in values.items()}
+    start = time.perf_counter()
+    for _ in range(launches):
+        launcher.run(**compiled)
+    results["launcher_per_second"] = launches / (time.perf_counter() - start)
+    results["block_writes_per_launch"] = len(launcher.plan.runs)
+    return results
@@ -0,0 +1,289 @@
+"""雷达数据端口的录制与回放
+
+录制文件格式（小端）::
+
+    文件头  FILE_HEADER（64字节）：魔术字、版本、帧数、索引偏移、创建时间
+    帧记录  RECORD_HEADER（长度、时间戳）+ 原始数据端口帧字节，顺序追加
+    索引    INDEX_DTYPE数组（偏移、长度、时间戳），close时写在文件末尾
+
+录制过程中只做顺序追加和批量写入；索引在close时一次写入并回填到文件头。
+文件未正常关闭（索引偏移为0）时，读取端按帧记录头扫描重建索引。
+"""
+
+import mmap
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+CAPTURE_MAGIC = b"IWRCAP\x00\x01"
+CAPTURE_VERSION = 1
+# 魔术字、版本、帧数、索引偏移、创建时间（Unix秒），补齐到64字节
+FILE_HEADER = struct.Struct("<8sI4xQQd24x")
+RECORD_HEADER = struct.Struct("<I4xd")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"),
+                        ("timestamp", "<f8")], align=True)
+
+
+class CaptureWriter:
+    """录制文件写入器
+
+    write可以在采集线程中直接调用：帧先追加到内存缓冲区，缓冲区满时一次写入
+    文件，索引只保存在内存中的列表里。也可以把写入器作为TLVParser的recorder，
+    解析器会把每个完整帧的原始字节交给它。
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        """创建录制文件
+
+        参数:
+            path: 文件路径（已存在时覆盖）
+            buffer_size: 写缓冲区大小（字节）
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = open(path, "wb")
+        self._created = time.time()
+        self._file.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, 0,
+                                          0, self._created))
+        self._offset = FILE_HEADER.size
+        self._buffer = bytearray()
+        self._index = []
+        self._lock = threading.Lock()
+
+    def write(self, frame, timestamp=None):
+        """追加一帧原始数据
+
+        参数:
+            frame: 帧字节（bytes、bytearray或memoryview）
+            timestamp: 接收时间（Unix秒），None表示当前时间
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        length = len(frame)
+        with self._lock:
+            if self._file is None:
+                raise RuntimeError("Capture file is closed")
+            self._index.append((self._offset + RECORD_HEADER.size, length,
+                                timestamp))
+            self._buffer += RECORD_HEADER.pack(length, timestamp)
+            self._buffer += frame
+            self._offset += RECORD_HEADER.size + length
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def _flush(self):
+        self._file.write(self._buffer)
+        del self._buffer[:]
+
+    def flush(self):
+        """把缓冲区中的帧写入文件"""
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.flush()
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        """写入索引并回填文件头"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            index = np.array(self._index, dtype=INDEX_DTYPE)
+            self._file.write(index.tobytes())
+            self._file.seek(0)
+            self._file.write(FILE_HEADER.pack(
+                CAPTURE_MAGIC, CAPTURE_VERSION, len(index), self._offset,
+                self._created))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """录制文件读取器
+
+    文件通过mmap映射，按帧号随机访问时不读取其他帧。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset, self.created = \
+            FILE_HEADER.unpack_from(self._mmap)
+        if magic != CAPTURE_MAGIC:
+            raise RuntimeError("{} is not a radar capture file".format(path))
+        if version != CAPTURE_VERSION:
+            raise RuntimeError(
+                "Unsupported capture file version {}".format(version))
+        if index_offset:
+            self.index = np.frombuffer(self._mmap, INDEX_DTYPE, count,
+                                       index_offset)
+        else:
+            self.index = self._scan()
+        self.recovered = not index_offset
+
+    def _scan(self):
+        """按帧记录头重建索引（文件未正常关闭时）"""
+        records = []
+        offset = FILE_HEADER.size
+        size = len(self._mmap)
+        while offset + RECORD_HEADER.size <= size:
+            length, timestamp = RECORD_HEADER.unpack_from(self._mmap, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                break
+            records.append((offset, length, timestamp))
+            offset += length
+        return np.array(records, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """第i帧的原始字节（memoryview，指向映射的文件）"""
+        offset, length, _ = self.index[i].tolist()
+        return memoryview(self._mmap)[offset:offset + length]
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    @property
+    def duration(self):
+        """录制时长（秒）"""
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self) else 0.0
+
+    def close(self):
+        self.index = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplaySource:
+    """把录制文件按原始节奏回放为串口数据源
+
+    提供与pyserial相同的in_waiting和read(size)，可以直接替换
+    IWR6843AOP_Serial中的ser对象或送入TLVParser，在没有雷达的情况下
+    测试和分析整条处理链路。
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, timeout=0.5):
+        """打开录制文件
+
+        参数:
+            path: 录制文件路径
+            speed: 回放速度倍数，None或0表示不限速
+            loop: 回放到文件尾后是否从头循环
+            timeout: read在没有数据时最长等待的时间（秒），与串口超时一致，
+                None表示一直等待到读满size字节或回放结束
+        """
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.timeout = timeout
+        self.is_open = True
+        self._times = self.reader.timestamps - (
+            self.reader.timestamps[0] if len(self.reader) else 0)
+        self._frame = 0
+        self._pos = 0
+        self._start = None
+        self.frames_replayed = 0
+
+    def _released(self):
+        """按回放时钟已经"到达"的帧数"""
+        if not self.speed:
+            return len(self.reader)
+        if self._start is None:
+            self._start = time.perf_counter()
+        elapsed = (time.perf_counter() - self._start) * self.speed
+        return int(np.searchsorted(self._times, elapsed, side="right"))
+
+    def _rewind(self):
+        if self.loop and self._frame >= len(self.reader) and len(self.reader):
+            self._frame = 0
+            self._pos = 0
+            self._start = None
+
+    @property
+    def in_waiting(self):
+        self._rewind()
+        released = self._released()
+        if self._frame >= released:
+            return 0
+        lengths = self.reader.index["length"][self._frame:released]
+        return int(lengths.sum()) - self._pos
+
+    def _wait(self, deadline):
+        """等待数据到达，deadline为None时一直等待
+
+        返回:
+            True: 有可读的数据
+            False: 超时，或回放已结束（不循环）
+        """
+        while not self.in_waiting:
+            if self._frame >= len(self.reader) and \
+                    (not self.loop or not len(self.reader)):
+                return False
+            if deadline is None:
+                time.sleep(0.005)
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, 0.005))
+        return True
+
+    def _read_released(self, size):
+        """读取最多size字节已到达的数据"""
+        released = self._released()
+        out = bytearray()
+        while len(out) < size and self._frame < released:
+            frame = self.reader[self._frame]
+            chunk = frame[self._pos:self._pos + size - len(out)]
+            out += chunk
+            self._pos += len(chunk)
+            if self._pos == len(frame):
+                self._frame += 1
+                self._pos = 0
+                self.frames_replayed += 1
+        return bytes(out)
+
+    def read(self, size=1):
+        """读取最多size字节
+
+        与pyserial相同：timeout为None时一直等待到读满size字节，回放结束
+        （不循环）时返回已读到的数据；否则没有已到达的数据时最多等待timeout
+        秒，返回已到达的数据。
+        """
+        if self.timeout is not None:
+            if not self._wait(time.perf_counter() + self.timeout):
+                return b""
+            return self._read_released(size)
+        out = bytearray()
+        while len(out) < size and self._wait(None):
+            out += self._read_released(size - len(out))
+        return bytes(out)
+
+    def read_all(self):
+        return self.read(self.in_waiting)
+
+    def close(self):
+        self.is_open = False
+        self.reader.close()
@@ -0,0 +1,293 @@
+"""IWR6843AOP数据端口TLV帧解析（mmWave SDK 3.x out-of-box demo格式）
+
+串口数据追加到可增量填充的bytearray缓冲区中，用bytes.find搜索魔术字，
+帧头和各TLV用np.frombuffer按结构化dtype一次解码，结果写入预分配的数组，
+解析过程中没有逐字节或逐点的Python循环。
+"""
+
+import collections
+import time
+
+import numpy as np
+
+
+MAGIC_WORD = bytes([2, 1, 4, 3, 6, 5, 8, 7])
+# 帧长度上限，超过时认为是误同步
+MAX_PACKET_LEN = 1 << 20
+
+# 帧头：魔术字之后的8个uint32
+FRAME_HEADER_DTYPE = np.dtype([
+    ("magic", "<u8"), ("version", "<u4"), ("total_packet_len", "<u4"),
+    ("platform", "<u4"), ("frame_number", "<u4"), ("time_cpu_cycles", "<u4"),
+    ("num_detected_obj", "<u4"), ("num_tlvs", "<u4"),
+    ("sub_frame_number", "<u4")])
+TLV_HEADER_DTYPE = np.dtype([("type", "<u4"), ("length", "<u4")])
+
+# TLV类型
+TLV_DETECTED_POINTS = 1
+TLV_RANGE_PROFILE = 2
+TLV_NOISE_PROFILE = 3
+TLV_STATS = 6
+TLV_SIDE_INFO = 7
+
+_RAW_POINT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                             ("velocity", "<f4")])
+_SIDE_INFO_DTYPE = np.dtype([("snr", "<i2"), ("noise", "<i2")])
+STATS_DTYPE = np.dtype([
+    ("inter_frame_processing_time", "<u4"), ("transmit_output_time", "<u4"),
+    ("inter_frame_processing_margin", "<u4"),
+    ("inter_chirp_processing_margin", "<u4"),
+    ("active_frame_cpu_load", "<u4"), ("inter_frame_cpu_load", "<u4")])
+
+# 解析后的点云：笛卡尔坐标（米）、径向速度（米/秒）、距离（米）、
+# 方位角（弧度）、信噪比和噪声（分贝）
+POINT_DTYPE = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("velocity", "<f4"),
+    ("range", "<f4"), ("azimuth", "<f4"), ("snr", "<f4"), ("noise", "<f4")])
+
+RadarFrame = collections.namedtuple(
+    "RadarFrame", ["header", "points", "range_profile", "noise_profile",
+                   "stats"])
+RadarFrame.__doc__ = """一帧解析结果
+
+header为帧头结构化标量，其余字段为预分配数组的视图（帧中没有对应TLV时为
+长度0的视图或None），在解析下一帧时会被覆盖，需要保留时请调用copy_frame。
+"""
+
+
+def copy_frame(frame):
+    """复制一帧解析结果，使其不再引用解析器的预分配数组"""
+    return RadarFrame(*(None if f is None else f.copy() for f in frame))
+
+
+class TLVParser:
+    """增量TLV帧解析器
+
+    典型用法::
+
+        parser = TLVParser()
+        while True:
+            parser.feed(ser.read(ser.in_waiting or 1))
+            for frame in parser.frames():
+                ...
+    """
+
+    def __init__(self, max_points=1024, max_range_bins=1024,
+                 buffer_size=1 << 16, recorder=None):
+        """初始化解析器
+
+        参数:
+            max_points: 每帧最大点数（预分配点云数组的长度）
+            max_range_bins: 最大距离单元数（预分配距离剖面数组的长度）
+            buffer_size: 接收缓冲区的初始大小（字节），帧更大时自动扩展
+            recorder: 提供write(frame)的录制器（如CaptureWriter），
+                每个完整帧的原始字节在解码前交给它
+        """
+        self.recorder = recorder
+        self._buf = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+        self._points = np.zeros(max_points, dtype=POINT_DTYPE)
+        self._range_profile = np.zeros(max_range_bins, dtype=np.float32)
+        self._noise_profile = np.zeros(max_range_bins, dtype=np.float32)
+        self._stats = np.zeros((), dtype=STATS_DTYPE)
+        self.frames_parsed = 0
+        self.bytes_received = 0
+        self.bytes_skipped = 0
+        self.bad_frames = 0
+
+    def feed(self, data):
+        """追加串口收到的数据"""
+        n = len(data)
+        if self._end + n > len(self._buf):
+            # 先把未解析的数据移到缓冲区开头，仍不够时扩展缓冲区
+            pending = self._end - self._start
+            if pending + n > len(self._buf):
+                self._buf.extend(bytes(pending + n - len(self._buf)))
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        self._buf[self._end:self._end + n] = data
+        self._end += n
+        self.bytes_received += n
+
+    def __len__(self):
+        """缓冲区中尚未解析的字节数"""
+        return self._end - self._start
+
+    def frames(self):
+        """解析缓冲区中所有完整的帧
+
+        返回:
+            RadarFrame生成器
+        """
+        buf = self._buf
+        hdr_size = FRAME_HEADER_DTYPE.itemsize
+        while True:
+            pos = buf.find(MAGIC_WORD, self._start, self._end)
+            if pos < 0:
+                # 保留可能是魔术字前缀的末尾字节
+                keep = min(len(MAGIC_WORD) - 1, self._end - self._start)
+                self.bytes_skipped += self._end - self._start - keep
+                self._start = self._end - keep
+                return
+            self.bytes_skipped += pos - self._start
+            self._start = pos
+            if self._end - pos < hdr_size:
+                return
+            header = np.frombuffer(buf, FRAME_HEADER_DTYPE, 1, pos)[0].copy()
+            length = int(header["total_packet_len"])
+            if length < hdr_size or length > MAX_PACKET_LEN:
+                # 帧长度不合理：跳过这个魔术字重新同步
+                self.bad_frames += 1
+                self._start = pos + 1
+                continue
+            if self._end - pos < length:
+                return
+            if self.recorder is not None:
+                self.recorder.write(buf[pos:pos + length])
+            frame = self._decode(header, pos + hdr_size, pos + length)
+            self._start = pos + length
+            if frame is None:
+                self.bad_frames += 1
+                continue
+            self.frames_parsed += 1
+            yield frame
+
+    def _decode(self, header, offset, end):
+        buf = self._buf
+        tlv_size = TLV_HEADER_DTYPE.itemsize
+        n_points = 0
+        points = self._points
+        range_profile = noise_profile = stats = None
+        for _ in range(int(header["num_tlvs"])):
+            if offset + tlv_size > end:
+                return None
+            tlv_type, length = np.frombuffer(buf, "<u4", 2, offset).tolist()
+            offset += tlv_size
+            if offset + length > end:
+                return None
+            if tlv_type == TLV_DETECTED_POINTS:
+                n_points = min(length // _RAW_POINT_DTYPE.itemsize,
+                               len(points))
+                raw = np.frombuffer(buf, _RAW_POINT_DTYPE, n_points, offset)
+                for name in _RAW_POINT_DTYPE.names:
+                    points[name][:n_points] = raw[name]
+                x, y, z = (points[k][:n_points] for k in "xyz")
+                points["range"][:n_points] = np.sqrt(x * x + y * y + z * z)
+                points["azimuth"][:n_points] = np.arctan2(x, y)
+                points["snr"][:n_points] = 0
+                points["noise"][:n_points] = 0
+            elif tlv_type == TLV_SIDE_INFO:
+                n = min(length // _SIDE_INFO_DTYPE.itemsize, len(points))
+                raw = np.frombuffer(buf, _SIDE_INFO_DTYPE, n, offset)
+                # 单位为0.1 dB
+                points["snr"][:n] = raw["snr"] * np.float32(0.1)
+                points["noise"][:n] = raw["noise"] * np.float32(0.1)
+            elif tlv_type in (TLV_RANGE_PROFILE, TLV_NOISE_PROFILE):
+                out = self._range_profile if tlv_type == TLV_RANGE_PROFILE \
+                    else self._noise_profile
+                n = min(length // 2, len(out))
+                # Q9格式的对数幅度
+                np.multiply(np.frombuffer(buf, "<u2", n, offset),
+                            np.float32(1.0 / 512), out=out[:n])
+                if tlv_type == TLV_RANGE_PROFILE:
+                    range_profile = out[:n]
+                else:
+                    noise_profile = out[:n]
+            elif tlv_type == TLV_STATS and length >= STATS_DTYPE.itemsize:
+                self._stats[()] = np.frombuffer(buf, STATS_DTYPE, 1, offset)[0]
+                stats = self._stats
+            offset += length
+        return RadarFrame(header, points[:n_points], range_profile,
+                          noise_profile, stats)
+
+
+def iter_frames(stream, chunk_size=4096, parser=None):
+    """从录制的字节流（文件对象或bytes）中逐帧解析
+
+    参数:
+        stream: 提供read(n)的文件对象，或bytes/bytearray
+        chunk_size: 每次读取的字节数，模拟串口分批到达的数据
+        parser: TLVParser实例，None时新建一个
+
+    返回:
+        RadarFrame生成器（帧数据在下一次迭代时被覆盖）
+    """
+    if parser is None:
+        parser = TLVParser()
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        view = memoryview(stream)
+        chunks = (view[i:i + chunk_size]
+                  for i in range(0, len(view), chunk_size))
+    else:
+        chunks = iter(lambda: stream.read(chunk_size), b"")
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.frames()
+
+
+def make_test_stream(frames=100, points=50, range_bins=256, seed=0):
+    """生成模拟的数据端口字节流，用于测试和基准测试
+
+    每帧包含检测点、距离剖面、点附加信息和统计信息四个TLV，
+    帧之间插入少量随机字节以检验重同步。
+    """
+    rng = np.random.default_rng(seed)
+    out = bytearray()
+    for i in range(frames):
+        pts = np.zeros(points, dtype=_RAW_POINT_DTYPE)
+        for name in _RAW_POINT_DTYPE.names:
+            pts[name] = rng.uniform(-5, 5, points)
+        side = np.zeros(points, dtype=_SIDE_INFO_DTYPE)
+        side["snr"] = rng.integers(100, 400, points)
+        side["noise"] = rng.integers(50, 150, points)
+        profile = rng.integers(0, 1 << 16, range_bins).astype("<u2")
+        stats = np.zeros((), dtype=STATS_DTYPE)
+        stats["active_frame_cpu_load"] = 40
+        tlvs = b""
+        for tlv_type, payload in ((TLV_DETECTED_POINTS, pts),
+                                  (TLV_RANGE_PROFILE, profile),
+                                  (TLV_SIDE_INFO, side),
+                                  (TLV_STATS, stats)):
+            payload = payload.tobytes()
+            tlvs += np.array((tlv_type, len(payload)),
+                             dtype=TLV_HEADER_DTYPE).tobytes() + payload
+        header = np.zeros((), dtype=FRAME_HEADER_DTYPE)
+        header["magic"] = np.frombuffer(MAGIC_WORD, "<u8")[0]
+        header["version"] = 0x03060000
+        header["total_packet_len"] = FRAME_HEADER_DTYPE.itemsize + len(tlvs)
+        header["platform"] = 0xA6843
+        header["frame_number"] = i
+        header["num_detected_obj"] = points
+        header["num_tlvs"] = 4
+        out += header.tobytes() + tlvs
+        out += rng.integers(0, 256, rng.integers(0, 16), dtype=np.uint8).tobytes()
+    return bytes(out)
+
+
+def benchmark_parser(stream=None, chunk_size=4096, repeat=3):
+    """测量解析吞吐量
+
+    参数:
+        stream: 录制的数据端口字节流，None时使用make_test_stream生成
+        chunk_size: 每次送入解析器的字节数
+        repeat: 重复次数，取最快的一次
+
+    返回:
+        字典，包含每秒字节数、每秒帧数，以及相对于921600波特率串口的裕量倍数
+    """
+    if stream is None:
+        stream = make_test_stream()
+    best = None
+    for _ in range(repeat):
+        parser = TLVParser()
+        start = time.perf_counter()
+        for _ in iter_frames(stream, chunk_size, parser):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    bytes_per_second = len(stream) / best
+    return {"bytes_per_second": bytes_per_second,
+            "frames_per_second": parser.frames_parsed / best,
+            "frames": parser.frames_parsed,
+            "headroom_921600": bytes_per_second / (921600 / 10)}
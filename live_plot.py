@@ -0,0 +1,265 @@
+"""实时曲线的数据层：定长环形缓冲区、min/max抽取和增量更新
+
+数据线程调用LivePlot.append追加数据；显示端按固定速率（与数据速率无关）
+调用update取得自上次以来的新增数据（Dash的extendData格式），或调用
+apply_to_figure把抽取到屏幕分辨率的数据写入plotly FigureWidget。每次增量
+更新的开销只取决于新增点数和屏幕点数；浏览器端每追加约max_points个点才
+重新抽取并发送一次整段历史。
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    """定长numpy环形缓冲区
+
+    内部使用两倍容量的数组，每个值同时写入两个位置，因此最近的数据总能以
+    连续视图（零拷贝）取出。
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._head = 0
+        self.total = 0
+
+    def append(self, values):
+        """追加一个或一批值（超过容量时只保留最后capacity个）"""
+        values = np.atleast_1d(np.asarray(values, dtype=self._data.dtype))
+        n = len(values)
+        self.total += n
+        if n >= self.capacity:
+            values = values[-self.capacity:]
+            n = self.capacity
+            self._head = 0
+        first = min(n, self.capacity - self._head)
+        for offset in (0, self.capacity):
+            start = self._head + offset
+            self._data[start:start + first] = values[:first]
+            self._data[offset:offset + n - first] = values[first:]
+        self._head = (self._head + n) % self.capacity
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def view(self, last=None):
+        """最近last个值（默认全部）的连续只读视图"""
+        n = len(self) if last is None else min(last, len(self))
+        end = self._head + self.capacity
+        out = self._data[end - n:end]
+        out.flags.writeable = False
+        return out
+
+
+def minmax_decimate(x, y, max_points):
+    """按min/max抽取到不超过max_points个点
+
+    把数据分成max_points // 2个桶，每个桶保留y的最小值和最大值两个点
+    （按原顺序），峰值和毛刺不会像简单隔点抽取那样丢失。
+
+    返回:
+        (x, y)，点数不超过max_points时原样返回
+    """
+    n = len(y)
+    if n <= max_points:
+        return x, y
+    buckets = max(1, max_points // 2)
+    size = n // buckets
+    trimmed = y[n - buckets * size:].reshape(buckets, size)
+    base = n - buckets * size + np.arange(buckets) * size
+    lo = base + trimmed.argmin(axis=1)
+    hi = base + trimmed.argmax(axis=1)
+    index = np.unique(np.concatenate((lo, hi)))
+    return x[index], y[index]
+
+
+class LivePlot:
+    """一组实时曲线
+
+    每条曲线有独立的x和y环形缓冲区。update和apply_to_figure受max_rate限制，
+    在最小间隔内再次调用时直接返回None，调用方可以用更快的定时器触发而
+    不增加开销。
+
+    figure发送的是整段历史抽取后的点，update追加的是之后的新数据，两者密度
+    不同，浏览器端不能按固定点数截断（否则截断后显示的时间跨度会突变）。
+    因此update不限制浏览器端的点数；某条曲线追加的点数超过max_points后
+    needs_refresh为True，调用方应重新取figure()，浏览器端每条曲线的点数
+    不超过3 * max_points。
+    """
+
+    def __init__(self, traces, capacity=100_000, max_points=1000,
+                 max_rate=10.0):
+        """初始化
+
+        参数:
+            traces: 曲线名列表，顺序即图中trace的索引
+            capacity: 每条曲线保留的历史点数
+            max_points: 每条曲线发送到前端的最大点数（屏幕分辨率）
+            max_rate: 最大刷新速率（次/秒）
+        """
+        self.names = list(traces)
+        self.capacity = capacity
+        self.max_points = max_points
+        self.max_rate = max_rate
+        self._x = {name: RingBuffer(capacity) for name in self.names}
+        self._y = {name: RingBuffer(capacity) for name in self.names}
+        self._sent = dict.fromkeys(self.names, 0)
+        # 自上次figure()以来各曲线在浏览器端追加的点数
+        self._extended = dict.fromkeys(self.names, 0)
+        self._lock = threading.Lock()
+        self._last_update = 0.0
+        self.updates = 0
+        self.skipped = 0
+
+    def append(self, name, x, y):
+        """追加一条曲线的一个或一批数据点"""
+        with self._lock:
+            self._x[name].append(x)
+            self._y[name].append(y)
+
+    def data(self, name, decimate=True):
+        """曲线的全部历史数据（默认抽取到max_points）"""
+        with self._lock:
+            x, y = self._x[name].view(), self._y[name].view()
+            if decimate:
+                x, y = minmax_decimate(x, y, self.max_points)
+            return x.copy(), y.copy()
+
+    def _due(self):
+        now = time.monotonic()
+        if now - self._last_update < 1.0 / self.max_rate:
+            self.skipped += 1
+            return False
+        self._last_update = now
+        self.updates += 1
+        return True
+
+    @property
+    def needs_refresh(self):
+        """浏览器端追加的点数已超过max_points，应重新发送figure()"""
+        with self._lock:
+            return max(self._extended.values(), default=0) > self.max_points
+
+    def update(self):
+        """自上次调用以来的新增数据，格式为Dash Graph的extendData
+
+        新增点数超过max_points时同样做min/max抽取。不包含maxPoints，浏览器端
+        不截断已有的点（见needs_refresh）。没有新数据、未到刷新时间或
+        needs_refresh为True时返回None。
+
+        返回:
+            (dict(x=[...], y=[...]), trace索引列表)或None
+        """
+        if self.needs_refresh or not self._due():
+            return None
+        xs, ys, indices = [], [], []
+        with self._lock:
+            for i, name in enumerate(self.names):
+                new = self._y[name].total - self._sent[name]
+                if not new:
+                    continue
+                self._sent[name] = self._y[name].total
+                x, y = minmax_decimate(self._x[name].view(new),
+                                       self._y[name].view(new),
+                                       self.max_points)
+                xs.append(x.tolist())
+                ys.append(y.tolist())
+                indices.append(i)
+                self._extended[name] += len(x)
+        if not indices:
+            return None
+        return dict(x=xs, y=ys), indices
+
+    def figure(self, **layout):
+        """完整的初始figure字典（页面刷新或新客户端连接时使用）"""
+        data = []
+        for name in self.names:
+            x, y = self.data(name)
+            data.append(dict(x=x.tolist(), y=y.tolist(), name=name,
+                             mode="lines"))
+        with self._lock:
+            for name in self.names:
+                self._sent[name] = self._y[name].total
+                self._extended[name] = 0
+        return dict(data=data, layout=layout)
+
+    def apply_to_figure(self, fig):
+        """把抽取后的数据写入plotly FigureWidget（受max_rate限制）
+
+        返回:
+            True: 已更新
+            False: 未到刷新时间
+        """
+        if not self._due():
+            return False
+        series = [self.data(name) for name in self.names]
+        with fig.batch_update():
+            for trace, (x, y) in zip(fig.data, series):
+                trace.x = x
+                trace.y = y
+        return True
+
+
+def register_dash_callback(app, plot, graph_id, interval_id):
+    """为Dash应用注册增量更新回调
+
+    回调把plot.update()的结果作为Graph的extendData返回，没有新数据时返回
+    no_update，浏览器端不会重绘整个图；plot.needs_refresh为True时改为发送
+    plot.figure()，用重新抽取的整段历史替换浏览器端的数据。
+    """
+    from dash import no_update
+    from dash.dependencies import Input, Output
+
+    @app.callback([Output(graph_id, "figure"),
+                   Output(graph_id, "extendData")],
+                  [Input(interval_id, "n_intervals")])
+    def _extend(n_intervals):
+        if plot.needs_refresh:
+            return plot.figure(), no_update
+        return no_update, plot.update() or no_update
+
+    return _extend
+
+
+def benchmark_tick(history=(1_000, 10_000, 100_000, 1_000_000),
+                   points_per_tick=100, ticks=100, max_points=1000):
+    """比较每次刷新的开销随历史长度的变化
+
+    对每个历史长度，先填满历史，再测量每次"追加points_per_tick个点并生成
+    更新"的平均耗时：LivePlot的增量更新（与register_dash_callback相同，
+    needs_refresh时重新生成figure）与每次把全部历史转换为列表重建figure的
+    做法（Notebook中update_graph_scatter/streamFig的方式）。
+
+    返回:
+        列表，每项为(历史长度, 增量更新耗时, 全量重建耗时)，单位为秒
+    """
+    results = []
+    for n in history:
+        plot = LivePlot(["a"], capacity=n, max_points=max_points,
+                        max_rate=float("inf"))
+        plot.append("a", np.arange(n), np.random.randn(n))
+        plot.figure()
+        x = np.arange(n, n + points_per_tick, dtype=float)
+        y = np.random.randn(points_per_tick)
+        start = time.perf_counter()
+        for i in range(ticks):
+            plot.append("a", x + i * points_per_tick, y)
+            if plot.needs_refresh:
+                plot.figure()
+            else:
+                plot.update()
+        incremental = (time.perf_counter() - start) / ticks
+
+        full_x = list(range(n))
+        full_y = np.random.randn(n).tolist()
+        start = time.perf_counter()
+        for i in range(ticks):
+            full_x.extend((x + i * points_per_tick).tolist())
+            full_y.extend(y.tolist())
+            {"data": [{"x": list(full_x), "y": list(full_y)}]}
+        full = (time.perf_counter() - start) / ticks
+        results.append((n, incremental, full))
+    return results
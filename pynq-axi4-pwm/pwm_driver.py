@@ -1,6 +1,40 @@
-from pynq import MMIO
+import numbers
+import time
 import numpy as np
 
+
+class SimulatedMMIO:
+    """模拟的MMIO后端，寄存器文件保存在内存中，用于脱离硬件测试PWM驱动
+    
+    接口与pynq.MMIO一致：read/write按字节偏移访问32位寄存器，
+    array为寄存器文件的numpy视图
+    """
+    
+    def __init__(self, base_addr, length=128):
+        """初始化模拟寄存器文件
+        
+        参数:
+            base_addr: 模拟的基地址
+            length: 寄存器空间大小（字节）
+        """
+        self.base_addr = base_addr
+        self.length = length
+        self.array = np.zeros(length >> 2, dtype=np.uint32)
+        
+    def read(self, offset=0, length=4):
+        """读取offset处的32位寄存器"""
+        return int(self.array[offset >> 2])
+        
+    def write(self, offset, data):
+        """写入offset处的32位寄存器（data为int）或连续寄存器（data为bytes）"""
+        idx = offset >> 2
+        if isinstance(data, bytes):
+            words = np.frombuffer(data, np.uint32)
+            self.array[idx:idx + len(words)] = words
+        else:
+            self.array[idx] = np.uint32(data)
+
+
 class PWM:
     """PYNQ PWM驱动类，封装PWM控制器的基本操作"""
     
@@ -8,18 +42,42 @@ class PWM:
     PWM_AXI_CTRL_REG_OFFSET = 0
     PWM_AXI_PERIOD_REG_OFFSET = 8
     PWM_AXI_DUTY_REG_OFFSET = 64
+    # 寄存器空间大小为128字节（足够覆盖用到的寄存器）
+    PWM_AXI_REG_SPACE = 128
+    PWM_MAX_CHANNELS = (PWM_AXI_REG_SPACE - PWM_AXI_DUTY_REG_OFFSET) // 4
     
-    def __init__(self, base_addr, device_name="PWM"):
+    def __init__(self, base_addr, device_name="PWM", mmio=None, shadow=False):
         """初始化PWM控制器
         
         参数:
             base_addr: PWM控制器的基地址
             device_name: 设备名称（用于调试）
+            mmio: 寄存器访问后端（默认创建pynq.MMIO，测试时可传入SimulatedMMIO）
+            shadow: 是否启用寄存器影子副本（写直达，读操作不访问总线）
         """
         self.base_addr = base_addr
         self.device_name = device_name
-        # 初始化MMIO，假设寄存器空间大小为128字节（足够覆盖用到的寄存器）
-        self.mmio = MMIO(base_addr, 128)
+        if mmio is None:
+            from pynq import MMIO
+            mmio = MMIO(base_addr, self.PWM_AXI_REG_SPACE)
+        self.mmio = mmio
+        # 影子副本在初始化时从硬件读取一次，之后随每次写入同步更新
+        self._shadow = None
+        if shadow:
+            self._shadow = np.array(
+                self.mmio.array[:self.PWM_AXI_REG_SPACE >> 2], dtype=np.uint32)
+        
+    def _read(self, offset):
+        """读取寄存器，启用影子副本时不访问总线"""
+        if self._shadow is not None:
+            return int(self._shadow[offset >> 2])
+        return self.mmio.read(offset)
+        
+    def _write(self, offset, value):
+        """写入寄存器并同步影子副本"""
+        self.mmio.write(offset, value)
+        if self._shadow is not None:
+            self._shadow[offset >> 2] = value
         
     def set_period(self, clocks):
         """设置PWM周期（时钟周期数）
@@ -29,7 +87,7 @@ class PWM:
         """
         if not isinstance(clocks, int) or clocks < 0 or clocks > 0xFFFFFFFF:
             raise ValueError("Invalid clock count (must be 32-bit unsigned integer)")
-        self.mmio.write(self.PWM_AXI_PERIOD_REG_OFFSET, clocks)
+        self._write(self.PWM_AXI_PERIOD_REG_OFFSET, clocks)
         
     def get_period(self):
         """获取当前PWM周期（时钟周期数）
@@ -37,7 +95,7 @@ class PWM:
         返回:
             当前周期值（32位无符号整数）
         """
-        return self.mmio.read(self.PWM_AXI_PERIOD_REG_OFFSET)
+        return self._read(self.PWM_AXI_PERIOD_REG_OFFSET)
         
     def set_duty(self, clocks, pwm_index):
         """设置指定PWM通道的占空比（时钟周期数）
@@ -53,7 +111,7 @@ class PWM:
         
         # 计算目标寄存器偏移（每个通道占4字节）
         reg_offset = self.PWM_AXI_DUTY_REG_OFFSET + 4 * pwm_index
-        self.mmio.write(reg_offset, clocks)
+        self._write(reg_offset, clocks)
         
     def get_duty(self, pwm_index):
         """获取指定PWM通道的占空比（时钟周期数）
@@ -68,15 +126,68 @@ class PWM:
             raise ValueError("Invalid PWM index (must be non-negative integer)")
             
         reg_offset = self.PWM_AXI_DUTY_REG_OFFSET + 4 * pwm_index
-        return self.mmio.read(reg_offset)
+        return self._read(reg_offset)
+        
+    def _check_channel_range(self, start, count):
+        if not isinstance(start, int) or start < 0:
+            raise ValueError("Invalid PWM index (must be non-negative integer)")
+        if start + count > self.PWM_MAX_CHANNELS:
+            raise ValueError("PWM channel range exceeds {} channels".format(
+                self.PWM_MAX_CHANNELS))
+        
+    def set_duties(self, duties, start=0):
+        """批量设置连续多个PWM通道的占空比（时钟周期数）
+        
+        整个数组只校验一次，并通过一次块写入更新连续的占空比寄存器
+        
+        参数:
+            duties: 占空比数组（整数，每个元素为32位无符号整数）
+            start: 第一个通道的索引，duties[i]写入通道start + i
+        """
+        duties = np.asarray(duties)
+        if duties.ndim != 1 or not np.issubdtype(duties.dtype, np.integer):
+            raise ValueError("Invalid duty clock counts (must be 1-D integer array)")
+        if duties.size and (duties.min() < 0 or duties.max() > 0xFFFFFFFF):
+            raise ValueError("Invalid duty clock count (must be 32-bit unsigned integer)")
+        self._check_channel_range(start, len(duties))
+        
+        idx = (self.PWM_AXI_DUTY_REG_OFFSET >> 2) + start
+        values = duties.astype(np.uint32)
+        self.mmio.array[idx:idx + len(values)] = values
+        if self._shadow is not None:
+            self._shadow[idx:idx + len(values)] = values
+        
+    def get_duties(self, start=0, count=None):
+        """批量读取连续多个PWM通道的占空比（时钟周期数）
+        
+        参数:
+            start: 第一个通道的索引
+            count: 通道数量（默认读取到最后一个通道）
+            
+        返回:
+            占空比数组（numpy uint32数组）
+        """
+        if isinstance(start, numbers.Integral) and start >= self.PWM_MAX_CHANNELS:
+            raise ValueError("PWM channel {} out of range (0-{})".format(
+                start, self.PWM_MAX_CHANNELS - 1))
+        if count is None:
+            count = self.PWM_MAX_CHANNELS - start
+        if not isinstance(count, numbers.Integral) or count < 1:
+            raise ValueError("Invalid PWM channel count (must be positive integer)")
+        count = int(count)
+        self._check_channel_range(start, count)
+        
+        idx = (self.PWM_AXI_DUTY_REG_OFFSET >> 2) + start
+        source = self.mmio.array if self._shadow is None else self._shadow
+        return np.array(source[idx:idx + count], dtype=np.uint32)
         
     def enable(self):
         """使能PWM输出"""
-        self.mmio.write(self.PWM_AXI_CTRL_REG_OFFSET, 1)
+        self._write(self.PWM_AXI_CTRL_REG_OFFSET, 1)
         
     def disable(self):
         """禁用PWM输出"""
-        self.mmio.write(self.PWM_AXI_CTRL_REG_OFFSET, 0)
+        self._write(self.PWM_AXI_CTRL_REG_OFFSET, 0)
         
     def self_test(self):
         """执行PWM寄存器自检（类似C语言中的PWM_Reg_SelfTest）
@@ -86,16 +197,17 @@ class PWM:
             False: 自检失败
         """
         try:
+            # 自检始终直接访问硬件，不使用影子副本
             # 保存当前寄存器状态
             orig_ctrl = self.mmio.read(self.PWM_AXI_CTRL_REG_OFFSET)
-            orig_period = self.get_period()
+            orig_period = self.mmio.read(self.PWM_AXI_PERIOD_REG_OFFSET)
             
             # 写入测试值
             self.disable()
             self.set_period(0x12345678)
             
             # 验证写入值
-            if self.get_period() != 0x12345678:
+            if self.mmio.read(self.PWM_AXI_PERIOD_REG_OFFSET) != 0x12345678:
                 return False
                 
             # 测试使能功能
@@ -109,7 +221,7 @@ class PWM:
                 
             # 恢复原始状态
             self.set_period(orig_period)
-            self.mmio.write(self.PWM_AXI_CTRL_REG_OFFSET, orig_ctrl)
+            self._write(self.PWM_AXI_CTRL_REG_OFFSET, orig_ctrl)
             return True
             
         except Exception as e:
@@ -117,4 +229,33 @@ class PWM:
             return False
             
     def __repr__(self):
-        return f"PWM(device_name={self.device_name}, base_addr=0x{self.base_addr:X})"
\ No newline at end of file
+        return f"PWM(device_name={self.device_name}, base_addr=0x{self.base_addr:X})"
+
+
+def benchmark_duty_update(pwm, channels=16, iterations=1000):
+    """比较逐通道set_duty与批量set_duties的占空比更新速率
+    
+    参数:
+        pwm: PWM实例（可使用SimulatedMMIO后端）
+        channels: 每次更新的通道数
+        iterations: 更新次数
+        
+    返回:
+        字典，包含两种方式每秒完成的整组更新次数及加速比
+    """
+    duties = np.arange(channels, dtype=np.uint32)
+    values = [int(d) for d in duties]
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for i, d in enumerate(values):
+            pwm.set_duty(d, i)
+    per_channel = iterations / (time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pwm.set_duties(duties)
+    batched = iterations / (time.perf_counter() - start)
+    
+    return {"per_channel": per_channel, "batched": batched,
+            "speedup": batched / per_channel}
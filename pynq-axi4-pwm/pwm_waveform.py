@@ -0,0 +1,201 @@
+import ctypes
+import ctypes.util
+import threading
+import time
+import numpy as np
+
+
+# Linux下clock_nanosleep的常量
+_CLOCK_MONOTONIC = 1
+_TIMER_ABSTIME = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_clock_nanosleep():
+    """加载libc中的clock_nanosleep，不可用时返回None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        fn = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.c_int,
+                   ctypes.POINTER(_timespec), ctypes.POINTER(_timespec)]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_clock_nanosleep = _load_clock_nanosleep()
+
+
+def sleep_until(deadline_ns):
+    """睡眠到CLOCK_MONOTONIC的绝对时间deadline_ns（纳秒）
+
+    优先使用clock_nanosleep(TIMER_ABSTIME)，截止时间不随唤醒延迟累积漂移；
+    不可用时退回到time.sleep
+
+    参数:
+        deadline_ns: 绝对截止时间，与time.monotonic_ns()同一时基
+    """
+    if _clock_nanosleep is not None:
+        ts = _timespec(deadline_ns // 1_000_000_000, deadline_ns % 1_000_000_000)
+        # 被信号中断时（EINTR）继续等待同一个绝对时间
+        while _clock_nanosleep(_CLOCK_MONOTONIC, _TIMER_ABSTIME, ts, None) == 4:
+            pass
+    else:
+        remaining = deadline_ns - time.monotonic_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+
+
+class WaveformPlayer:
+    """PWM占空比波形播放器
+
+    在独立线程上按目标更新速率播放预先计算好的占空比表。表的每一行是一个
+    时间步，每一列对应一个PWM通道（从start开始的连续通道），每一步通过
+    PWM.set_duties一次块写入。截止时间按绝对时间计算，因此单次唤醒延迟
+    不会累积；若延迟超过一个周期，则跳过错过的步以保持波形与时间对齐，
+    并计入错过的截止时间次数。
+    """
+
+    def __init__(self, pwm, table, start=0, rate=1000.0, loop=True):
+        """初始化波形播放器
+
+        参数:
+            pwm: PWM实例
+            table: 占空比表，形状为(步数, 通道数)的整数数组（一维数组视为单通道）
+            start: 第一个通道的索引
+            rate: 目标更新速率（每秒步数）
+            loop: 播放到表尾后是否从头循环
+        """
+        if rate <= 0:
+            raise ValueError("Invalid update rate (must be positive)")
+        self.pwm = pwm
+        self.start_channel = start
+        self.rate = rate
+        self.loop = loop
+        self._table = self._prepare(table)
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset_stats()
+
+    def _prepare(self, table):
+        """一次性校验整张占空比表并转换为uint32"""
+        table = np.asarray(table)
+        if table.ndim == 1:
+            table = table[:, np.newaxis]
+        if table.ndim != 2 or len(table) == 0 or \
+                not np.issubdtype(table.dtype, np.integer):
+            raise ValueError("Invalid duty table (must be non-empty 2-D integer array)")
+        if table.min() < 0 or table.max() > 0xFFFFFFFF:
+            raise ValueError("Invalid duty clock count (must be 32-bit unsigned integer)")
+        self.pwm._check_channel_range(self.start_channel, table.shape[1])
+        return np.ascontiguousarray(table, dtype=np.uint32)
+
+    def _reset_stats(self):
+        self.updates = 0
+        self.missed_deadlines = 0
+        self.max_lateness = 0.0
+        self._started_ns = None
+        self._stopped_ns = None
+
+    def swap(self, table, immediate=False):
+        """无缝切换到新的占空比表，播放不中断
+
+        参数:
+            table: 新的占空比表，通道数可以与原表不同
+            immediate: True时在下一步立即切换，否则在当前表播放完一轮后切换
+        """
+        table = self._prepare(table)
+        with self._lock:
+            self._pending = (table, immediate)
+
+    def start(self):
+        """启动播放线程"""
+        if self.is_running:
+            raise RuntimeError("Waveform player is already running")
+        self._stop.clear()
+        self._reset_stats()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="WaveformPlayer")
+        self._thread.start()
+
+    def stop(self):
+        """停止播放并等待线程退出（PWM保持最后一步的输出）"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait(self, timeout=None):
+        """等待非循环播放结束
+
+        返回:
+            True: 播放已结束
+            False: 超时
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        period_ns = int(round(1e9 / self.rate))
+        table = self._table
+        index = 0
+        step = 0
+        at_boundary = True
+        self._started_ns = time.monotonic_ns()
+        while not self._stop.is_set():
+            pending = self._pending
+            if pending is not None and (at_boundary or pending[1]):
+                with self._lock:
+                    table, _ = self._pending
+                    self._pending = None
+                self._table = table
+                index = 0
+            deadline = self._started_ns + step * period_ns
+            sleep_until(deadline)
+            self.pwm.set_duties(table[index], self.start_channel)
+            self.updates += 1
+
+            lateness = time.monotonic_ns() - deadline
+            self.max_lateness = max(self.max_lateness, lateness / 1e9)
+            # 延迟超过一个周期时跳过错过的步，保持波形与时间对齐
+            skipped = max(0, lateness) // period_ns
+            self.missed_deadlines += skipped
+            step += 1 + skipped
+            index += 1 + skipped
+            at_boundary = index >= len(table)
+            if at_boundary:
+                if not self.loop and self._pending is None:
+                    break
+                index %= len(table)
+        self._stopped_ns = time.monotonic_ns()
+
+    @property
+    def stats(self):
+        """播放统计信息
+
+        返回:
+            字典，包含更新次数、实际更新速率（每秒步数）、错过的截止时间次数
+            和最大延迟（秒）
+        """
+        if self._started_ns is None:
+            elapsed = 0.0
+        else:
+            end = self._stopped_ns if self._stopped_ns is not None \
+                else time.monotonic_ns()
+            elapsed = (end - self._started_ns) / 1e9
+        return {"updates": self.updates,
+                "achieved_rate": self.updates / elapsed if elapsed else 0.0,
+                "missed_deadlines": self.missed_deadlines,
+                "max_lateness": self.max_lateness}
@@ -0,0 +1,353 @@
+"""MicroBlaze邮箱的异步命令队列
+
+pynq-mb-leds.ipynb中的MB.write_blocking_command写入命令字后用
+while self.read(...) != 0: pass忙等，每个邮箱字都单独调用一次write/read，
+一条命令占满一个ARM核，且所有命令只能在调用者中串行执行。这里：
+
+* 多字参数通过mmio.array一次块写入邮箱数据区，返回值一次块读取
+* 命令在asyncio队列中排队，由一个后台任务逐条送入邮箱（邮箱同时只能有
+  一条命令），调用者得到future，可以同时提交多条命令而不阻塞
+* 完成由mb_done_intr中断唤醒，等待完全由事件驱动
+* 固件没有触发中断时（mb_software/main.c目前只清零命令字），先连续检查
+  命令字spin次（短命令在这期间即可完成，asyncio.sleep的精度远低于50微秒），
+  再按指数退避间隔检查命令字，等待期间不占用CPU
+* SimulatedMicroblaze模拟邮箱和main.c中的命令，用于无板卡测试
+
+邮箱布局与mb_software/circular_buffer.h一致：数据区从MAILBOX_OFFSET开始
+（MAILBOX_DATA(0)），命令字在MAILBOX_OFFSET + MAILBOX_PY2IOP_CMD_OFFSET。
+固件以命令字的第0位判断是否有新命令，因此命令码必须是奇数。
+"""
+
+import asyncio
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+MAILBOX_OFFSET = 0xF000
+MAILBOX_SIZE = 0x1000
+MAILBOX_PY2IOP_CMD_OFFSET = 0xffc
+MAILBOX_PY2IOP_ADDR_OFFSET = 0xff8
+MAILBOX_PY2IOP_DATA_OFFSET = 0xf00
+
+WRITE_LED = 0x9
+READ_LED = 0x23
+TEST_CYCLE = 0x69
+
+
+class MailboxTimeoutError(Exception):
+    pass
+
+
+class MailboxQueue:
+    """MicroBlaze邮箱的异步命令队列"""
+
+    def __init__(self, mb, mailbox_offset=MAILBOX_OFFSET, data_offset=0,
+                 poll_interval=(50e-6, 2e-3), timeout=1.0, interrupt=None,
+                 spin=500):
+        """初始化
+
+        参数:
+            mb: PynqMicroblaze（如Notebook中的_mb）或SimulatedMicroblaze
+            mailbox_offset: 邮箱在MicroBlaze地址空间中的偏移
+            data_offset: 参数和返回值在邮箱中的偏移；main.c从MAILBOX_DATA(0)
+                读取参数，因此默认为0
+            poll_interval: 检查命令字的(最短, 最长)间隔（秒），每次未完成时加倍；
+                有中断时以最长间隔作为等待中断的超时
+            timeout: 单条命令的最长执行时间（秒）
+            interrupt: 完成中断，None时使用mb.interrupt（mb_info中配置了
+                intr_pin_name和intr_ack_name时存在）
+            spin: 没有中断时，让出事件循环之前连续检查命令字的次数，
+                0表示不检查；有中断时不使用
+        """
+        self.mb = mb
+        self.cmd_offset = mailbox_offset + MAILBOX_PY2IOP_CMD_OFFSET
+        self.data_offset = mailbox_offset + data_offset
+        if (self.data_offset - mailbox_offset) % 4:
+            raise ValueError("Mailbox data offset must be word aligned")
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.spin = spin
+        self.interrupt = interrupt if interrupt is not None \
+            else getattr(mb, "interrupt", None)
+        self._queue = None
+        self._task = None
+        self.completed = 0
+        self.interrupts = 0
+        self.polls = 0
+        self.spins = 0
+
+    def _words(self, offset, n):
+        start = offset >> 2
+        return self.mb.mmio.array[start:start + n]
+
+    def submit(self, command, payload=(), reply_words=0):
+        """提交一条命令（在事件循环中调用）
+
+        参数:
+            command: 命令码（奇数）
+            payload: 写入数据区的32位字序列
+            reply_words: 命令完成后从数据区读回的字数
+
+        返回:
+            asyncio.Future，结果为读回的uint32数组（reply_words为0时为None）
+        """
+        if not command & 1:
+            raise ValueError(
+                "Mailbox commands must be odd, bit 0 marks a pending command")
+        payload = np.asarray(payload, dtype=np.uint32).reshape(-1)
+        if (len(payload) + reply_words) * 4 > MAILBOX_PY2IOP_ADDR_OFFSET - \
+                (self.data_offset & (MAILBOX_SIZE - 1)):
+            raise ValueError("Payload does not fit in the mailbox")
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._worker())
+        future = loop.create_future()
+        self._queue.put_nowait((command, payload, reply_words, future))
+        return future
+
+    async def command(self, command, payload=(), reply_words=0):
+        """提交一条命令并等待完成"""
+        return await self.submit(command, payload, reply_words)
+
+    async def _worker(self):
+        while True:
+            command, payload, reply_words, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            try:
+                result = await self._execute(command, payload, reply_words)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def _execute(self, command, payload, reply_words):
+        if len(payload):
+            self._words(self.data_offset, len(payload))[:] = payload
+        if self.interrupt is not None:
+            # 清除上一条命令遗留的中断，避免被误认为本条命令完成
+            self.interrupt.clear()
+        self.mb.write(self.cmd_offset, command)
+        await self._wait_done()
+        self.completed += 1
+        if reply_words:
+            return self._words(self.data_offset, reply_words).copy()
+        return None
+
+    async def _wait_done(self):
+        if self.interrupt is None:
+            # 连续检查会阻塞事件循环，只用于没有完成中断的固件
+            for _ in range(self.spin):
+                if self.mb.read(self.cmd_offset) == 0:
+                    self.spins += 1
+                    return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        delay, max_delay = self.poll_interval
+        while self.mb.read(self.cmd_offset) != 0:
+            if loop.time() > deadline:
+                raise MailboxTimeoutError(
+                    "MicroBlaze did not complete the mailbox command")
+            self.polls += 1
+            if self.interrupt is not None:
+                try:
+                    await asyncio.wait_for(self.interrupt.wait(), max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    self.interrupts += 1
+                    self.interrupt.clear()
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    async def close(self):
+        """取消后台任务，未执行的命令以CancelledError结束"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait()[-1].cancel()
+
+
+class _SimulatedMMIO:
+    def __init__(self, size):
+        self.array = np.zeros(size // 4, dtype=np.uint32)
+
+
+class SimulatedInterrupt:
+    """模拟的MBInterruptEvent（wait/clear）
+
+    命令完成时间到达时由一个后台线程通过call_soon_threadsafe唤醒等待者，
+    与真实中断经UIO文件描述符唤醒事件循环的方式相同。
+    """
+
+    def __init__(self, mb):
+        self.mb = mb
+        self._timers = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="SimulatedInterrupt")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            deadline, loop, future = self._timers.get()
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            loop.call_soon_threadsafe(
+                lambda f=future: f.done() or f.set_result(None))
+
+    async def wait(self):
+        self.mb._service()
+        if self.mb._raised:
+            return
+        if self.mb._deadline is None:
+            # 没有执行中的命令，中断不会到来
+            await asyncio.get_running_loop().create_future()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._timers.put((self.mb._deadline, loop, future))
+        await future
+        self.mb._service()
+
+    def clear(self):
+        self.mb._raised = False
+
+
+class SimulatedMicroblaze:
+    """模拟的MicroBlaze（mb_software/main.c），用于无板卡测试
+
+    提供PynqMicroblaze的read、write和mmio.array。写入命令字后，命令在latency
+    秒后完成：执行对应的处理函数，清零命令字并触发中断。
+    """
+
+    def __init__(self, latency=20e-6, interrupt=True, handlers=None):
+        """初始化
+
+        参数:
+            latency: 每条命令的执行时间（秒）
+            interrupt: 是否模拟mb_done_intr中断（False时interrupt为None，
+                与目前的main.c一致）
+            handlers: 字典，命令码 -> 函数f(data)，data为邮箱数据区的uint32视图；
+                追加或替换main.c中的命令
+        """
+        self.mmio = _SimulatedMMIO(MAILBOX_OFFSET + MAILBOX_SIZE)
+        self.latency = latency
+        self.led = 0
+        self.handlers = {WRITE_LED: self._write_led, READ_LED: self._read_led,
+                         TEST_CYCLE: lambda data: None}
+        self.handlers.update(handlers or {})
+        self._deadline = None
+        self._raised = False
+        self.commands = 0
+        self.interrupt = SimulatedInterrupt(self) if interrupt else None
+
+    @property
+    def _data(self):
+        return self.mmio.array[MAILBOX_OFFSET >> 2:]
+
+    def _write_led(self, data):
+        self.led = int(data[0] & 0xFFFF) == 1
+
+    def _read_led(self, data):
+        data[0] = self.led
+
+    def _service(self):
+        """命令执行时间到达时完成命令"""
+        if self._deadline is None or time.perf_counter() < self._deadline:
+            return
+        cmd_index = (MAILBOX_OFFSET + MAILBOX_PY2IOP_CMD_OFFSET) >> 2
+        handler = self.handlers.get(int(self.mmio.array[cmd_index]))
+        if handler is not None:
+            handler(self._data)
+        self.mmio.array[cmd_index] = 0
+        self._deadline = None
+        self._raised = True
+        self.commands += 1
+
+    def write(self, offset, data):
+        if isinstance(data, int):
+            data = [data]
+        self.mmio.array[offset >> 2:(offset >> 2) + len(data)] = data
+        if offset == MAILBOX_OFFSET + MAILBOX_PY2IOP_CMD_OFFSET and data[0] & 1:
+            self._deadline = time.perf_counter() + self.latency
+
+    def read(self, offset, length=1):
+        self._service()
+        words = self.mmio.array[offset >> 2:(offset >> 2) + length]
+        return int(words[0]) if length == 1 else words.tolist()
+
+
+def _polling_command(mb, command, payload):
+    """Notebook中的做法：逐字write_mailbox，再忙等命令字清零"""
+    for i, word in enumerate(payload):
+        mb.write(MAILBOX_OFFSET + 4 * i, int(word))
+    mb.write(MAILBOX_OFFSET + MAILBOX_PY2IOP_CMD_OFFSET, command)
+    while mb.read(MAILBOX_OFFSET + MAILBOX_PY2IOP_CMD_OFFSET) != 0:
+        pass
+
+
+def benchmark_mailbox(commands=2000, payload_words=16, latency=200e-6,
+                      mb=None):
+    """比较忙等与队列方式的命令速率和CPU占用
+
+    CPU占用为进程CPU时间与墙钟时间之比（1.0即占满一个核）。使用模拟的
+    MicroBlaze时，队列方式分别测试有mb_done_intr中断和没有中断（与目前的
+    main.c一致）两种配置。
+
+    参数:
+        commands: 命令条数
+        payload_words: 每条命令的参数字数
+        latency: 模拟固件执行每条命令的时间（秒）
+        mb: PynqMicroblaze，None时使用SimulatedMicroblaze
+
+    返回:
+        字典，polling和queued（模拟时还有queued_no_interrupt）各方式的
+        commands_per_second和cpu
+    """
+    payload = np.arange(payload_words, dtype=np.uint32)
+    if mb is None:
+        configs = {"queued": SimulatedMicroblaze(latency=latency),
+                   "queued_no_interrupt":
+                       SimulatedMicroblaze(latency=latency, interrupt=False)}
+    else:
+        configs = {"queued": mb}
+    results = {}
+
+    polling_mb = configs["queued"]
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(commands):
+        _polling_command(polling_mb, WRITE_LED, payload)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    results["polling"] = {"commands_per_second": commands / wall,
+                          "cpu": cpu / wall}
+
+    async def queued(target):
+        mailbox = MailboxQueue(target)
+        futures = [mailbox.submit(WRITE_LED, payload)
+                   for _ in range(commands)]
+        await asyncio.gather(*futures)
+        await mailbox.close()
+        return mailbox
+
+    for name, target in configs.items():
+        wall, cpu = time.perf_counter(), time.process_time()
+        mailbox = asyncio.run(queued(target))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        results[name] = {"commands_per_second": commands / wall,
+                         "cpu": cpu / wall,
+                         "spins": mailbox.spins,
+                         "interrupts": mailbox.interrupts}
+    return results
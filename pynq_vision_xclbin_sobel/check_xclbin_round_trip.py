@@ -0,0 +1,99 @@
+"""检查embedded_device中合成的xclbin能否被PYNQ原样解析回来
+
+对每个HWH文件，用其中的存储器合成xclbin（_create_xclbin），再用PYNQ的
+parse_xclbin_header和XclBin解析，检查：
+
+* 只有EMBEDDED_METADATA和MEM_TOPOLOGY两个段
+* EMBEDDED_METADATA与BLANK_METADATA相同
+* 用PYNQ的ctypes结构解码的MEM_TOPOLOGY各项与_ip_to_topology的输出一致
+* XclBin接受该文件并给出相同的存储器标签
+
+需要安装pynq（在板卡上运行）。本目录中的embedded_device.py作为
+pynq.pl_server的子模块加载，因此检查的是这份代码而不是已安装的版本。
+
+用法::
+
+    python check_xclbin_round_trip.py             # 仓库中所有.hwh文件
+    python check_xclbin_round_trip.py a.hwh b.hwh
+"""
+
+import copy
+import importlib.util
+import sys
+from pathlib import Path
+
+
+HERE = Path(__file__).resolve().parent
+
+
+def load_embedded_device():
+    """把本目录中的embedded_device.py加载为pynq.pl_server的子模块"""
+    import pynq.pl_server
+    spec = importlib.util.spec_from_file_location(
+        "pynq.pl_server.embedded_device", HERE / "embedded_device.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def check_round_trip(ed, hwh_file):
+    """检查一个HWH文件，返回检查的存储器数量
+
+    不一致时抛出AssertionError。
+    """
+    from pynq._3rdparty import xclbin
+    from pynq.pl_server.hwh_parser import HWH
+    from pynq.pl_server.xclbin_parser import XclBin, parse_xclbin_header
+
+    mem_dict = HWH(hwh_data=Path(hwh_file).read_text()).mem_dict
+    expected = ed._ip_to_topology(
+        copy.deepcopy(mem_dict))["mem_topology"]["m_mem_data"]
+    data = ed._create_xclbin(copy.deepcopy(mem_dict))
+    sections, _ = parse_xclbin_header(data)
+    if set(sections) != {ed._AXLF_SECTION_EMBEDDED_METADATA,
+                         ed._AXLF_SECTION_MEM_TOPOLOGY}:
+        raise AssertionError("unexpected sections {}".format(sorted(sections)))
+    if bytes(sections[ed._AXLF_SECTION_EMBEDDED_METADATA]) != \
+            ed.BLANK_METADATA.encode():
+        raise AssertionError("EMBEDDED_METADATA does not match")
+    section = bytearray(sections[ed._AXLF_SECTION_MEM_TOPOLOGY])
+    parsed = xclbin.mem_topology.from_buffer(section)
+    if parsed.m_count != len(expected):
+        raise AssertionError("{} memories instead of {}".format(
+            parsed.m_count, len(expected)))
+    entries = (xclbin.mem_data * parsed.m_count).from_buffer(
+        section, xclbin.mem_topology.m_mem_data.offset)
+    for entry, m in zip(entries, expected):
+        actual = (entry.m_type, entry.m_used, entry.m_size,
+                  entry.m_base_address, entry.m_tag.decode())
+        wanted = (ed._MEM_TYPES[m["m_type"]], m["m_used"], m["m_sizeKB"],
+                  m["m_base_address"], m["m_tag"])
+        if actual != wanted:
+            raise AssertionError("MEM_TOPOLOGY entry {} != {}".format(
+                actual, wanted))
+    if set(XclBin(xclbin_data=data).mem_dict) != \
+            {m["m_tag"] for m in expected}:
+        raise AssertionError("XclBin memories do not match")
+    return len(expected)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    hwh_files = argv or sorted(HERE.parent.glob("**/*.hwh"))
+    ed = load_embedded_device()
+    failed = 0
+    for hwh_file in hwh_files:
+        try:
+            count = check_round_trip(ed, hwh_file)
+        except AssertionError as e:
+            failed += 1
+            print("FAIL {}: {}".format(hwh_file, e))
+        else:
+            print("ok   {} ({} memories)".format(hwh_file, count))
+    print("{} of {} HWH files round-trip".format(
+        len(hwh_files) - failed, len(hwh_files)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,10 @@
+import collections
+import contextlib
+import mmap
 import os
 import struct
+import time
+import weakref
 from pathlib import Path
 import numpy as np
 from .xrt_device import XrtDevice, XrtMemory
@@ -23,31 +28,16 @@ def _unify_dictionaries(hwh_parser, xclbin_parser):
         hwh_parser.mem_dict[v['tag']] = v
 
 
-def parse_bit_header(bit_data):
-    """The method to parse the header of a bitstream.
-
-    The returned dictionary has the following keys:
-    "design": str, the Vivado project name that generated the bitstream;
-    "version": str, the Vivado tool version that generated the bitstream;
-    "part": str, the Xilinx part name that the bitstream targets;
-    "date": str, the date the bitstream was compiled on;
-    "time": str, the time the bitstream finished compilation;
-    "length": int, total length of the bitstream (in bytes);
-    "data": binary, binary data in .bit file format
+def _parse_bit_fields(contents):
+    """Walk the header fields of a bitstream without copying the data
 
-    Returns
-    -------
-    Dict
-        A dictionary containing the header information.
-
-    Note
-    ----
-    Implemented based on: https://blog.aeste.my/?p=2892
+    `contents` can be any object supporting indexing and slicing such as
+    bytes or an mmap. Returns the header dictionary without the "data"
+    entry together with the offset and length of the bit data.
 
     """
     finished = False
     offset = 0
-    contents = bit_data
     bit_dict = {}
 
     # Strip the (2+n)-byte first field (2-bit length, n-bit data)
@@ -91,9 +81,35 @@ def parse_bit_header(bit_data):
             bit_dict['length'] = str(length)
             if length + offset != len(contents):
                 raise RuntimeError("Invalid length found")
-            bit_dict['data'] = contents[offset:offset + length]
         else:
             raise RuntimeError("Unknown field: {}".format(hex(desc)))
+    return bit_dict, offset, length
+
+
+def parse_bit_header(bit_data):
+    """The method to parse the header of a bitstream.
+
+    The returned dictionary has the following keys:
+    "design": str, the Vivado project name that generated the bitstream;
+    "version": str, the Vivado tool version that generated the bitstream;
+    "part": str, the Xilinx part name that the bitstream targets;
+    "date": str, the date the bitstream was compiled on;
+    "time": str, the time the bitstream finished compilation;
+    "length": int, total length of the bitstream (in bytes);
+    "data": binary, binary data in .bit file format
+
+    Returns
+    -------
+    Dict
+        A dictionary containing the header information.
+
+    Note
+    ----
+    Implemented based on: https://blog.aeste.my/?p=2892
+
+    """
+    bit_dict, offset, length = _parse_bit_fields(bit_data)
+    bit_dict['data'] = bit_data[offset:offset + length]
     return bit_dict
 
 
@@ -107,17 +123,628 @@ def bit2bin(bit_data):
     return bytes(bin_buffer)
 
 
-def _preload_binfile(bitstream, parser):
+def bit2bin_file(bitfile, binfile, chunk_size=1024 * 1024):
+    """Convert a .bit file on disk to a .bin file for fpga_manager
+
+    The .bit file is memory-mapped and its header validated in place.
+    The 32-bit words are then byteswapped through a buffer of
+    `chunk_size` bytes and written straight to `binfile`, so peak memory
+    is bounded by the chunk size rather than the size of the bitstream.
+    The output is byte-identical to that of bit2bin.
+
+    Parameters
+    ----------
+    bitfile : str or Path
+        Path to the .bit file to convert.
+    binfile : str or Path
+        Path of the .bin file to write.
+    chunk_size : int
+        Number of bytes converted per write.
+
+    """
+    chunk_words = max(chunk_size >> 2, 1)
+    with open(bitfile, 'rb') as f:
+        mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        _, offset, length = _parse_bit_fields(mem)
+        if length % 4:
+            raise RuntimeError("Invalid length found")
+        if not length:
+            open(binfile, 'wb').close()
+            return
+        # Reading the words as big-endian into a native buffer performs
+        # the byteswap during the copy
+        words = np.frombuffer(mem, '>u4', length >> 2, offset)
+        chunk = None
+        try:
+            buffer = np.empty(min(chunk_words, len(words)), np.uint32)
+            with open(binfile, 'wb') as f:
+                for start in range(0, len(words), chunk_words):
+                    chunk = words[start:start + chunk_words]
+                    out = buffer[:len(chunk)]
+                    out[:] = chunk
+                    f.write(out)
+        finally:
+            # Release the views on the mapping before it is closed, also
+            # when writing failed, so that the original error is raised
+            del words, chunk
+    finally:
+        mem.close()
+
+
+def _file_digest(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks
+
+    """
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _temporary_path(path):
+    """A sibling of `path` that no other thread or process will write to
+
+    """
+    import threading
+    return path.with_name('.{}.{}.{}.tmp'.format(
+        path.name, os.getpid(), threading.get_ident()))
+
+
+class FirmwareCache:
+    """Content-addressed cache of .bin files converted from .bit files
+
+    Converted bitstreams are stored under `root` named by the SHA-256
+    digest of the source .bit file. A JSON index records the size and
+    mtime of every source file seen so that unchanged files are not
+    re-hashed, the last use of each entry for LRU eviction and the state
+    of every firmware file installed so that an identical file in
+    /lib/firmware is not rewritten. Updates of the index are serialised
+    across processes with an flock on a lock file next to it.
+
+    Attributes
+    ----------
+    root : Path
+        Directory holding the cached .bin files and the index.
+    max_size : int
+        Maximum total size in bytes of the cached .bin files. The least
+        recently used entries are evicted once this is exceeded.
+    hits : int
+        Number of lookups served from the cache.
+    misses : int
+        Number of lookups that required converting the bitstream.
+
+    """
+    INDEX_NAME = 'index.json'
+    LOCK_NAME = 'index.lock'
+
+    def __init__(self, root=None, max_size=256 * 1024 * 1024):
+        if root is None:
+            root = os.environ.get('PYNQ_FIRMWARE_CACHE',
+                                  '/var/cache/pynq/firmware')
+        self.root = Path(root)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        import threading
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the cache against other threads and other processes
+
+        """
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / self.LOCK_NAME, 'a') as f:
+                try:
+                    import fcntl
+                except ImportError:
+                    fcntl = None
+                if fcntl is not None:
+                    # Released when the file is closed
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+
+    def _load_index(self):
+        import json
+        try:
+            index = json.loads((self.root / self.INDEX_NAME).read_text())
+        except (OSError, ValueError):
+            index = {}
+        for key in ('sources', 'entries', 'firmware'):
+            index.setdefault(key, {})
+        return index
+
+    def _save_index(self, index):
+        import json
+        tmp = _temporary_path(self.root / self.INDEX_NAME)
+        tmp.write_text(json.dumps(index))
+        os.replace(tmp, self.root / self.INDEX_NAME)
+
+    def _entry_path(self, digest):
+        return self.root / (digest + '.bin')
+
+    def _digest(self, index, bitfile):
+        """Digest of `bitfile`, re-hashed only if its size or mtime changed
+
+        """
+        st = bitfile.stat()
+        key = str(bitfile.resolve())
+        source = index['sources'].get(key)
+        if source is not None and source['size'] == st.st_size and \
+                source['mtime_ns'] == st.st_mtime_ns:
+            return source['digest']
+        digest = _file_digest(bitfile)
+        index['sources'][key] = {'size': st.st_size,
+                                 'mtime_ns': st.st_mtime_ns,
+                                 'digest': digest}
+        return digest
+
+    def _convert(self, bitfile, entry):
+        tmp = _temporary_path(entry)
+        try:
+            bit2bin_file(bitfile, tmp)
+            os.replace(tmp, entry)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def _evict(self, index, keep):
+        entries = index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for digest in sorted(entries, key=lambda d: entries[d]['last_used']):
+            if total <= self.max_size:
+                break
+            if digest == keep:
+                continue
+            total -= entries[digest]['size']
+            del entries[digest]
+            try:
+                self._entry_path(digest).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _lookup(self, index, bitfile):
+        """Return the path of the cached .bin for `bitfile`, converting
+        and adding it to the cache on a miss
+
+        """
+        digest = self._digest(index, bitfile)
+        entry = self._entry_path(digest)
+        if digest in index['entries'] and entry.exists():
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._convert(bitfile, entry)
+            index['entries'][digest] = {'size': entry.stat().st_size}
+        index['entries'][digest]['last_used'] = time.time()
+        self._evict(index, digest)
+        return digest, entry
+
+    def get_bin_data(self, bitfile):
+        """Return the .bin data for a .bit file
+
+        Parameters
+        ----------
+        bitfile : str or Path
+            Path to the .bit file.
+
+        Returns
+        -------
+        bytes
+            The bitstream in the format expected by FPGA manager.
+
+        """
+        with self._locked():
+            index = self._load_index()
+            _, entry = self._lookup(index, Path(bitfile))
+            data = entry.read_bytes()
+            self._save_index(index)
+        return data
+
+    def install(self, bitfile, firmware_path):
+        """Make `firmware_path` contain the .bin data for a .bit file
+
+        The firmware file is only written if it does not already hold
+        the converted data for the current contents of `bitfile`.
+
+        Parameters
+        ----------
+        bitfile : str or Path
+            Path to the .bit file.
+        firmware_path : str or Path
+            Destination of the .bin file, usually in /lib/firmware.
+
+        Returns
+        -------
+        bool
+            True if the firmware file was written, False if it was
+            already up to date.
+
+        """
+        import shutil
+        firmware_path = Path(firmware_path)
+        with self._locked():
+            index = self._load_index()
+            digest, entry = self._lookup(index, Path(bitfile))
+            key = str(firmware_path.resolve())
+            installed = index['firmware'].get(key)
+            written = True
+            try:
+                st = firmware_path.stat()
+                if installed is not None and \
+                        installed['digest'] == digest and \
+                        installed['size'] == st.st_size and \
+                        installed['mtime_ns'] == st.st_mtime_ns:
+                    written = False
+            except FileNotFoundError:
+                pass
+            if written:
+                shutil.copyfile(entry, firmware_path)
+                st = firmware_path.stat()
+                index['firmware'][key] = {'digest': digest,
+                                          'size': st.st_size,
+                                          'mtime_ns': st.st_mtime_ns}
+            self._save_index(index)
+        return written
+
+    def clear(self):
+        """Remove all cached .bin files and reset the index
+
+        """
+        with self._locked():
+            for entry in self.root.glob('*.bin'):
+                entry.unlink()
+            try:
+                (self.root / self.INDEX_NAME).unlink()
+            except FileNotFoundError:
+                pass
+
+
+firmware_cache = FirmwareCache()
+
+
+def _process_io():
+    """Bytes read and written by this process so far, or (None, None)
+
+    Uses the rchar/wchar counters of /proc/self/io, which include reads
+    served from the page cache and writes to sysfs.
+
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes, or None
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Phase:
+    def __init__(self, profiler, name, attributes):
+        self._profiler = profiler
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self):
+        stack = self._profiler._stack()
+        self._parent = stack[-1] if stack else None
+        self._depth = len(stack)
+        stack.append(self._name)
+        self._read, self._written = _process_io()
+        self._peak = _peak_rss()
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        read, written = _process_io()
+        peak = _peak_rss()
+        self._profiler._stack().pop()
+        event = {
+            'phase': self._name,
+            'parent': self._parent,
+            'depth': self._depth,
+            'start': self._wall,
+            'duration': duration,
+            'read_bytes': None if read is None else read - self._read,
+            'written_bytes':
+                None if written is None else written - self._written,
+            'peak_rss': peak,
+            'peak_rss_growth':
+                None if peak is None else peak - self._peak,
+        }
+        if exc_type is not None:
+            event['error'] = repr(exc)
+        event.update(self._attributes)
+        self._profiler._record(event)
+        return False
+
+
+class DownloadProfiler:
+    """Opt-in timing of the phases of an overlay download
+
+    When enabled, every phase of `EmbeddedDevice.download` and of the
+    metadata loading before it produces an event with its wall time,
+    the bytes read and written by the process during the phase, and the
+    peak RSS of the process at its end together with how much the phase
+    raised it. Events are passed to the
+    registered hooks and kept for `summary`. When disabled, a phase
+    costs a single attribute check.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether phases are recorded.
+    events : collections.deque
+        The most recent events, oldest first.
+
+    """
+    _NULL_PHASE = contextlib.nullcontext()
+
+    def __init__(self, max_events=1000):
+        import threading
+        self.enabled = False
+        self.events = collections.deque(maxlen=max_events)
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, hook=None):
+        """Start recording phases, optionally adding a hook
+
+        """
+        if hook is not None:
+            self.add_hook(hook)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_hook(self, hook):
+        """Call `hook(event)` for every recorded phase
+
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+
+    def phase(self, name, **attributes):
+        """Context manager timing one phase
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+        **attributes
+            Extra JSON-compatible values stored in the event.
+
+        """
+        if not self.enabled:
+            return self._NULL_PHASE
+        return _Phase(self, name, attributes)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, name, duration, start=None, **fields):
+        """Record a phase that was timed elsewhere, e.g. in a worker process
+
+        Does nothing when the profiler is disabled.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+        duration : float
+            Wall time of the phase in seconds.
+        start : float
+            Wall-clock time the phase started, `duration` seconds before
+            now if None.
+        **fields
+            Measurements of the phase - read_bytes, written_bytes,
+            peak_rss and peak_rss_growth default to None - and extra
+            JSON-compatible attributes.
+
+        """
+        if not self.enabled:
+            return
+        event = {
+            'phase': name,
+            'parent': None,
+            'depth': 0,
+            'start': time.time() - duration if start is None else start,
+            'duration': duration,
+            'read_bytes': None,
+            'written_bytes': None,
+            'peak_rss': None,
+            'peak_rss_growth': None,
+        }
+        event.update(fields)
+        self._record(event)
+
+    def _record(self, event):
+        with self._lock:
+            self.events.append(event)
+            hooks = list(self._hooks)
+        for hook in hooks:
+            hook(event)
+
+    def summary(self):
+        """Per-phase totals and the recorded events
+
+        Returns
+        -------
+        dict
+            `phases` maps each phase name to its count, total, mean and
+            max duration in seconds and total bytes read and written;
+            `events` lists the individual events.
+
+        """
+        with self._lock:
+            events = list(self.events)
+        phases = {}
+        for event in events:
+            entry = phases.setdefault(event['phase'], {
+                'count': 0, 'total': 0.0, 'max': 0.0,
+                'read_bytes': 0, 'written_bytes': 0})
+            entry['count'] += 1
+            entry['total'] += event['duration']
+            entry['max'] = max(entry['max'], event['duration'])
+            for key in ('read_bytes', 'written_bytes'):
+                if event[key] is not None:
+                    entry[key] += event[key]
+        for entry in phases.values():
+            entry['mean'] = entry['total'] / entry['count']
+        return {'phases': phases, 'events': events}
+
+    def to_json(self, path=None, indent=2):
+        """Return the summary as JSON, also writing it to `path` if given
+
+        """
+        import json
+        text = json.dumps(self.summary(), indent=indent, default=str)
+        if path is not None:
+            Path(path).write_text(text)
+        return text
+
+
+download_profiler = DownloadProfiler()
+
+FIRMWARE_DIR = '/lib/firmware'
+
+
+def _preload_binfile(bitstream, parser, firmware_dir=FIRMWARE_DIR):
     """Dump the data from a parser into a binary file in firmware
 
+    Nothing is written if overlay_prefetcher has already prepared the
+    firmware file for the bitstream.
+
     """
+    bitstream.binfile_name = Path(bitstream.bitfile_name).stem + ".bin"
+    bitstream.firmware_path = Path(firmware_dir) / bitstream.binfile_name
+    if overlay_prefetcher.firmware_ready(bitstream.bitfile_name,
+                                         bitstream.firmware_path):
+        return
     bin_data = getattr(parser, 'bin_data', None)
     if bin_data is None:
-        bin_data = _get_bitstream_handler(
-            bitstream.bitfile_name).get_bin_data()
-    bitstream.binfile_name = Path(bitstream.bitfile_name).stem + ".bin"
-    bitstream.firmware_path = Path('/lib/firmware') / bitstream.binfile_name
-    bitstream.firmware_path.write_bytes(bin_data)
+        _get_bitstream_handler(
+            bitstream.bitfile_name).write_firmware(bitstream.firmware_path)
+    else:
+        bitstream.firmware_path.write_bytes(bin_data)
+
+
+_METADATA_CACHE_VERSION = 2
+
+_PARSER_ATTRIBUTES = (
+    'ip_dict', 'gpio_dict', 'interrupt_controllers', 'interrupt_pins',
+    'hierarchy_dict', 'clock_dict', 'mem_dict', 'nets', 'pins',
+    'ps_name', 'family_ps', 'family_irq', 'family_gpio', 'partial',
+    'axi_port_width_plan'
+)
+
+
+def _metadata_to_json(obj):
+    """Convert parser metadata into a JSON-compatible structure
+
+    Types that JSON cannot represent directly are tagged so that
+    _metadata_from_json can restore them exactly.
+
+    """
+    if obj is None or type(obj) in (str, int, float, bool):
+        return obj
+    if type(obj) is dict:
+        if all(type(k) is str and not k.startswith('__') for k in obj):
+            return {k: _metadata_to_json(v) for k, v in obj.items()}
+        return {'__items__': [[_metadata_to_json(k), _metadata_to_json(v)]
+                              for k, v in obj.items()]}
+    if type(obj) is list:
+        return [_metadata_to_json(v) for v in obj]
+    if type(obj) is tuple:
+        return {'__tuple__': [_metadata_to_json(v) for v in obj]}
+    if type(obj) is set:
+        return {'__set__': [_metadata_to_json(v) for v in obj]}
+    if type(obj) is bytes:
+        import base64
+        return {'__bytes__': base64.b64encode(obj).decode()}
+    raise TypeError("Cannot cache metadata of type {}".format(type(obj)))
+
+
+def _metadata_from_json(obj):
+    """Inverse of _metadata_to_json
+
+    """
+    if type(obj) is list:
+        return [_metadata_from_json(v) for v in obj]
+    if type(obj) is not dict:
+        return obj
+    if '__items__' in obj:
+        return {_metadata_from_json(k): _metadata_from_json(v)
+                for k, v in obj['__items__']}
+    if '__tuple__' in obj:
+        return tuple(_metadata_from_json(v) for v in obj['__tuple__'])
+    if '__set__' in obj:
+        return {_metadata_from_json(v) for v in obj['__set__']}
+    if '__bytes__' in obj:
+        import base64
+        return base64.b64decode(obj['__bytes__'])
+    return {k: _metadata_from_json(v) for k, v in obj.items()}
+
+
+def _metadata_key(hwh_data, xclbin_data, dtbo_data):
+    """Content hash of the metadata inputs of a bitstream
+
+    """
+    import hashlib
+    h = hashlib.sha256(
+        'pynq-metadata-v{}'.format(_METADATA_CACHE_VERSION).encode())
+    for data in (hwh_data, xclbin_data, dtbo_data):
+        if data is None:
+            h.update(b'\x00')
+        else:
+            if isinstance(data, str):
+                data = data.encode()
+            h.update(b'\x01' + struct.pack('<Q', len(data)))
+            h.update(data)
+    return h.hexdigest()
+
+
+class CachedParser:
+    """Parser restored from the on-disk metadata cache
+
+    Holds the same metadata attributes as the HWH or XclBin parser it
+    was created from, so it can be used in their place by the Overlay
+    and Device classes.
+
+    """
+    def __init__(self, attributes):
+        for k, v in attributes.items():
+            setattr(self, k, v)
 
 
 class BitstreamHandler:
@@ -128,10 +755,16 @@ class BitstreamHandler:
     the Overlay class. If the bitstream is going to be used with
     the Bitstream class then only get_bin_data is required.
 
+    Handlers that set `_defer_bin_data` leave the conversion to
+    write_firmware at download time rather than doing it in get_parser.
+
     """
+    _defer_bin_data = False
 
     def __init__(self, filepath):
         self._filepath = Path(filepath)
+        self._metadata_file = self._filepath.with_name(
+            '.' + self._filepath.name + '.metadata.json')
 
     def get_bin_data(self):
         """Get the binary data of the bitstream in a form suitable
@@ -140,6 +773,12 @@ class BitstreamHandler:
         """
         return None
 
+    def write_firmware(self, firmware_path):
+        """Write the binary data of the bitstream to `firmware_path`
+
+        """
+        firmware_path.write_bytes(self.get_bin_data())
+
     def get_xclbin_data(self):
         """Return the xclbin data for the bitstream
 
@@ -173,6 +812,49 @@ class BitstreamHandler:
             return hwh_file.read_text()
         return None
 
+    def _load_cached_parser(self, key):
+        """Return the parser stored in the metadata cache for `key`
+
+        Returns None if there is no cache file or it was created from
+        different metadata.
+
+        """
+        import json
+        try:
+            cached = json.loads(self._metadata_file.read_text())
+        except (OSError, ValueError):
+            return None
+        if cached.get('key') != key:
+            return None
+        return CachedParser(_metadata_from_json(cached['attributes']))
+
+    def _save_cached_parser(self, key, parser, xclbin_data):
+        """Store the merged metadata of `parser` in the metadata cache
+
+        `xclbin_data` is only stored when it was synthesized rather than
+        read from the inputs. The cache is best effort - failing to
+        write it does not prevent the parser from being used.
+
+        """
+        import json
+        attributes = {k: getattr(parser, k) for k in _PARSER_ATTRIBUTES
+                      if hasattr(parser, k)}
+        if xclbin_data is not None:
+            attributes['xclbin_data'] = bytes(xclbin_data)
+        # Prefetch workers and the application may save the same cache
+        # file at once, so each writer needs its own temporary file
+        tmp = _temporary_path(self._metadata_file)
+        try:
+            cached = {'key': key,
+                      'attributes': _metadata_to_json(attributes)}
+            tmp.write_text(json.dumps(cached))
+            os.replace(tmp, self._metadata_file)
+        except (OSError, TypeError):
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
     def get_parser(self):
         """Returns a parser object for the bitstream
 
@@ -181,31 +863,64 @@ class BitstreamHandler:
         attached to the object. Note that the parser may
         contain synthetic xclbin data where that is necessary
 
+        The merged metadata is cached in a hidden JSON file next to
+        the bitstream, keyed by a hash of the HWH, xclbin and dtbo
+        inputs, so that later loads of the same design skip parsing.
+
         """
+        with download_profiler.phase('get_parser',
+                                     bitfile=str(self._filepath)):
+            return self._get_parser()
+
+    def _get_parser(self):
         from .xclbin_parser import XclBin
         from .hwh_parser import HWH
         hwh_data = self.get_hwh_data()
         xclbin_data = self.get_xclbin_data()
-        if hwh_data is not None:
+        dtbo_data = self.get_dtbo_data()
+        if hwh_data is None and xclbin_data is None:
+            return None
+        key = _metadata_key(hwh_data, xclbin_data, dtbo_data)
+        parser = self._load_cached_parser(key)
+        if parser is None and hwh_data is not None:
             parser = HWH(hwh_data=hwh_data)
+            synthesized = None
             if xclbin_data is None:
-                xclbin_data = _create_xclbin(parser.mem_dict)
+                xclbin_data = synthesized = _create_xclbin(parser.mem_dict)
             xclbin_parser = XclBin(xclbin_data=xclbin_data)
             _unify_dictionaries(parser, xclbin_parser)
-        elif xclbin_data is not None:
+            axi_port_width_plan(parser)
+            self._save_cached_parser(key, parser, synthesized)
+        elif parser is None:
             parser = XclBin(xclbin_data=xclbin_data)
+            axi_port_width_plan(parser)
+            self._save_cached_parser(key, parser, None)
+        if self._defer_bin_data:
+            parser.bin_data = None
         else:
-            return None
-        parser.bin_data = self.get_bin_data()
-        parser.xclbin_data = xclbin_data
-        parser.dtbo_data = self.get_dtbo_data()
+            parser.bin_data = self.get_bin_data()
+        if xclbin_data is not None:
+            parser.xclbin_data = xclbin_data
+        parser.dtbo_data = dtbo_data
         return parser
 
 
 class BitfileHandler(BitstreamHandler):
+    _defer_bin_data = True
+
     def get_bin_data(self):
-        bit_data = self._filepath.read_bytes()
-        return bit2bin(bit_data)
+        try:
+            return firmware_cache.get_bin_data(self._filepath)
+        except OSError:
+            # The cache directory is not usable, e.g. when running
+            # unprivileged, so convert without it
+            return bit2bin(self._filepath.read_bytes())
+
+    def write_firmware(self, firmware_path):
+        try:
+            firmware_cache.install(self._filepath, firmware_path)
+        except OSError:
+            bit2bin_file(self._filepath, firmware_path)
 
 
 class BinfileHandler(BitstreamHandler):
@@ -230,6 +945,48 @@ class XclbinHandler(BitstreamHandler):
         return self._data
 
 
+def benchmark_get_parser(bitfile_names, repeat=5):
+    """Compare cold and warm get_parser times for a set of bitstreams
+
+    For each bitstream the metadata cache is removed and get_parser is
+    timed once to give the cold time, then timed `repeat` more times
+    against the populated cache and the fastest run taken as the warm
+    time.
+
+    Parameters
+    ----------
+    bitfile_names : list
+        Paths to .bit, .bin or .xclbin files with their metadata.
+    repeat : int
+        Number of warm runs per bitstream.
+
+    Returns
+    -------
+    dict
+        For each bitstream a dictionary of 'cold' and 'warm' times in
+        seconds and the resulting 'speedup'.
+
+    """
+    results = {}
+    for bitfile_name in bitfile_names:
+        handler = _get_bitstream_handler(bitfile_name)
+        try:
+            handler._metadata_file.unlink()
+        except FileNotFoundError:
+            pass
+        start = time.perf_counter()
+        handler.get_parser()
+        cold = time.perf_counter() - start
+        warm = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            handler.get_parser()
+            warm = min(warm, time.perf_counter() - start)
+        results[str(bitfile_name)] = {'cold': cold, 'warm': warm,
+                                      'speedup': cold / warm}
+    return results
+
+
 _bitstream_handlers = {
     '.bit': BitfileHandler,
     '.bin': BinfileHandler,
@@ -244,6 +1001,415 @@ def _get_bitstream_handler(bitfile_name):
     return _bitstream_handlers[filetype](bitfile_name)
 
 
+def _prefetch_overlay(bitfile_name, firmware_dir):
+    """Prepare the metadata cache and firmware file of one bitstream
+
+    Runs in a prefetch worker process. The parser itself is not returned
+    - the merged metadata reaches the caller through the on-disk cache
+    written by get_parser.
+
+    """
+    import types
+    start = time.perf_counter()
+    source = os.stat(bitfile_name)
+    parser = _get_bitstream_handler(bitfile_name).get_parser()
+    bitstream = types.SimpleNamespace(bitfile_name=bitfile_name,
+                                      binfile_name='')
+    _preload_binfile(bitstream, parser, firmware_dir)
+    firmware = os.stat(bitstream.firmware_path)
+    return {
+        'firmware_path': str(bitstream.firmware_path),
+        'has_metadata': parser is not None,
+        'source': (source.st_size, source.st_mtime_ns),
+        'firmware': (firmware.st_size, firmware.st_mtime_ns),
+        'duration': time.perf_counter() - start,
+        'peak_rss': _peak_rss(),
+    }
+
+
+def _estimate_prefetch_memory(bitfile_name, hwh_factor=20):
+    """Rough upper bound in bytes on the memory used to prefetch a bitstream
+
+    The bitstream and its converted copy are held in memory and the
+    parsed HWH takes several times the size of the XML text.
+
+    """
+    path = Path(bitfile_name)
+    estimate = 0
+    for suffix, factor in (('.hwh', hwh_factor), ('.xclbin', 2),
+                           (path.suffix, 2)):
+        try:
+            estimate += path.with_suffix(suffix).stat().st_size * factor
+        except OSError:
+            pass
+    return estimate
+
+
+class _PrefetchJob:
+    def __init__(self, bitfile_name, memory):
+        self.bitfile_name = bitfile_name
+        self.memory = memory
+        self.state = 'queued'
+        self.future = None
+        self.result = None
+        self.error = None
+
+
+class OverlayPrefetcher:
+    """Prepare overlays that are likely to be downloaded next
+
+    For each bitstream passed to `prefetch` a worker process parses the
+    metadata, which get_parser stores in the metadata cache next to the
+    bitstream, and writes the .bin file to the firmware directory. A
+    later download of a ready overlay loads the cached metadata and
+    finds its firmware file already in place, so only the FPGA manager
+    write is left on the critical path.
+
+    Work is done in a process pool so that parsing does not hold the
+    GIL of the application. At most `max_workers` bitstreams are
+    prepared at once and, beyond the first, only while the estimated
+    memory of the running jobs stays below `max_memory`.
+
+    Attributes
+    ----------
+    firmware_dir : str or Path
+        Directory the .bin files are written to.
+    max_workers : int
+        Maximum number of bitstreams prepared at the same time.
+    max_memory : int
+        Budget in bytes for the estimated memory of the running jobs.
+
+    """
+    def __init__(self, max_workers=2, max_memory=512 * 1024 * 1024,
+                 firmware_dir=None, mp_context=None):
+        import threading
+        self.firmware_dir = FIRMWARE_DIR if firmware_dir is None \
+            else firmware_dir
+        self.max_workers = max_workers
+        self.max_memory = max_memory
+        self._mp_context = mp_context
+        self._executor = None
+        self._jobs = {}
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _key(bitfile_name):
+        return str(Path(bitfile_name).resolve())
+
+    def _get_executor(self):
+        if self._executor is None:
+            import concurrent.futures
+            import multiprocessing
+            import sys
+            # Workers are spawned rather than forked so that they do not
+            # inherit locks or device mappings held by the application
+            context = self._mp_context or multiprocessing.get_context('spawn')
+            kwargs = {}
+            if sys.version_info >= (3, 11) and \
+                    context.get_start_method() != 'fork':
+                # A fresh worker per bitstream returns the memory of each
+                # parse to the system as soon as it is done
+                kwargs['max_tasks_per_child'] = 1
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.max_workers, mp_context=context, **kwargs)
+        return self._executor
+
+    def prefetch(self, bitfile_names, cancel_stale=True):
+        """Start preparing bitstreams in the background
+
+        Parameters
+        ----------
+        bitfile_names : list
+            Paths of the bitstreams likely to be used next, most likely
+            first. Bitstreams that are already ready are not redone.
+        cancel_stale : bool
+            Cancel the queued and running work for bitstreams that are
+            not in `bitfile_names`.
+
+        """
+        keys = [self._key(name) for name in bitfile_names]
+        with self._condition:
+            if cancel_stale:
+                self._cancel([k for k in self._jobs if k not in keys])
+            for key in keys:
+                job = self._jobs.get(key)
+                if job is not None and job.state in ('queued', 'running'):
+                    continue
+                if job is not None and job.state == 'cancelled' and \
+                        job.future is not None:
+                    # Still running in a worker, keep its result after all
+                    job.state = 'running'
+                    continue
+                if job is not None and job.state == 'ready' and \
+                        self._is_current(job):
+                    continue
+                self._jobs[key] = _PrefetchJob(
+                    key, _estimate_prefetch_memory(key))
+            # Queued work follows the order of the latest request
+            queued = [k for k in keys if self._jobs[k].state == 'queued']
+            self._pending = collections.deque(
+                dict.fromkeys(queued + [k for k in self._pending
+                                        if k not in queued]))
+            self._schedule()
+
+    def cancel(self, bitfile_names=None):
+        """Cancel queued and running work
+
+        Work that has already started in a worker process runs to
+        completion but its result is discarded.
+
+        Parameters
+        ----------
+        bitfile_names : list
+            Bitstreams to cancel, all of them if None.
+
+        """
+        with self._condition:
+            if bitfile_names is None:
+                keys = list(self._jobs)
+            else:
+                keys = [self._key(name) for name in bitfile_names]
+            self._cancel(keys)
+            self._condition.notify_all()
+
+    def _cancel(self, keys):
+        for key in keys:
+            job = self._jobs.get(key)
+            if job is None or job.state not in ('queued', 'running'):
+                continue
+            if job.state == 'queued':
+                self._pending.remove(key)
+            elif job.future.cancel():
+                job.future = None
+            job.state = 'cancelled'
+
+    def _schedule(self):
+        while self._pending:
+            running = [job for job in self._jobs.values()
+                       if job.future is not None]
+            job = self._jobs[self._pending[0]]
+            if len(running) >= self.max_workers or running and \
+                    sum(r.memory for r in running) + job.memory > \
+                    self.max_memory:
+                break
+            self._pending.popleft()
+            job.state = 'running'
+            try:
+                job.future = self._get_executor().submit(
+                    _prefetch_overlay, job.bitfile_name, self.firmware_dir)
+            except RuntimeError as e:
+                job.state = 'failed'
+                job.error = repr(e)
+                self._executor = None
+                continue
+            job.future.add_done_callback(
+                lambda future, job=job: self._finished(job, future))
+
+    def _finished(self, job, future):
+        from concurrent.futures.process import BrokenProcessPool
+        with self._condition:
+            if job.future is not future:
+                return
+            job.future = None
+            if job.state == 'running':
+                error = None if future.cancelled() else future.exception()
+                if future.cancelled():
+                    job.state = 'cancelled'
+                elif error is not None:
+                    job.state = 'failed'
+                    job.error = repr(error)
+                    if isinstance(error, BrokenProcessPool):
+                        self._executor = None
+                else:
+                    job.state = 'ready'
+                    job.result = future.result()
+                    result = job.result
+                    download_profiler.record(
+                        'prefetch', result['duration'],
+                        written_bytes=result['firmware'][0],
+                        peak_rss=result['peak_rss'],
+                        bitfile=job.bitfile_name)
+            self._schedule()
+            self._condition.notify_all()
+
+    @staticmethod
+    def _is_current(job):
+        """Whether the bitstream and firmware file are unchanged since
+        the job completed
+
+        """
+        try:
+            source = os.stat(job.bitfile_name)
+            firmware = os.stat(job.result['firmware_path'])
+        except OSError:
+            return False
+        return (source.st_size, source.st_mtime_ns) == \
+            tuple(job.result['source']) and \
+            (firmware.st_size, firmware.st_mtime_ns) == \
+            tuple(job.result['firmware'])
+
+    def firmware_ready(self, bitfile_name, firmware_path):
+        """Whether `firmware_path` holds prefetched firmware for a bitstream
+
+        """
+        with self._condition:
+            job = self._jobs.get(self._key(bitfile_name))
+            return job is not None and job.state == 'ready' and \
+                os.path.abspath(job.result['firmware_path']) == \
+                os.path.abspath(firmware_path) and self._is_current(job)
+
+    def status(self, bitfile_names=None):
+        """Report the readiness of prefetched bitstreams
+
+        Parameters
+        ----------
+        bitfile_names : list
+            Bitstreams to report, all known ones if None.
+
+        Returns
+        -------
+        dict
+            For each bitstream its 'state' - one of 'queued', 'running',
+            'ready', 'stale', 'failed', 'cancelled' or 'unknown' - and for
+            completed work the 'firmware_path', the 'duration' in seconds
+            and the 'peak_rss' of the worker or the 'error'.
+
+        """
+        with self._condition:
+            if bitfile_names is None:
+                keys = list(self._jobs)
+            else:
+                keys = [self._key(name) for name in bitfile_names]
+            report = {}
+            for key in keys:
+                job = self._jobs.get(key)
+                if job is None:
+                    report[key] = {'state': 'unknown'}
+                    continue
+                entry = {'state': job.state}
+                if job.state == 'ready':
+                    if not self._is_current(job):
+                        entry['state'] = 'stale'
+                    for k in ('firmware_path', 'duration', 'peak_rss'):
+                        entry[k] = job.result[k]
+                elif job.state == 'failed':
+                    entry['error'] = job.error
+                report[key] = entry
+            return report
+
+    def wait(self, bitfile_names=None, timeout=None):
+        """Wait for queued and running work to finish
+
+        Parameters
+        ----------
+        bitfile_names : list
+            Bitstreams to wait for, all known ones if None.
+        timeout : float
+            Maximum time to wait in seconds, no limit if None.
+
+        Returns
+        -------
+        bool
+            True if all of the work finished within the timeout.
+
+        """
+        def done():
+            if bitfile_names is None:
+                jobs = self._jobs.values()
+            else:
+                jobs = [self._jobs.get(self._key(name))
+                        for name in bitfile_names]
+            return all(job is None or job.state not in ('queued', 'running')
+                       for job in jobs)
+
+        with self._condition:
+            return self._condition.wait_for(done, timeout)
+
+    def shutdown(self, wait=True):
+        """Cancel outstanding work and stop the worker processes
+
+        """
+        self.cancel()
+        with self._condition:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+overlay_prefetcher = OverlayPrefetcher()
+
+
+def benchmark_prefetch(bitfile_names, firmware_dir, max_workers=2):
+    """Compare overlay switch times with and without prefetching
+
+    The switch time is the part of a download that precedes the FPGA
+    manager write: get_parser and preparing the firmware file. For the
+    cold case the metadata cache and firmware file of every bitstream
+    are removed before switching; for the prefetched case they are
+    prepared by an OverlayPrefetcher first.
+
+    Parameters
+    ----------
+    bitfile_names : list
+        Paths to .bit, .bin or .xclbin files with their metadata.
+    firmware_dir : str or Path
+        Scratch directory to write the firmware files to.
+    max_workers : int
+        Number of prefetch worker processes.
+
+    Returns
+    -------
+    dict
+        'switch' maps each bitstream to its 'cold' and 'prefetched'
+        switch times in seconds, 'prefetch_time' is the time taken to
+        prepare all of them and 'status' the final prefetcher status.
+
+    """
+    import types
+    global overlay_prefetcher
+
+    def switch(bitfile_name):
+        start = time.perf_counter()
+        parser = _get_bitstream_handler(bitfile_name).get_parser()
+        bitstream = types.SimpleNamespace(bitfile_name=bitfile_name,
+                                          binfile_name='')
+        _preload_binfile(bitstream, parser, firmware_dir)
+        return time.perf_counter() - start
+
+    def clean():
+        for bitfile_name in bitfile_names:
+            handler = _get_bitstream_handler(bitfile_name)
+            for path in (handler._metadata_file, Path(firmware_dir) /
+                         (Path(bitfile_name).stem + '.bin')):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    results = {str(name): {} for name in bitfile_names}
+    clean()
+    for bitfile_name in bitfile_names:
+        results[str(bitfile_name)]['cold'] = switch(bitfile_name)
+
+    clean()
+    prefetcher = OverlayPrefetcher(max_workers, firmware_dir=firmware_dir)
+    saved_prefetcher, overlay_prefetcher = overlay_prefetcher, prefetcher
+    try:
+        start = time.perf_counter()
+        prefetcher.prefetch(bitfile_names)
+        prefetcher.wait()
+        prefetch_time = time.perf_counter() - start
+        for bitfile_name in bitfile_names:
+            results[str(bitfile_name)]['prefetched'] = switch(bitfile_name)
+        status = prefetcher.status()
+    finally:
+        overlay_prefetcher = saved_prefetcher
+        prefetcher.shutdown()
+    return {'switch': results, 'prefetch_time': prefetch_time,
+            'status': status}
+
+
 BLANK_METADATA = r"""<?xml version="1.0" encoding="UTF-8"?>
 <project name="binary_container_1">
   <platform vendor="xilinx" boardid="zcu111" name="name" featureRomTime="0">
@@ -311,32 +1477,98 @@ def _ip_to_topology(mem_dict):
     return {'mem_topology': topology}
 
 
-def _as_str(obj):
-    if type(obj) is bytes:
-        return obj.decode()
-    return obj
+_AXLF_SECTION_EMBEDDED_METADATA = 2
+_AXLF_SECTION_MEM_TOPOLOGY = 6
+
+_MEM_TYPES = {
+    'MEM_DDR3': 0,
+    'MEM_DDR4': 1,
+    'MEM_DRAM': 2,
+    'MEM_STREAMING': 3,
+    'MEM_PREALLOCATED_GLOB': 4,
+    'MEM_ARE': 5,
+    'MEM_HBM': 6,
+    'MEM_BRAM': 7,
+    'MEM_URAM': 8,
+    'MEM_STREAMING_CONNECTION': 9
+}
+
+# struct axlf up to, but not including, the first section header
+_AXLF_FORMAT = '<8si28s256sQ' + 'QQQHBBHH16s64s16s16sI4x'
+_AXLF_SECTION_HEADER_FORMAT = '<I16s4xQQ'
+_MEM_DATA_FORMAT = '<BB6xQQ16s'
+
+
+def _pack_mem_topology(topology):
+    """Pack the output of _ip_to_topology into a MEM_TOPOLOGY section
+
+    """
+    mem_data = topology['mem_topology']['m_mem_data']
+    packed = [struct.pack('<i4x', len(mem_data))]
+    for m in mem_data:
+        packed.append(struct.pack(
+            _MEM_DATA_FORMAT, _MEM_TYPES[m['m_type']], m['m_used'],
+            m['m_sizeKB'], m['m_base_address'], m['m_tag'].encode()[:15]))
+    return b''.join(packed)
+
+
+def _pack_xclbin(sections):
+    """Assemble an axlf container from a list of (kind, name, data)
+
+    The header fields mirror those written by xclbinutil for an
+    unsigned, flat xclbin. The UUID is derived from the section contents
+    so that the same memories always produce the same file.
+
+    """
+    import hashlib
+    header_size = struct.calcsize(_AXLF_FORMAT)
+    section_size = struct.calcsize(_AXLF_SECTION_HEADER_FORMAT)
+    offset = header_size + section_size * len(sections)
+    headers = []
+    payload = []
+    digest = hashlib.sha256()
+    for kind, name, data in sections:
+        padding = -offset % 8
+        payload.append(b'\x00' * padding + data)
+        offset += padding
+        headers.append(struct.pack(_AXLF_SECTION_HEADER_FORMAT, kind,
+                                   name.encode(), offset, len(data)))
+        offset += len(data)
+        digest.update(struct.pack('<IQ', kind, len(data)) + data)
+    header = struct.pack(
+        _AXLF_FORMAT,
+        b'xclbin2\x00',  # m_magic
+        -1,  # m_signature_length, no signature
+        b'\xff' * 28,  # reserved
+        b'\xff' * 256,  # m_keyBlock
+        0,  # m_uniqueId
+        offset,  # m_length
+        0,  # m_timeStamp
+        0,  # m_featureRomTimeStamp
+        0, 2, 8,  # m_versionPatch, m_versionMajor, m_versionMinor
+        0,  # m_mode, XCLBIN_FLAT
+        0,  # m_actionMask
+        b'',  # m_interface_uuid
+        b'',  # m_platformVBNV
+        digest.digest()[:16],  # uuid
+        b'',  # m_debug_bin
+        len(sections))
+    return b''.join([header] + headers + payload)
 
 
 def _create_xclbin(mem_dict):
     """Create an XCLBIN file containing the specified memories
 
+    The xclbin is assembled in-process with the EMBEDDED_METADATA and
+    MEM_TOPOLOGY sections that xclbinutil would otherwise produce.
+
     """
-    import tempfile
-    import subprocess
-    import json
-    with tempfile.TemporaryDirectory() as td:
-        td = Path(td)
-        (td / 'metadata.xml').write_text(BLANK_METADATA)
-        (td / 'mem.json').write_text(json.dumps(_ip_to_topology(mem_dict)))
-        completion = subprocess.run(
-            ['xclbinutil', '--add-section=EMBEDDED_METADATA:RAW:metadata.xml',
-             '--add-section=MEM_TOPOLOGY:JSON:mem.json', '--output',
-             't.xclbin', '--skip-bank-grouping'],
-            cwd=td, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        if completion.returncode != 0:
-            raise RuntimeError("xclbinutil failed: " +
-                               _as_str(completion.stdout))
-        return (td / 't.xclbin').read_bytes()
+    return _pack_xclbin([
+        (_AXLF_SECTION_EMBEDDED_METADATA, 'metadata',
+         BLANK_METADATA.encode()),
+        (_AXLF_SECTION_MEM_TOPOLOGY, 'mem',
+         _pack_mem_topology(_ip_to_topology(mem_dict)))
+    ])
 
 
 ZU_FPD_SLCR_REG = {
@@ -446,6 +1678,225 @@ ZU_AXIFM_VALUE = {
 }
 
 
+RegisterUpdate = collections.namedtuple(
+    'RegisterUpdate', ['address', 'mask', 'value', 'fields'])
+RegisterUpdate.__doc__ = """Update of one physical PS register
+
+Attributes
+----------
+address : int
+    Physical address of the 32-bit register.
+mask : int
+    Bits owned by the fields being set.
+value : int
+    Target value of the masked bits.
+fields : tuple of str
+    Names of the register fields merged into this update.
+
+"""
+
+
+def _port_width_fields(parameter_dict):
+    """Yield (name, address, field, value) for every field a design sets
+
+    """
+    for regs, values in ((ZU_FPD_SLCR_REG, ZU_FPD_SLCR_VALUE),
+                         (ZU_AXIFM_REG, ZU_AXIFM_VALUE)):
+        for para, fields in regs.items():
+            if para in parameter_dict:
+                value = values[parameter_dict[para]]
+                for name, reg in fields.items():
+                    yield name, reg['addr'], reg['field'], value
+
+
+def axi_port_width_plan(parser):
+    """Resolve the PS AXI port widths required by a design
+
+    Fields that share a physical register, such as DW_SS0_SEL and
+    DW_SS1_SEL at 0xFD615000, are merged into a single update. The plan
+    is stored on the parser, and therefore in the metadata cache, so it
+    is only computed once per design.
+
+    Parameters
+    ----------
+    parser : HWH, XclBin or CachedParser
+        Parsed metadata of the design.
+
+    Returns
+    -------
+    tuple of RegisterUpdate
+        One update per physical register, sorted by address. Empty for
+        designs that do not need port width changes.
+
+    """
+    plan = getattr(parser, 'axi_port_width_plan', None)
+    if plan is None:
+        updates = {}
+        # Setting port widths is not supported for xclbin-only designs
+        if getattr(parser, 'family_ps', None) == 'zynq_ultra_ps_e' and \
+                getattr(parser, 'ps_name', None):
+            parameter_dict = parser.ip_dict[parser.ps_name]['parameters']
+            for name, addr, field, value in _port_width_fields(
+                    parameter_dict):
+                high, low = field
+                mask = ((1 << (high - low + 1)) - 1) << low
+                update = updates.setdefault(addr, [addr, 0, 0, ()])
+                update[1] |= mask
+                update[2] = (update[2] & ~mask) | (value << low)
+                update[3] += (name,)
+        # Plain tuples so that the plan can be stored in the JSON cache
+        plan = tuple(tuple(updates[addr]) for addr in sorted(updates))
+        parser.axi_port_width_plan = plan
+    return tuple(RegisterUpdate(*update) for update in plan)
+
+
+def apply_register_plan(plan, registers):
+    """Apply register updates with one read and at most one write each
+
+    Registers whose masked bits already hold the target value are not
+    written.
+
+    Parameters
+    ----------
+    plan : iterable of RegisterUpdate
+        Updates as returned by `axi_port_width_plan`.
+    registers : object
+        Register space providing `read(address)` and
+        `write(address, value)` on physical addresses.
+
+    Returns
+    -------
+    list of RegisterUpdate
+        The updates that required a write.
+
+    """
+    written = []
+    for update in plan:
+        current = registers.read(update.address)
+        target = (current & ~update.mask) | update.value
+        if target != current:
+            registers.write(update.address, target)
+            written.append(update)
+    return written
+
+
+class PhysicalRegisters:
+    """32-bit register access through a memory mapping function
+
+    Parameters
+    ----------
+    mmap : callable
+        Function `mmap(base_addr, length)` returning a uint32 array, such
+        as `EmbeddedDevice.mmap` or `MmapPool.map`.
+
+    """
+    def __init__(self, mmap):
+        self._mmap = mmap
+
+    def read(self, address):
+        return int(self._mmap(address, 4)[0])
+
+    def write(self, address, value):
+        self._mmap(address, 4)[0] = value
+
+
+class MmapPool:
+    """Pool of shared, page-aligned mappings of a memory device
+
+    Requests are served from windows aligned to `window_size`. A request
+    that falls inside an existing window reuses its mapping rather than
+    creating a new one, so IP sharing the same AXI-Lite pages share a
+    single mapping. The pool only holds a weak reference to each mapping;
+    every array handed out, and every slice or view of it, keeps the
+    mapping alive, and the window is dropped from the pool once the last
+    of them has been garbage collected.
+
+    Any file can stand in for /dev/mem, which allows the pool to be used
+    without root permissions.
+
+    Attributes
+    ----------
+    path : str
+        The device or file that is mapped.
+    window_size : int
+        Granularity of the mappings in bytes.
+
+    """
+    def __init__(self, path='/dev/mem', window_size=64 * 1024):
+        import threading
+        if window_size <= 0 or window_size % mmap.ALLOCATIONGRANULARITY:
+            raise ValueError("Window size must be a multiple of {}".format(
+                mmap.ALLOCATIONGRANULARITY))
+        self.path = path
+        self.window_size = window_size
+        # (base, size) -> weak reference to the mmap of the window
+        self._windows = {}
+        # Mappings can be collected, and drop their window, while the
+        # lock is held by the same thread
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for ref in list(self._windows.values())
+                       if ref() is not None)
+
+    def _find_window(self, start, end):
+        """Return the live mapping covering [start, end) and its base
+
+        """
+        # Iterate over a copy - collecting an unrelated view during the
+        # loop can remove its window from the dictionary
+        for (base, size), ref in list(self._windows.items()):
+            if base <= start and end <= base + size:
+                mem = ref()
+                if mem is not None:
+                    return mem, base
+        return None, None
+
+    def map(self, base_addr, length):
+        """Return a view of `length` bytes at `base_addr`
+
+        Parameters
+        ----------
+        base_addr : int
+            Physical address, or file offset, of the region.
+        length : int
+            Length of the region in bytes.
+
+        Returns
+        -------
+        numpy.ndarray
+            A uint32 array backed by the shared mapping.
+
+        """
+        with self._lock:
+            mem, base = self._find_window(base_addr, base_addr + length)
+            if mem is None:
+                base = base_addr & ~(self.window_size - 1)
+                size = -(-(base_addr + length - base) // self.window_size) \
+                    * self.window_size
+                fd = os.open(self.path, os.O_RDWR | os.O_SYNC)
+                try:
+                    mem = mmap.mmap(fd, size, mmap.MAP_SHARED,
+                                    mmap.PROT_READ | mmap.PROT_WRITE,
+                                    offset=base)
+                finally:
+                    os.close(fd)
+                key = (base, size)
+                self._windows[key] = weakref.ref(
+                    mem, lambda ref, key=key: self._release(key, ref))
+            return np.frombuffer(mem, np.uint32, length >> 2,
+                                 base_addr - base)
+
+    def _release(self, key, ref):
+        """Drop a window once its mapping has been collected
+
+        """
+        with self._lock:
+            if self._windows.get(key) is ref:
+                del self._windows[key]
+
+
 class EmbeddedXrtMemory(XrtMemory):
     def __init__(self, device, desc):
         super().__init__(device, desc)
@@ -481,7 +1932,7 @@ class EmbeddedDevice(XrtDevice):
      * Xclbin file containing a bitstream
      * XSA file containing a bitstream
 
-    In situations where an xclbin file isn't provided a temporary one
+    In situations where an xclbin file isn't provided a synthetic one
     will be created so that all memories in the design can be allocated
     with XRT.
 
@@ -511,38 +1962,41 @@ class EmbeddedDevice(XrtDevice):
                 return self.get_memory(v)
         raise RuntimeError("XRT design does not contain PS memory")
 
-    def __init__(self):
+    def __init__(self, fpga_manager_dir=None, firmware_dir=None):
+        """Create the device
+
+        Parameters
+        ----------
+        fpga_manager_dir : str or Path
+            Directory holding the FPGA manager `firmware` and `flags`
+            attributes. Defaults to the paths in BS_FPGA_MAN and
+            BS_FPGA_MAN_FLAGS; tests can point it at a scratch directory.
+        firmware_dir : str or Path
+            Directory the FPGA manager loads .bin files from. Defaults to
+            FIRMWARE_DIR.
+
+        """
         super().__init__(0, "embedded_xrt{}")
+        if fpga_manager_dir is not None:
+            self.BS_FPGA_MAN = str(Path(fpga_manager_dir) / 'firmware')
+            self.BS_FPGA_MAN_FLAGS = str(Path(fpga_manager_dir) / 'flags')
+        self.firmware_dir = FIRMWARE_DIR if firmware_dir is None \
+            else firmware_dir
         self.capabilities['REGISTER_RW'] = False
         self.capabilities['MEMORY_MAPPED'] = True
         self.capabilities['CALLABLE'] = True
+        self._mmap_pool = MmapPool()
 
     def get_memory(self, description):
         return EmbeddedXrtMemory(self, description)
 
     def mmap(self, base_addr, length):
-        import mmap
         euid = os.geteuid()
         if euid != 0:
             raise EnvironmentError('Root permissions required.')
+        return self._mmap_pool.map(base_addr, length)
 
-        # Align the base address with the pages
-        virt_base = base_addr & ~(mmap.PAGESIZE - 1)
-
-        # Calculate base address offset w.r.t the base address
-        virt_offset = base_addr - virt_base
-
-        # Open file and mmap
-        mmap_file = os.open('/dev/mem', os.O_RDWR | os.O_SYNC)
-        mem = mmap.mmap(mmap_file, length + virt_offset,
-                        mmap.MAP_SHARED,
-                        mmap.PROT_READ | mmap.PROT_WRITE,
-                        offset=virt_base)
-        os.close(mmap_file)
-        array = np.frombuffer(mem, np.uint32, length >> 2, virt_offset)
-        return array
-
-    def set_axi_port_width(self, parser):
+    def set_axi_port_width(self, parser, registers=None):
         """This method will set the AXI port width.
 
         This is useful to resolve discrepancy between the PS configurations
@@ -554,54 +2008,68 @@ class EmbeddedDevice(XrtDevice):
 
         Currently only zynq ultrascale devices support data width changes.
 
-        """
-        from pynq.registers import Register
-        if not hasattr(parser, 'ps_name'):
-            # Setting port widths not supported for xclbin-only designs
-            return
-        parameter_dict = parser.ip_dict[parser.ps_name]['parameters']
-        if parser.family_ps == 'zynq_ultra_ps_e':
-            for para in ZU_FPD_SLCR_REG:
-                if para in parameter_dict:
-                    width = parameter_dict[para]
-                    for reg_name in ZU_FPD_SLCR_REG[para]:
-                        addr = ZU_FPD_SLCR_REG[para][reg_name]['addr']
-                        f = ZU_FPD_SLCR_REG[para][reg_name]['field']
-                        Register(addr)[f[0]:f[1]] = ZU_FPD_SLCR_VALUE[width]
-            for para in ZU_AXIFM_REG:
-                if para in parameter_dict:
-                    width = parameter_dict[para]
-                    for reg_name in ZU_AXIFM_REG[para]:
-                        addr = ZU_AXIFM_REG[para][reg_name]['addr']
-                        f = ZU_AXIFM_REG[para][reg_name]['field']
-                        Register(addr)[f[0]:f[1]] = ZU_AXIFM_VALUE[width]
+        The required widths are resolved once per design by
+        `axi_port_width_plan`, and each physical register is read once and
+        only written if it does not already hold the required value.
 
-    def download(self, bitstream, parser=None):
-        if parser is None:
-            from .xclbin_parser import XclBin
-            parser = XclBin(xclbin_data=DEFAULT_XCLBIN)
-
-        if not bitstream.binfile_name:
-            _preload_binfile(bitstream, parser)
-
-        if not bitstream.partial:
-            self.shutdown()
-            flag = 0
-        else:
-            flag = 1
+        Parameters
+        ----------
+        parser : HWH, XclBin or CachedParser
+            Parsed metadata of the design being downloaded.
+        registers : object
+            Register space with `read(address)` and `write(address, value)`.
+            Defaults to the physical registers mapped through /dev/mem.
 
-        with open(self.BS_FPGA_MAN_FLAGS, 'w') as fd:
-            fd.write(str(flag))
-        with open(self.BS_FPGA_MAN, 'w') as fd:
-            fd.write(bitstream.binfile_name)
+        Returns
+        -------
+        list of RegisterUpdate
+            The updates that were written.
 
-        self.set_axi_port_width(parser)
+        """
+        plan = axi_port_width_plan(parser)
+        if not plan:
+            return []
+        if registers is None:
+            registers = PhysicalRegisters(self.mmap)
+        return apply_register_plan(plan, registers)
 
-        self._xrt_download(parser.xclbin_data)
-        super().post_download(bitstream, parser)
+    def download(self, bitstream, parser=None):
+        profiler = download_profiler
+        with profiler.phase('download', bitfile=str(bitstream.bitfile_name),
+                            partial=bool(bitstream.partial)):
+            if parser is None:
+                from .xclbin_parser import XclBin
+                parser = XclBin(xclbin_data=DEFAULT_XCLBIN)
+
+            if not bitstream.binfile_name:
+                with profiler.phase('preload_binfile'):
+                    _preload_binfile(bitstream, parser, self.firmware_dir)
+
+            if not bitstream.partial:
+                with profiler.phase('shutdown'):
+                    self.shutdown()
+                flag = 0
+            else:
+                flag = 1
+
+            with profiler.phase('fpga_manager'):
+                with open(self.BS_FPGA_MAN_FLAGS, 'w') as fd:
+                    fd.write(str(flag))
+                with open(self.BS_FPGA_MAN, 'w') as fd:
+                    fd.write(bitstream.binfile_name)
+
+            with profiler.phase('set_axi_port_width'):
+                self.set_axi_port_width(parser)
+
+            with profiler.phase('xrt_download'):
+                self._xrt_download(parser.xclbin_data)
+            with profiler.phase('post_download'):
+                super().post_download(bitstream, parser)
 
     def get_bitfile_metadata(self, bitfile_name):
-        parser = _get_bitstream_handler(bitfile_name).get_parser()
+        with download_profiler.phase('get_bitfile_metadata',
+                                     bitfile=str(bitfile_name)):
+            parser = _get_bitstream_handler(bitfile_name).get_parser()
         if parser is None:
             raise RuntimeError("Unable to find metadata for bitstream")
         return parser
@@ -0,0 +1,386 @@
+"""XRT视觉内核的缓冲池与流水线执行
+
+Notebook中每张图像都重新allocate输入输出缓冲区，并串行执行
+复制→sync_to_device→krnl.call→sync_from_device→reshape，摄像头、CPU复制
+和内核不能并行。这里提供：
+
+* BufferPool：按(shape, dtype)分组复用的CMA缓冲池
+* KernelPipeline：采集+上传、内核、下载三级线程流水线，统计每级延迟和帧率
+* MockKernel/mock_allocate：无板卡时的模拟内核和缓冲区
+
+典型用法（sobel_accel_1）::
+
+    pipe = KernelPipeline(ol.sobel_accel_1,
+                          inputs=[((h * w,), np.uint8)],
+                          outputs=[((h * w,), np.uint8), ((h * w,), np.uint8)],
+                          scalars=(h, w))
+    for out1, out2 in pipe.run(camera_frames()):
+        ...
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class MockBuffer(np.ndarray):
+    """模拟的CMA缓冲区，提供与pynq.allocate返回值相同的同步方法"""
+
+    def sync_to_device(self):
+        pass
+
+    def sync_from_device(self):
+        pass
+
+    def freebuffer(self):
+        pass
+
+    @property
+    def physical_address(self):
+        return self.__array_interface__["data"][0]
+
+
+def mock_allocate(shape, dtype=np.uint8):
+    """与pynq.allocate接口相同的模拟分配函数"""
+    return np.zeros(shape, dtype=dtype).view(MockBuffer)
+
+
+class MockKernel:
+    """模拟的XRT内核
+
+    call(*args)调用func(*args)并在之前睡眠latency秒以模拟内核执行时间；
+    func负责把结果写入输出缓冲区。
+    """
+
+    def __init__(self, func, latency=0.0):
+        self.func = func
+        self.latency = latency
+        self.calls = 0
+
+    def call(self, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        self.func(*args)
+        self.calls += 1
+
+
+class BufferPool:
+    """按(shape, dtype)分组复用的缓冲池
+
+    CMA分配和释放代价较高，缓冲区用完后通过put放回池中，
+    下次get相同形状和类型时直接复用。
+    """
+
+    def __init__(self, allocator=None):
+        """初始化缓冲池
+
+        参数:
+            allocator: 分配函数allocator(shape, dtype)，None时使用pynq.allocate
+        """
+        if allocator is None:
+            from pynq import allocate
+            allocator = allocate
+        self._allocator = allocator
+        self._free = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    @staticmethod
+    def _key(shape, dtype):
+        return tuple(np.atleast_1d(shape).tolist()), np.dtype(dtype).str
+
+    def get(self, shape, dtype=np.uint8):
+        """取出一个缓冲区（池中没有时新分配）"""
+        key = self._key(shape, dtype)
+        with self._lock:
+            if self._free[key]:
+                self.reused += 1
+                return self._free[key].pop()
+            self.allocated += 1
+        return self._allocator(shape=key[0], dtype=dtype)
+
+    def put(self, buffer):
+        """把缓冲区放回池中"""
+        key = self._key(buffer.shape, buffer.dtype)
+        with self._lock:
+            self._free[key].append(buffer)
+
+    def __len__(self):
+        """池中空闲缓冲区的数量"""
+        with self._lock:
+            return sum(len(v) for v in self._free.values())
+
+    def close(self):
+        """释放池中所有空闲缓冲区"""
+        with self._lock:
+            buffers = [b for v in self._free.values() for b in v]
+            self._free.clear()
+        for b in buffers:
+            if hasattr(b, "freebuffer"):
+                b.freebuffer()
+
+
+_STAGES = ("upload", "kernel", "download")
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class KernelPipeline:
+    """三级流水线执行XRT内核
+
+    1. 采集+上传：从帧源取一帧，写入池中的输入缓冲区并sync_to_device
+    2. 内核：取输出缓冲区，执行kernel.call，输入缓冲区放回池中
+    3. 下载：sync_from_device，用finish生成结果，输出缓冲区放回池中
+
+    各级之间是深度为depth的有界队列，下游变慢时上游自动等待。
+    """
+
+    def __init__(self, kernel, inputs, outputs, scalars=(), args=None,
+                 prepare=None, finish=None, depth=2, pool=None):
+        """初始化流水线
+
+        参数:
+            kernel: 提供call(*args)的内核（如ol.sobel_accel_1）或MockKernel
+            inputs: 输入缓冲区规格列表[(shape, dtype), ...]
+            outputs: 输出缓冲区规格列表[(shape, dtype), ...]
+            scalars: 追加在缓冲区之后的标量参数，或以帧为参数返回标量元组的函数
+            args: 函数args(ins, outs, scalars)，返回kernel.call的参数元组；
+                None时按(*ins, *outs, *scalars)的顺序
+            prepare: 函数prepare(frame, ins)，把帧写入输入缓冲区；
+                None时把帧按元素顺序复制到第一个输入缓冲区
+            finish: 函数finish(outs)，从输出缓冲区生成结果；None时返回各输出的副本。
+                finish返回后输出缓冲区立即被复用，结果不能引用缓冲区本身
+            depth: 级间队列深度
+            pool: BufferPool，None时新建一个（使用pynq.allocate）
+        """
+        self.kernel = kernel
+        self.inputs = [(tuple(np.atleast_1d(s)), np.dtype(d)) for s, d in inputs]
+        self.outputs = [(tuple(np.atleast_1d(s)), np.dtype(d)) for s, d in outputs]
+        self.scalars = scalars
+        self.args = args
+        self.prepare = prepare if prepare is not None else self._copy_in
+        self.finish = finish if finish is not None else \
+            (lambda outs: [np.array(o) for o in outs])
+        self.depth = depth
+        self.pool = pool if pool is not None else BufferPool()
+        self._reset_stats()
+
+    @staticmethod
+    def _copy_in(frame, ins):
+        ins[0].reshape(-1)[:] = np.asarray(frame).reshape(-1)
+
+    def _reset_stats(self):
+        # 每级只保存[次数, 总和, 最大值]，长时间运行时内存不随帧数增长
+        self._latency = {name: [0, 0.0, 0.0] for name in _STAGES + ("total",)}
+        self.frames = 0
+        self._started = None
+        self._stopped = None
+
+    def _call_args(self, ins, outs, frame):
+        scalars = self.scalars(frame) if callable(self.scalars) \
+            else tuple(self.scalars)
+        if self.args is not None:
+            return self.args(ins, outs, scalars)
+        return (*ins, *outs, *scalars)
+
+    def process(self, frame):
+        """串行处理一帧（与Notebook中的做法相同，但缓冲区来自缓冲池）"""
+        ins = [self.pool.get(s, d) for s, d in self.inputs]
+        outs = [self.pool.get(s, d) for s, d in self.outputs]
+        try:
+            self.prepare(frame, ins)
+            for b in ins:
+                b.sync_to_device()
+            self.kernel.call(*self._call_args(ins, outs, frame))
+            for b in outs:
+                b.sync_from_device()
+            return self.finish(outs)
+        finally:
+            for b in ins + outs:
+                self.pool.put(b)
+
+    def _upload(self, source, q_out, stop):
+        try:
+            for frame in source:
+                if stop.is_set():
+                    break
+                t0 = time.perf_counter()
+                ins = [self.pool.get(s, d) for s, d in self.inputs]
+                self.prepare(frame, ins)
+                for b in ins:
+                    b.sync_to_device()
+                t1 = time.perf_counter()
+                q_out.put((ins, frame, t0, {"upload": t1 - t0}))
+        except Exception as e:
+            stop.set()
+            q_out.put(_StageError(e))
+        else:
+            q_out.put(_DONE)
+
+    def _execute(self, item):
+        ins, frame, t0, times = item
+        t1 = time.perf_counter()
+        outs = [self.pool.get(s, d) for s, d in self.outputs]
+        try:
+            self.kernel.call(*self._call_args(ins, outs, frame))
+        except Exception:
+            self._release(outs)
+            raise
+        finally:
+            self._release(ins)
+        times["kernel"] = time.perf_counter() - t1
+        return outs, t0, times
+
+    def _download(self, item):
+        outs, t0, times = item
+        t1 = time.perf_counter()
+        try:
+            for b in outs:
+                b.sync_from_device()
+            result = self.finish(outs)
+        finally:
+            self._release(outs)
+        t2 = time.perf_counter()
+        times["download"] = t2 - t1
+        times["total"] = t2 - t0
+        return result, times
+
+    def _release(self, buffers):
+        for b in buffers:
+            self.pool.put(b)
+
+    def _worker(self, step, q_in, q_out, stop):
+        """流水线中间级：处理q_in中的数据直到收到结束标记
+
+        出错或停止后继续取出上游数据并把缓冲区放回池中（不再处理），
+        保证上游不会阻塞在已满的队列上。
+        """
+        while True:
+            item = q_in.get()
+            if item is _DONE or isinstance(item, _StageError):
+                q_out.put(item)
+                return
+            if stop.is_set():
+                # 各级数据的第一项都是缓冲区列表
+                self._release(item[0])
+                continue
+            try:
+                q_out.put(step(item))
+            except Exception as e:
+                stop.set()
+                q_out.put(_StageError(e))
+
+    @staticmethod
+    def _thread(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True,
+                                  name="KernelPipeline-" + target.__name__)
+        thread.start()
+        return thread
+
+    def run(self, source):
+        """流水线处理帧源中的所有帧
+
+        参数:
+            source: 帧的可迭代对象（如从cv2.VideoCapture读帧的生成器）
+
+        返回:
+            结果生成器，顺序与输入帧一致
+        """
+        self._reset_stats()
+        stop = threading.Event()
+        q1 = queue.Queue(self.depth)
+        q2 = queue.Queue(self.depth)
+        q3 = queue.Queue(self.depth)
+        threads = [self._thread(self._upload, iter(source), q1, stop),
+                   self._thread(self._worker, self._execute, q1, q2, stop),
+                   self._thread(self._worker, self._download, q2, q3, stop)]
+        self._started = time.perf_counter()
+        try:
+            while True:
+                item = q3.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _StageError):
+                    raise item.exc
+                result, times = item
+                for name, value in times.items():
+                    acc = self._latency[name]
+                    acc[0] += 1
+                    acc[1] += value
+                    acc[2] = max(acc[2], value)
+                self.frames += 1
+                yield result
+        finally:
+            self._stopped = time.perf_counter()
+            stop.set()
+            # 停止后中间各级丢弃数据并把缓冲区放回池中，只需排空最后一级的队列
+            while threads[-1].is_alive():
+                try:
+                    q3.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+
+    @property
+    def stats(self):
+        """每级平均/最大延迟（秒）、端到端延迟和帧率"""
+        out = {}
+        for name, (count, total, peak) in self._latency.items():
+            if count:
+                out[name] = {"mean": total / count, "max": peak}
+        if self._started is not None:
+            end = self._stopped if self._stopped is not None \
+                else time.perf_counter()
+            out["fps"] = self.frames / (end - self._started) \
+                if end > self._started else 0.0
+        out["frames"] = self.frames
+        return out
+
+
+def benchmark_pipeline(frames=100, shape=(480, 640), capture_time=0.005,
+                       kernel_time=0.005, depth=2):
+    """用模拟摄像头和模拟内核比较串行与流水线的帧率
+
+    参数:
+        frames: 帧数
+        shape: 灰度图像的(rows, cols)
+        capture_time: 模拟摄像头每帧的采集时间（秒）
+        kernel_time: 模拟内核每帧的执行时间（秒）
+        depth: 流水线级间队列深度
+
+    返回:
+        字典，包含串行和流水线的帧率以及流水线各级统计
+    """
+    rows, cols = shape
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+
+    def camera():
+        for _ in range(frames):
+            time.sleep(capture_time)
+            yield image
+
+    def invert(src, dst, rows, cols):
+        np.subtract(255, src, out=dst)
+
+    pipe = KernelPipeline(MockKernel(invert, kernel_time),
+                          inputs=[((rows * cols,), np.uint8)],
+                          outputs=[((rows * cols,), np.uint8)],
+                          scalars=(rows, cols), depth=depth,
+                          pool=BufferPool(mock_allocate))
+    start = time.perf_counter()
+    for frame in camera():
+        pipe.process(frame)
+    serial_fps = frames / (time.perf_counter() - start)
+
+    for _ in pipe.run(camera()):
+        pass
+    stats = pipe.stats
+    return {"serial_fps": serial_fps, "pipelined_fps": stats["fps"],
+            "stages": stats, "buffers_allocated": pipe.pool.allocated}
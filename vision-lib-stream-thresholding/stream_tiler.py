@@ -0,0 +1,342 @@
+"""把超出内核尺寸上限的大图分块送入stream内核
+
+kern_threshhold（WIDTH 1920, HEIGHT 1080）和resizer-stream（3840x2160）的
+最大帧尺寸在综合时固定，而Notebook一次DMA传输整幅图像，既需要整帧大小的
+CMA缓冲区，也无法处理更大的图像。这里把图像切成带重叠边（halo）的块，
+每块不超过内核上限，通过预先分配、反复使用的DMA缓冲区依次处理，再裁掉
+重叠边拼回整幅图像；有多个内核实例时各块并行处理。
+"""
+
+import collections
+import glob
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+Tile = collections.namedtuple("Tile", ["src", "dst", "crop"])
+Tile.__doc__ = """一个块
+
+src: 输入图像中的(行切片, 列切片)，包含重叠边
+dst: 输出图像中的(行切片, 列切片)，不含重叠边
+crop: 内核输出块中对应dst的(行切片, 列切片)
+"""
+
+
+def _plan_axis(size, limit, halo, scale):
+    """单个维度的分块：返回[(src_start, src_stop, dst_start, dst_stop, crop_start)]"""
+    core = (limit - 2 * halo) // scale * scale
+    if size <= limit:
+        return [(0, size, 0, size // scale, 0)]
+    if core <= 0:
+        raise ValueError("Tile limit {} too small for halo {}".format(limit, halo))
+    spans = []
+    for start in range(0, size, core):
+        stop = min(start + core, size)
+        src_start = max(0, start - halo)
+        src_stop = min(size, stop + halo)
+        spans.append((src_start, src_stop, start // scale, stop // scale,
+                      (start - src_start) // scale))
+    return spans
+
+
+def plan_tiles(shape, max_rows, max_cols, halo=0, scale=1):
+    """计算分块方案
+
+    参数:
+        shape: 输入图像形状(rows, cols, ...)
+        max_rows, max_cols: 内核支持的最大输入尺寸
+        halo: 重叠边宽度（像素），不小于内核的邻域半径；scale>1时必须是scale的倍数
+        scale: 整数缩小倍数（resize内核），1表示输入输出同尺寸
+
+    返回:
+        Tile列表
+    """
+    rows, cols = shape[:2]
+    if halo % scale:
+        raise ValueError("halo must be a multiple of scale")
+    if rows % scale or cols % scale:
+        raise ValueError("Image size must be a multiple of scale")
+    tiles = []
+    for r0, r1, dr0, dr1, cr in _plan_axis(rows, max_rows, halo, scale):
+        for c0, c1, dc0, dc1, cc in _plan_axis(cols, max_cols, halo, scale):
+            tiles.append(Tile((slice(r0, r1), slice(c0, c1)),
+                              (slice(dr0, dr1), slice(dc0, dc1)),
+                              (slice(cr, cr + dr1 - dr0),
+                               slice(cc, cc + dc1 - dc0))))
+    return tiles
+
+
+class DMAStreamRunner:
+    """通过一个DMA和一个stream内核实例处理单个块
+
+    输入输出DMA缓冲区按内核最大尺寸分配一次，每块只传输实际字节数。
+    每块只设置ap_start（不设auto_restart），等内核空闲后才为下一块
+    设置尺寸寄存器，否则内核会以上一块的尺寸重新启动，尺寸不同的
+    边缘块会使DMA挂起或输出错位。
+    """
+
+    def __init__(self, dma, ip, max_rows, max_cols, channels=3, scale=1,
+                 configure=None, allocator=None, timeout=1.0):
+        """初始化
+
+        参数:
+            dma: 内核所连接的axi_dma
+            ip: 内核IP（如colorthresholding_ac_0、resize_accel_0）
+            max_rows, max_cols: 内核支持的最大输入尺寸
+            channels: 每像素通道数
+            scale: 整数缩小倍数
+            configure: 函数configure(ip, src_shape, dst_shape)，每块传输前设置
+                尺寸寄存器；阈值等不随块变化的寄存器应事先设置好
+            allocator: 缓冲区分配函数，None时使用pynq.allocate
+            timeout: 传输完成后等待内核ap_done/ap_idle的最长时间（秒）
+        """
+        if allocator is None:
+            from pynq import allocate
+            allocator = allocate
+        self.dma = dma
+        self.ip = ip
+        self.channels = channels
+        self.scale = scale
+        self.configure = configure
+        self.timeout = timeout
+        self.in_buffer = allocator(shape=(max_rows * max_cols * channels,),
+                                   dtype=np.uint8)
+        self.out_buffer = allocator(
+            shape=((max_rows // scale) * (max_cols // scale) * channels,),
+            dtype=np.uint8)
+
+    def __call__(self, tile):
+        rows, cols = tile.shape[:2]
+        out_rows, out_cols = rows // self.scale, cols // self.scale
+        n_in = tile.size
+        n_out = out_rows * out_cols * self.channels
+        self.in_buffer[:n_in] = tile.reshape(-1)
+        self.in_buffer.sync_to_device()
+        if self.configure is not None:
+            self.configure(self.ip, (rows, cols), (out_rows, out_cols))
+        self.dma.sendchannel.transfer(self.in_buffer, nbytes=n_in)
+        self.dma.recvchannel.transfer(self.out_buffer, nbytes=n_out)
+        self.ip.write(0x00, 0x01)  # ap_start
+        self.dma.sendchannel.wait()
+        self.dma.recvchannel.wait()
+        self._wait_idle()
+        self.out_buffer.sync_from_device()
+        return self.out_buffer[:n_out].reshape(out_rows, out_cols,
+                                               self.channels)
+
+    def _wait_idle(self):
+        """等待控制寄存器的ap_done（第1位）或ap_idle（第2位）"""
+        deadline = time.perf_counter() + self.timeout
+        while not self.ip.read(0x00) & 0x06:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("Stream kernel did not finish the tile")
+
+    def close(self):
+        for buffer in (self.in_buffer, self.out_buffer):
+            if hasattr(buffer, "freebuffer"):
+                buffer.freebuffer()
+
+
+class SoftwareRunner:
+    """用软件函数处理单个块，用于无板卡测试和作为参考"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, tile):
+        return self.func(tile)
+
+
+class TiledProcessor:
+    """分块处理大图像"""
+
+    def __init__(self, runners, max_rows, max_cols, halo=0, scale=1):
+        """初始化
+
+        参数:
+            runners: 处理单块的对象列表（DMAStreamRunner或SoftwareRunner），
+                每个对应一个内核实例，各块在这些实例上并行处理
+            max_rows, max_cols: 内核支持的最大输入尺寸
+            halo: 重叠边宽度（像素）
+            scale: 整数缩小倍数
+        """
+        if callable(runners):
+            runners = [runners]
+        self.runners = list(runners)
+        self.max_rows = max_rows
+        self.max_cols = max_cols
+        self.halo = halo
+        self.scale = scale
+
+    def process(self, image, out=None):
+        """处理整幅图像
+
+        参数:
+            image: 输入图像（rows, cols, channels）
+            out: 预分配的输出数组，None时新建
+
+        返回:
+            拼接后的输出图像
+        """
+        image = np.asarray(image)
+        tiles = plan_tiles(image.shape, self.max_rows, self.max_cols,
+                           self.halo, self.scale)
+        if out is None:
+            out = np.empty((image.shape[0] // self.scale,
+                            image.shape[1] // self.scale) + image.shape[2:],
+                           dtype=image.dtype)
+        if len(self.runners) == 1:
+            for tile in tiles:
+                self._run(self.runners[0], image, out, tile)
+            return out
+
+        pending = queue.Queue()
+        for tile in tiles:
+            pending.put(tile)
+        errors = []
+
+        def worker(runner):
+            while not errors:
+                try:
+                    tile = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._run(runner, image, out, tile)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(r,), daemon=True)
+                   for r in self.runners]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return out
+
+    @staticmethod
+    def _run(runner, image, out, tile):
+        # 块在内存中必须连续，才能作为一段DMA数据传输
+        result = runner(np.ascontiguousarray(image[tile.src]))
+        out[tile.dst] = result[tile.crop].reshape(out[tile.dst].shape)
+
+
+def threshold_reference(lower, upper):
+    """colorthresholding内核的软件参考
+
+    像素的三个通道同时落在任一颜色的[lower, upper]范围内时输出255，
+    否则输出0（三个输出通道相同）。lower和upper为长度3*颜色数的数组。
+
+    返回:
+        处理单幅图像（或单个块）的函数
+    """
+    lower = np.asarray(lower, dtype=np.uint8).reshape(-1, 3)
+    upper = np.asarray(upper, dtype=np.uint8).reshape(-1, 3)
+
+    def func(image):
+        px = image[..., np.newaxis, :]
+        hit = ((px >= lower) & (px <= upper)).all(axis=-1).any(axis=-1)
+        out = np.where(hit, np.uint8(255), np.uint8(0))
+        return np.repeat(out[..., np.newaxis], image.shape[-1], axis=-1)
+    return func
+
+
+def resize_reference(factor):
+    """按整数倍缩小的双线性插值软件参考（像素中心对齐）
+
+    返回:
+        处理单幅图像（或单个块）的函数
+    """
+    def axis(n):
+        pos = (np.arange(n // factor) + 0.5) * factor - 0.5
+        lo = np.clip(np.floor(pos).astype(int), 0, n - 1)
+        hi = np.clip(lo + 1, 0, n - 1)
+        return lo, hi, (pos - np.floor(pos))[:, np.newaxis]
+
+    def func(image):
+        image = image.astype(np.float32)
+        r0, r1, fr = axis(image.shape[0])
+        c0, c1, fc = axis(image.shape[1])
+        fr = fr[..., np.newaxis]
+        rows = image[r0] * (1 - fr) + image[r1] * fr
+        out = rows[:, c0] * (1 - fc) + rows[:, c1] * fc
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+    return func
+
+
+def verify_tiling(image, reference, max_rows, max_cols, halo=0, scale=1,
+                  runners=None):
+    """比较分块处理与整幅图像软件参考的结果
+
+    参数:
+        image: 输入图像
+        reference: 整幅图像的软件参考函数
+        runners: 分块处理用的runner列表，None时用reference本身做分块处理
+            （只检验分块与拼接）；传入DMAStreamRunner时检验硬件结果
+
+    返回:
+        最大绝对误差
+    """
+    if runners is None:
+        runners = [SoftwareRunner(reference)]
+    tiled = TiledProcessor(runners, max_rows, max_cols, halo, scale)
+    result = tiled.process(image)
+    expected = reference(image)
+    return int(np.abs(result.astype(int) - expected.astype(int)).max())
+
+
+def verify_samples(root=None, max_rows=1080, max_cols=1920):
+    """在仓库中的sahara*.jpg示例图像上检验分块处理
+
+    分别检验阈值（逐像素，无重叠边）和2倍缩小（双线性，重叠边为2）。
+
+    返回:
+        字典，(文件名, 处理) -> 最大绝对误差
+    """
+    from PIL import Image
+
+    if root is None:
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    lower = [136, 87, 111, 25, 52, 72, 94, 80, 2]
+    upper = [180, 255, 255, 102, 255, 255, 120, 255, 255]
+    results = {}
+    for path in sorted(glob.glob(os.path.join(root, "*", "image", "sahara*.jpg"))):
+        image = np.array(Image.open(path).convert("RGB"))
+        name = os.path.relpath(path, root)
+        results[name, "threshold"] = verify_tiling(
+            image, threshold_reference(lower, upper), max_rows, max_cols)
+        results[name, "resize"] = verify_tiling(
+            image, resize_reference(2), max_rows, max_cols, halo=2, scale=2)
+    return results
+
+
+def benchmark_tiler(shape=(2160, 3840, 3), max_rows=1080, max_cols=1920,
+                    instances=(1, 2, 4), tile_time=0.02):
+    """比较不同内核实例数时分块处理整幅图像的耗时
+
+    每个模拟内核实例处理一块的时间为tile_time（秒，模拟DMA传输和内核执行，
+    期间释放GIL），输出与输入相同。
+
+    返回:
+        列表，每项为(实例数, 每幅图像耗时秒)
+    """
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+
+    def kernel(tile):
+        time.sleep(tile_time)
+        return tile
+
+    results = []
+    for n in instances:
+        tiled = TiledProcessor([SoftwareRunner(kernel) for _ in range(n)],
+                               max_rows // 2, max_cols // 2)
+        start = time.perf_counter()
+        tiled.process(image)
+        results.append((n, time.perf_counter() - start))
+    return results
@@ -0,0 +1,337 @@
+"""XADC高速采样服务
+
+每次扫描（sweep）用一次块读取取出所有已使能的序列器通道的结果寄存器，
+再以向量化方式换算为电压；后台线程按设定速率采样到环形缓冲区，
+并提供最小/最大/平均值统计和抽取后的数据流。
+
+寄存器定义见PG019（XADC Wizard）和xsysmon_hw.h。
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+XADC_SRR_OFFSET = 0x00          # 软件复位寄存器
+XADC_SR_OFFSET = 0x04           # 状态寄存器
+XADC_TEMP_OFFSET = 0x200        # 温度
+XADC_VCCINT_OFFSET = 0x204
+XADC_VCCAUX_OFFSET = 0x208
+XADC_VPVN_OFFSET = 0x20C
+XADC_VREFP_OFFSET = 0x210
+XADC_VREFN_OFFSET = 0x214
+XADC_VBRAM_OFFSET = 0x218
+XADC_VCCPINT_OFFSET = 0x234     # Zynq PS供电
+XADC_VCCPAUX_OFFSET = 0x238
+XADC_VCCO_DDR_OFFSET = 0x23C
+XADC_AUX00_OFFSET = 0x240       # VAUXP0/VAUXN0，之后每个通道递增4
+XADC_SEQ00_OFFSET = 0x320       # 序列器通道选择（片上通道）
+XADC_SEQ01_OFFSET = 0x324       # 序列器通道选择（VAUX0~15）
+XADC_REG_SPACE = 0x400
+
+# SEQ00中各位对应的片上通道
+_SEQ00_CHANNELS = {5: "vccpint", 6: "vccpaux", 7: "vccoddr", 8: "temp",
+                   9: "vccint", 10: "vccaux", 11: "vpvn", 12: "vrefp",
+                   13: "vrefn", 14: "vbram"}
+# SEQ00第0位使能校准，没有结果寄存器
+_SEQ00_CALIBRATION = 1 << 0
+_CHANNEL_OFFSETS = {"temp": XADC_TEMP_OFFSET, "vccint": XADC_VCCINT_OFFSET,
+                    "vccaux": XADC_VCCAUX_OFFSET, "vpvn": XADC_VPVN_OFFSET,
+                    "vrefp": XADC_VREFP_OFFSET, "vrefn": XADC_VREFN_OFFSET,
+                    "vbram": XADC_VBRAM_OFFSET,
+                    "vccpint": XADC_VCCPINT_OFFSET,
+                    "vccpaux": XADC_VCCPAUX_OFFSET,
+                    "vccoddr": XADC_VCCO_DDR_OFFSET}
+_CHANNEL_OFFSETS.update({"aux{}".format(i): XADC_AUX00_OFFSET + 4 * i
+                         for i in range(16)})
+
+
+def channel_offset(name):
+    """通道名（temp、vccint、aux0~aux15等）对应的结果寄存器偏移"""
+    try:
+        return _CHANNEL_OFFSETS[name]
+    except KeyError:
+        raise ValueError("Unknown XADC channel {}".format(name)) from None
+
+
+class SimulatedXADC:
+    """模拟的XADC寄存器空间，用于无硬件测试
+
+    提供与pynq.MMIO相同的read、write和array。每次调用convst
+    （对应硬件上CONVST引脚的一个脉冲）按signals更新一次结果寄存器。
+    """
+
+    def __init__(self, signals=None, channels=("aux0", "aux1")):
+        """初始化
+
+        参数:
+            signals: 字典，通道名 -> 函数f(t)，返回该通道在t秒时的原始16位码值；
+                None时每个通道输出一个不同频率的正弦波
+            channels: 序列器使能的通道
+        """
+        self.array = np.zeros(XADC_REG_SPACE // 4, dtype=np.uint32)
+        if signals is None:
+            signals = {name: (lambda t, f=i + 1:
+                              32768 + 30000 * np.sin(2 * np.pi * f * t))
+                       for i, name in enumerate(channels)}
+        self.signals = signals
+        seq0 = sum(1 << bit for bit, name in _SEQ00_CHANNELS.items()
+                   if name in channels)
+        seq1 = sum(1 << i for i in range(16) if "aux{}".format(i) in channels)
+        self.write(XADC_SEQ00_OFFSET, seq0)
+        self.write(XADC_SEQ01_OFFSET, seq1)
+        self._start = time.perf_counter()
+        self.conversions = 0
+
+    def read(self, offset=0, length=4):
+        # 与pynq.MMIO.read相同的参数检查
+        if length not in (1, 2, 4, 8):
+            raise ValueError("MMIO currently only supports 1, 2, 4 and 8-byte reads.")
+        if offset < 0:
+            raise ValueError("Offset cannot be negative.")
+        if offset % 4:
+            raise MemoryError("Unaligned read: offset must be multiple of 4.")
+        return int(self.array[offset >> 2])
+
+    def write(self, offset, value):
+        self.array[offset >> 2] = value
+
+    def convst(self):
+        """执行一次序列转换"""
+        t = time.perf_counter() - self._start
+        for name, f in self.signals.items():
+            # 结果寄存器中12位转换值按MSB对齐存放在低16位
+            code = int(np.clip(f(t), 0, 0xFFFF)) & 0xFFF0
+            self.write(channel_offset(name), code)
+        self.conversions += 1
+
+
+class XADCSampler:
+    """XADC多通道采样器"""
+
+    def __init__(self, mmio, channels=None, rate=1000.0, capacity=100_000,
+                 trigger=None, aux_scale=3.0):
+        """初始化采样器
+
+        参数:
+            mmio: XADC的MMIO（覆盖整个寄存器空间）或SimulatedXADC
+            channels: 通道名列表，None时读取序列器通道选择寄存器
+            rate: 后台采样速率（次扫描/秒）
+            capacity: 环形缓冲区保存的扫描次数
+            trigger: 每次扫描前调用的函数，事件定时模式下用于产生CONVST脉冲
+            aux_scale: 外部通道的满量程电压，换算为raw*aux_scale/65535，与
+                Notebook中的raw*3.0/65535一致（XADC本身的单极性满量程为1.0 V）；
+                片上温度和电源通道按UG480的传递函数除以65536
+        """
+        self.mmio = mmio
+        self.channels = list(channels) if channels is not None \
+            else self.sequencer_channels()
+        if not self.channels:
+            raise ValueError("No XADC channels enabled")
+        self.rate = rate
+        self.trigger = trigger
+        offsets = np.array([channel_offset(c) for c in self.channels])
+        # 一次块读取覆盖所有通道结果寄存器的最小连续范围
+        self._lo = offsets.min() >> 2
+        self._hi = (offsets.max() >> 2) + 1
+        self._index = (offsets >> 2) - self._lo
+        self._scale = np.array(
+            [503.975 / 65536 if c == "temp" else
+             aux_scale / 65535 if c.startswith("aux") else 3.0 / 65536
+             for c in self.channels])
+        self._bias = np.array([-273.15 if c == "temp" else 0.0
+                               for c in self.channels])
+        self.capacity = capacity
+        # 环形缓冲区保存整个块读取范围的原始值，读出时再选列和换算
+        self._raw = np.zeros((capacity, self._hi - self._lo), dtype=np.uint32)
+        self._times = np.zeros(capacity)
+        self._head = 0
+        self.total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.overruns = 0
+        self._started = None
+        self._stopped = None
+
+    def sequencer_channels(self):
+        """读取序列器通道选择寄存器，返回已使能的通道名列表"""
+        seq0 = self.mmio.read(XADC_SEQ00_OFFSET)
+        known = _SEQ00_CALIBRATION | sum(1 << bit for bit in _SEQ00_CHANNELS)
+        if seq0 & 0xFFFF & ~known:
+            raise ValueError("Unsupported XADC sequencer channels in SEQ00: "
+                             "0x{:04X}".format(seq0 & 0xFFFF & ~known))
+        seq1 = self.mmio.read(XADC_SEQ01_OFFSET)
+        return [name for bit, name in sorted(_SEQ00_CHANNELS.items())
+                if seq0 >> bit & 1] + \
+            ["aux{}".format(i) for i in range(16) if seq1 >> i & 1]
+
+    def read_block(self, out=None):
+        """一次块读取覆盖所有通道结果寄存器的连续范围
+
+        参数:
+            out: 预分配的uint32数组，None时返回新数组
+        """
+        if self.trigger is not None:
+            self.trigger()
+        block = self.mmio.array[self._lo:self._hi]
+        if out is None:
+            return block.copy()
+        out[:] = block
+        return out
+
+    def to_volts(self, blocks):
+        """把read_block得到的原始块（一维或二维）换算为电压（温度通道为摄氏度）
+
+        返回:
+            最后一维为通道的数组，顺序与channels一致
+        """
+        raw = blocks[..., self._index] & 0xFFFF
+        return raw * self._scale + self._bias
+
+    def sweep(self):
+        """采样一次所有通道
+
+        返回:
+            数组，顺序与channels一致
+        """
+        return self.to_volts(self.read_block())
+
+    def _capture(self):
+        """采样一次并写入环形缓冲区（只做块复制，不换算）"""
+        if self.trigger is not None:
+            self.trigger()
+        # 在锁内写入，latest不会读到新旧通道混杂的一行
+        with self._lock:
+            i = self._head
+            self._raw[i] = self.mmio.array[self._lo:self._hi]
+            self._times[i] = time.perf_counter()
+            self._head = (i + 1) % self.capacity
+            self.total += 1
+
+    def start(self):
+        """启动后台采样线程"""
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("XADC sampler is already running")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="XADCSampler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        period = 1.0 / self.rate
+        self._started = time.perf_counter()
+        self._stopped = None
+        deadline = self._started
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if deadline > now:
+                time.sleep(deadline - now)
+            self._capture()
+            deadline += period
+            # 落后超过一个周期时不补采，重新对齐
+            now = time.perf_counter()
+            if now - deadline > period:
+                self.overruns += 1
+                deadline = now
+        self._stopped = time.perf_counter()
+
+    def latest(self, n=None):
+        """最近n次扫描（默认全部）
+
+        返回:
+            (时间戳数组, 形状为(n, 通道数)的数值数组)，均为副本
+        """
+        with self._lock:
+            count = min(self.total, self.capacity)
+            n = count if n is None else min(n, count)
+            index = np.arange(self._head - n, self._head) % self.capacity
+            times = self._times[index]
+            raw = self._raw[index]
+        return times, self.to_volts(raw)
+
+    def stats(self, n=None):
+        """最近n次扫描中每个通道的最小、最大和平均值
+
+        返回:
+            字典，通道名 -> {"min", "max", "mean"}
+        """
+        _, values = self.latest(n)
+        if not len(values):
+            return {}
+        lo, hi, mean = values.min(axis=0), values.max(axis=0), values.mean(axis=0)
+        return {c: {"min": lo[i], "max": hi[i], "mean": mean[i]}
+                for i, c in enumerate(self.channels)}
+
+    def decimated(self, max_points=1000, n=None):
+        """按min/max抽取到不超过max_points个点的数据流
+
+        每个桶输出该桶的最小值和最大值（各通道独立），时间戳取桶的起止时间。
+
+        返回:
+            (时间戳数组, 数值数组)
+        """
+        times, values = self.latest(n)
+        buckets = max_points // 2
+        if len(values) <= max_points or buckets == 0:
+            return times, values
+        size = len(values) // buckets
+        start = len(values) - buckets * size
+        v = values[start:].reshape(buckets, size, -1)
+        t = times[start:].reshape(buckets, size)
+        out_v = np.empty((2 * buckets, values.shape[1]))
+        out_v[0::2] = v.min(axis=1)
+        out_v[1::2] = v.max(axis=1)
+        out_t = np.empty(2 * buckets)
+        out_t[0::2] = t[:, 0]
+        out_t[1::2] = t[:, -1]
+        return out_t, out_v
+
+    @property
+    def achieved_rate(self):
+        if self._started is None:
+            return 0.0
+        end = self._stopped if self._stopped is not None else time.perf_counter()
+        return self.total / (end - self._started) if end > self._started else 0.0
+
+
+def benchmark_sampler(mmio=None, channels=("aux0", "aux1"), sweeps=10_000):
+    """比较块读取与逐通道读取的采样速度（不限速）
+
+    逐通道读取按Notebook的做法：每个通道调用一次read并在Python中换算电压；
+    块读取使用采样线程的方式：每次扫描一次块复制到环形缓冲区，最后一次性
+    向量化换算。
+
+    参数:
+        mmio: XADC的MMIO，None时使用SimulatedXADC
+        channels: 采样的通道
+        sweeps: 扫描次数
+
+    返回:
+        字典，两种方式每秒的样本数（通道数×扫描次数/秒）
+    """
+    if mmio is None:
+        mmio = SimulatedXADC(channels=channels)
+    offsets = [channel_offset(c) for c in channels]
+    start = time.perf_counter()
+    for _ in range(sweeps):
+        [mmio.read(off) * 3.0 / 65535 for off in offsets]
+    per_read = time.perf_counter() - start
+
+    sampler = XADCSampler(mmio, channels, capacity=sweeps)
+    start = time.perf_counter()
+    for _ in range(sweeps):
+        sampler._capture()
+    sampler.latest()
+    block = time.perf_counter() - start
+
+    samples = sweeps * len(channels)
+    return {"per_read_samples_per_second": samples / per_read,
+            "block_samples_per_second": samples / block}
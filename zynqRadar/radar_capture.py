@@ -0,0 +1,298 @@
+"""zynqRadar连续双缓冲采集流水线
+
+生产者线程循环地从预分配的缓冲池中取出空闲缓冲区并执行dma.read，
+采集到的帧以只读视图（零拷贝）分发给各个消费者（UDP发送、录制、可视化）。
+每个消费者有独立的有界队列：队列满时按策略丢弃最旧的帧（drop）或让
+生产者等待（block，即背压）。帧在所有消费者release之后才回到缓冲池。
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class FakeRadarDMA:
+    """模拟的雷达DMA，用于无硬件测试
+
+    与Notebook中的dma.read(buf, length)约定一致。每帧前4个字节为递增的帧
+    计数（小端），其余字节为计数的低8位；rate不为None时按该帧速率限速。
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.count = 0
+        self._next = None
+
+    def read(self, buf, length):
+        if self.rate is not None:
+            now = time.perf_counter()
+            if self._next is None:
+                self._next = now
+            if self._next > now:
+                time.sleep(self._next - now)
+            self._next += 1.0 / self.rate
+        buf[:length] = self.count & 0xFF
+        buf[:4] = np.frombuffer(np.uint32(self.count).tobytes(), dtype=np.uint8)
+        self.count += 1
+        return length
+
+
+class Frame:
+    """一帧采集数据
+
+    data为缓冲池中缓冲区的只读视图，使用完毕后必须调用release（或使用with语句），
+    否则缓冲区不会回到缓冲池。
+    """
+
+    __slots__ = ("index", "timestamp", "data", "_buffer", "_pipeline", "_refs")
+
+    def __init__(self, pipeline, buffer, index, timestamp, refs):
+        self._pipeline = pipeline
+        self._buffer = buffer
+        self.index = index
+        self.timestamp = timestamp
+        self.data = buffer.view()
+        self.data.flags.writeable = False
+        self._refs = refs
+
+    def release(self):
+        """释放该消费者对帧的引用"""
+        self._pipeline._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Consumer:
+    """采集流水线的一个消费者（通过CapturePipeline.subscribe创建）"""
+
+    def __init__(self, pipeline, name, depth, policy):
+        if policy not in ("drop", "block"):
+            raise ValueError("policy must be 'drop' or 'block'")
+        self.name = name
+        self.depth = depth
+        self.policy = policy
+        self.received = 0
+        self.dropped = 0
+        self._pipeline = pipeline
+        self._queue = collections.deque()
+        self._cond = threading.Condition(pipeline._lock)
+
+    def get(self, timeout=None):
+        """取出下一帧
+
+        返回:
+            Frame，超时或流水线已停止且队列为空时返回None
+        """
+        stopped = self._pipeline._stop
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self._queue or stopped.is_set(), timeout):
+                return None
+            if not self._queue:
+                return None
+            frame = self._queue.popleft()
+            self.received += 1
+            # 唤醒因背压而等待的生产者
+            self._pipeline._space.notify_all()
+            return frame
+
+    def __iter__(self):
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    def __len__(self):
+        return len(self._queue)
+
+    def close(self):
+        """取消订阅并释放队列中尚未取出的帧"""
+        self._pipeline.unsubscribe(self)
+
+
+class CapturePipeline:
+    """连续采集流水线
+
+    缓冲区数量应不少于各消费者队列深度之和加一，否则缓冲区被消费者占满时
+    生产者只能等待，等待的次数计入overruns。
+    """
+
+    def __init__(self, dma, frame_length=2048, buffers=8, allocator=None):
+        """初始化采集流水线
+
+        参数:
+            dma: 提供read(buf, length)的DMA对象（硬件DMA或FakeRadarDMA）
+            frame_length: 每帧字节数
+            buffers: 预分配的缓冲区数量
+            allocator: 缓冲区分配函数，调用方式为allocator(shape, dtype)，
+                在板上可传入pynq.allocate以获得物理连续的缓冲区
+        """
+        if allocator is None:
+            allocator = lambda shape, dtype: np.zeros(shape, dtype=dtype)
+        self.dma = dma
+        self.frame_length = frame_length
+        self._buffers = [allocator(frame_length, np.uint8)
+                         for _ in range(buffers)]
+        self._free = collections.deque(self._buffers)
+        self._lock = threading.RLock()
+        self._space = threading.Condition(self._lock)
+        self._consumers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.frames_captured = 0
+        self.overruns = 0
+        self._started = None
+        self._stopped = None
+
+    def subscribe(self, name, depth=4, policy="drop"):
+        """添加消费者
+
+        参数:
+            name: 消费者名称（用于统计）
+            depth: 队列深度
+            policy: 队列满时的策略，"drop"丢弃最旧的帧，"block"让生产者等待
+
+        返回:
+            Consumer
+        """
+        consumer = Consumer(self, name, depth, policy)
+        with self._lock:
+            self._consumers.append(consumer)
+        return consumer
+
+    def unsubscribe(self, consumer):
+        with self._lock:
+            if consumer in self._consumers:
+                self._consumers.remove(consumer)
+            while consumer._queue:
+                self._release(consumer._queue.popleft())
+            consumer._cond.notify_all()
+            self._space.notify_all()
+
+    def start(self):
+        """启动生产者线程"""
+        if self.is_running:
+            raise RuntimeError("Capture pipeline is already running")
+        self._stop.clear()
+        self._reset_stats()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="CapturePipeline")
+        self._thread.start()
+
+    def stop(self):
+        """停止采集并等待生产者线程退出（队列中的帧仍可取出）"""
+        self._stop.set()
+        with self._lock:
+            self._space.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for consumer in self._consumers:
+                consumer._cond.notify_all()
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() \
+            and not self._stop.is_set()
+
+    def _acquire(self):
+        with self._lock:
+            if not self._free:
+                self.overruns += 1
+                self._space.wait_for(
+                    lambda: self._free or self._stop.is_set())
+            return self._free.popleft() if self._free else None
+
+    def _release(self, frame):
+        with self._lock:
+            frame._refs -= 1
+            if frame._refs == 0:
+                self._free.append(frame._buffer)
+                self._space.notify_all()
+
+    def _publish(self, buffer):
+        with self._lock:
+            consumers = list(self._consumers)
+            frame = Frame(self, buffer, self.frames_captured,
+                          time.time(), len(consumers) or 1)
+            self.frames_captured += 1
+            if not consumers:
+                self._release(frame)
+                return
+            for consumer in consumers:
+                if len(consumer._queue) >= consumer.depth:
+                    if consumer.policy == "block":
+                        self._space.wait_for(
+                            lambda: len(consumer._queue) < consumer.depth
+                            or consumer not in self._consumers
+                            or self._stop.is_set())
+                    if len(consumer._queue) >= consumer.depth \
+                            or consumer not in self._consumers:
+                        # 丢弃最旧的帧；停止时block消费者丢弃当前帧
+                        if consumer.policy == "drop" and consumer._queue:
+                            self._release(consumer._queue.popleft())
+                        else:
+                            self._release(frame)
+                            consumer.dropped += 1
+                            continue
+                        consumer.dropped += 1
+                consumer._queue.append(frame)
+                consumer._cond.notify()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                buffer = self._acquire()
+                if buffer is None:
+                    break
+                try:
+                    self.dma.read(buffer, self.frame_length)
+                except Exception:
+                    with self._lock:
+                        self._free.append(buffer)
+                    raise
+                self._publish(buffer)
+        finally:
+            self._stopped = time.perf_counter()
+            self._stop.set()
+            with self._lock:
+                for consumer in self._consumers:
+                    consumer._cond.notify_all()
+
+    @property
+    def stats(self):
+        """采集统计信息
+
+        返回:
+            字典，包含采集帧数、采集速率（帧/秒）、缓冲区占用率、
+            生产者等待空闲缓冲区的次数，以及每个消费者的接收数、丢帧数和队列长度
+        """
+        with self._lock:
+            if self._started is None:
+                elapsed = 0.0
+            else:
+                end = self._stopped if self._stopped is not None \
+                    else time.perf_counter()
+                elapsed = end - self._started
+            return {
+                "frames_captured": self.frames_captured,
+                "capture_rate": self.frames_captured / elapsed if elapsed else 0.0,
+                "buffer_occupancy": 1 - len(self._free) / len(self._buffers),
+                "overruns": self.overruns,
+                "consumers": {c.name: {"received": c.received,
+                                       "dropped": c.dropped,
+                                       "queued": len(c._queue)}
+                              for c in self._consumers},
+            }
@@ -0,0 +1,345 @@
+"""zynqRadar的asyncio UDP命令与数据服务器
+
+命令为UTF-8文本数据报，格式为"命令名 参数1 参数2 ..."，例如
+b'start_collect'、b'motor_move H 1 24'。处理函数返回str时原样回复一个
+数据报；返回bytes或numpy数组时作为雷达帧发送：帧被切分为不超过MTU的
+数据报，每个数据报带有FRAME_HEADER（帧序号、帧长度、分片序号、分片总数），
+客户端可以用FrameAssembler重组并统计丢包。
+"""
+
+import asyncio
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# 帧序号、帧总长度（字节）、分片序号、分片总数，网络字节序
+FRAME_HEADER = struct.Struct("!IIHH")
+# 1500字节以太网MTU减去IP头和UDP头
+DEFAULT_MTU = 1472
+
+
+def split_frame(frame_id, data, mtu=DEFAULT_MTU):
+    """将一帧数据切分为带帧头的数据报
+
+    参数:
+        frame_id: 帧序号（32位无符号整数）
+        data: 帧数据（bytes、bytearray、memoryview或numpy数组）
+        mtu: 单个数据报的最大字节数（含帧头）
+
+    返回:
+        数据报列表
+    """
+    payload = mtu - FRAME_HEADER.size
+    if payload <= 0:
+        raise ValueError("MTU too small for frame header")
+    view = memoryview(np.ascontiguousarray(data)).cast("B")
+    count = max(1, -(-len(view) // payload))
+    if count > 0xFFFF:
+        raise ValueError("Frame too large for {} byte datagrams".format(mtu))
+    frame_id &= 0xFFFFFFFF
+    return [FRAME_HEADER.pack(frame_id, len(view), i, count) +
+            view[i * payload:(i + 1) * payload]
+            for i in range(count)]
+
+
+class FrameAssembler:
+    """客户端帧重组器
+
+    按帧序号收集分片，分片齐全时返回完整帧。当更新的帧已经完成时，
+    仍不完整的旧帧被丢弃并计入丢失的分片数；与最新帧序号相差超过
+    max_age的不完整帧也被丢弃，丢包时未完成帧占用的内存有上限。
+    帧序号按32位回绕比较。
+    """
+
+    def __init__(self, max_age=16):
+        """初始化
+
+        参数:
+            max_age: 不完整帧最多保留的帧序号跨度
+        """
+        self._partial = {}
+        self.max_age = max_age
+        self.frames = 0
+        self.datagrams = 0
+        self.lost_datagrams = 0
+        self.lost_frames = 0
+
+    @staticmethod
+    def _age(frame_id, newest):
+        """frame_id落后newest的帧数（32位回绕），frame_id更新时为负数"""
+        delta = (newest - frame_id) & 0xFFFFFFFF
+        return delta - 0x100000000 if delta & 0x80000000 else delta
+
+    def _drop(self, frame_id):
+        _, count, chunks = self._partial.pop(frame_id)
+        self.lost_datagrams += count - len(chunks)
+        self.lost_frames += 1
+
+    def feed(self, datagram):
+        """加入一个数据报
+
+        返回:
+            完整帧的bytes，帧尚未完整时返回None
+        """
+        frame_id, length, index, count = FRAME_HEADER.unpack_from(datagram)
+        self.datagrams += 1
+        entry = self._partial.setdefault(frame_id, [length, count, {}])
+        entry[2][index] = bytes(datagram[FRAME_HEADER.size:])
+        for old in [k for k in self._partial
+                    if abs(self._age(k, frame_id)) > self.max_age]:
+            self._drop(old)
+        if len(entry[2]) < count:
+            return None
+        del self._partial[frame_id]
+        self.frames += 1
+        # 比当前帧更早且仍不完整的帧不会再完成
+        for old in [k for k in self._partial if self._age(k, frame_id) > 0]:
+            self._drop(old)
+        return b"".join(entry[2][i] for i in range(count))[:length]
+
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server._transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server._dispatch(data, addr)
+
+
+class RadarUDPServer:
+    """asyncio UDP命令与数据服务器
+
+    通过command装饰器或register注册命令处理函数。阻塞的处理函数（DMA读、
+    UART、滑台运动等）在线程池中执行，协程处理函数直接在事件循环中执行；
+    每个命令在独立的任务中处理，慢速命令不会阻塞其他客户端。共享同一个
+    lock名称的命令串行执行，例如所有滑台命令共用"motor"。
+    """
+
+    def __init__(self, host="0.0.0.0", port=8888, mtu=DEFAULT_MTU,
+                 max_workers=4):
+        """初始化服务器
+
+        参数:
+            host: 监听地址
+            port: 监听端口
+            mtu: 发送数据报的最大字节数
+            max_workers: 执行阻塞处理函数的线程数
+        """
+        self.host = host
+        self.port = port
+        self.mtu = mtu
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._handlers = {}
+        self._locks = {}
+        self._transport = None
+        self._tasks = set()
+        self._frame_id = 0
+        self.commands_handled = 0
+        self.frames_sent = 0
+        self.datagrams_sent = 0
+
+    def register(self, name, handler, blocking=True, lock=None):
+        """注册命令处理函数
+
+        参数:
+            name: 命令名
+            handler: 处理函数，调用方式为handler(*args)，args为命令中的参数字符串
+            blocking: 是否在线程池中执行（协程函数忽略此参数）
+            lock: 串行执行锁的名称，None表示不串行
+        """
+        self._handlers[name] = (handler, blocking, lock)
+
+    def command(self, name, blocking=True, lock=None):
+        """注册命令处理函数的装饰器"""
+        def decorator(handler):
+            self.register(name, handler, blocking, lock)
+            return handler
+        return decorator
+
+    async def start(self):
+        """绑定端口并开始接收命令"""
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(
+            lambda: _ServerProtocol(self), local_addr=(self.host, self.port))
+        # 端口为0时记录实际绑定的端口
+        self.port = self._transport.get_extra_info("sockname")[1]
+
+    async def serve_forever(self):
+        """启动服务器并一直运行，直到任务被取消"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.close()
+
+    def close(self):
+        """关闭套接字和线程池"""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for task in self._tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def send_frame(self, data, addr):
+        """将一帧数据分片发送给addr"""
+        datagrams = split_frame(self._frame_id, data, self.mtu)
+        self._frame_id += 1
+        for datagram in datagrams:
+            self._transport.sendto(datagram, addr)
+        self.frames_sent += 1
+        self.datagrams_sent += len(datagrams)
+
+    def _dispatch(self, data, addr):
+        task = asyncio.ensure_future(self._handle(data, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, data, addr):
+        try:
+            name, *args = data.decode().split()
+        except (UnicodeDecodeError, ValueError):
+            name, args = None, []
+        if name not in self._handlers:
+            self._reply(b"Unknown command", addr)
+            return
+        handler, blocking, lock = self._handlers[name]
+        if lock is not None:
+            async with self._locks.setdefault(lock, asyncio.Lock()):
+                result = await self._call(handler, blocking, args)
+        else:
+            result = await self._call(handler, blocking, args)
+        self.commands_handled += 1
+        if result is None:
+            return
+        if isinstance(result, str):
+            self._reply(result.encode(), addr)
+        elif hasattr(result, "release"):
+            # 采集流水线的Frame：发送完成后才把缓冲区交还缓冲池
+            try:
+                if self._transport is not None:
+                    self.send_frame(result.data, addr)
+            finally:
+                result.release()
+        elif self._transport is not None:
+            self.send_frame(result, addr)
+
+    async def _call(self, handler, blocking, args):
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                return await handler(*args)
+            if blocking:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, handler, *args)
+            return handler(*args)
+        except Exception as e:
+            return "error: {}".format(e)
+
+    def _reply(self, data, addr):
+        if self._transport is not None:
+            self._transport.sendto(data, addr)
+
+    @property
+    def stats(self):
+        """已处理命令数、已发送帧数和数据报数"""
+        return {"commands_handled": self.commands_handled,
+                "frames_sent": self.frames_sent,
+                "datagrams_sent": self.datagrams_sent}
+
+
+def register_radar_commands(server, uart=None, motor=None, dma=None,
+                            frame_length=2048, consumer=None):
+    """注册演示Notebook中的雷达命令
+
+    控制器沿用Notebook中的约定：uart.write(bytes)、
+    motor.move(axis, direction, steps)、dma.read(buf, size)。
+    给出consumer（radar_capture.CapturePipeline的消费者）时，
+    start_collect从连续采集流水线取帧，不再单独执行dma.read。
+
+    start_collect: 启动雷达并返回一帧采集数据
+    stop_collect: 停止雷达
+    motor_move AXIS DIR STEPS: 滑台运动，AXIS为H或V
+    """
+    @server.command("start_collect", lock="radar")
+    def start_collect():
+        if uart is not None:
+            uart.write(b"sensorStart 0\r\n")
+            time.sleep(0.1)
+        if consumer is not None:
+            return consumer.get(timeout=1.0) or "timeout"
+        if dma is None:
+            return "started"
+        buf = np.zeros(frame_length, dtype=np.uint8)
+        dma.read(buf, frame_length)
+        return buf
+
+    @server.command("stop_collect", lock="radar")
+    def stop_collect():
+        if uart is not None:
+            uart.write(b"sensorStop\r\n")
+            time.sleep(0.1)
+        return "stopped"
+
+    @server.command("motor_move", lock="motor")
+    def motor_move(axis, direction, steps):
+        if axis not in ("H", "V"):
+            raise ValueError("axis must be H or V")
+        if motor is not None:
+            motor.move(axis, int(direction), int(steps))
+        return "moved"
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, assembler, frames):
+        self.assembler = assembler
+        self.frames = frames
+
+    def datagram_received(self, data, addr):
+        if self.assembler.feed(data) is not None:
+            self.frames.put_nowait(None)
+
+
+async def benchmark_loopback(frame_size=65_536, frames=200, mtu=DEFAULT_MTU,
+                             timeout=1.0):
+    """在本机回环上测量帧速率和数据报丢失率
+
+    启动一个服务器，注册返回frame_size字节随机帧的"frame"命令，
+    客户端依次请求frames帧并重组。
+
+    返回:
+        字典，包含每秒帧数、接收到的帧数和数据报丢失率
+    """
+    server = RadarUDPServer("127.0.0.1", 0, mtu=mtu)
+    payload = np.random.default_rng(0).integers(0, 256, frame_size,
+                                                dtype=np.uint8)
+    server.register("frame", lambda: payload, blocking=False)
+    await server.start()
+
+    loop = asyncio.get_running_loop()
+    assembler = FrameAssembler()
+    received = asyncio.Queue()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _ClientProtocol(assembler, received),
+        remote_addr=("127.0.0.1", server.port))
+    start = time.perf_counter()
+    try:
+        for _ in range(frames):
+            transport.sendto(b"frame")
+            try:
+                await asyncio.wait_for(received.get(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        elapsed = time.perf_counter() - start
+    finally:
+        transport.close()
+        server.close()
+    expected = server.datagrams_sent
+    return {"frames_per_second": assembler.frames / elapsed,
+            "frames_received": assembler.frames,
+            "datagram_loss": 1 - assembler.datagrams / expected if expected else 0.0}